@@ -0,0 +1,203 @@
+"""
+Copyright 2020 Siddharth Priya
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""Times every process of the world model on fixed worlds.
+
+`python3 benchmark.py run -o before.json` times each doStep of the six
+processes for every scenario and grid size, `python3 benchmark.py compare
+before.json after.json` reports the phases that got slower.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+import numpy
+
+import world_model as world
+
+PHASES = ['HoleProcess', 'LinkProcess', 'CatalystProcess', 'ProductionProcess', 'DisintegrationProcess',
+          'CycleObserver']
+
+GRID_SIZES = [10, 50, 100, 200, 500]
+
+# H S K weights and disintegration probability of every scenario
+SCENARIOS = {
+    'default': ([9, 90, 1], 0.02),
+    'catalyst_heavy': ([10, 60, 30], 0.02),
+    # catalysts produce many links during warm up and few disintegrate
+    'link_heavy': ([10, 70, 20], 0.002),
+    # square membranes of bonded links around a catalyst, see stampMembranes
+    'membrane': ([9, 90, 1], 0.02),
+}
+
+# side of the grid block holding one membrane
+MEMBRANE_BLOCK = 10
+
+
+def stampMembranes(grid, grid_size: int):
+    """Places a closed ring of bonded links with a catalyst inside in every MEMBRANE_BLOCK block."""
+    for bx in range(0, grid_size - MEMBRANE_BLOCK + 1, MEMBRANE_BLOCK):
+        for by in range(0, grid_size - MEMBRANE_BLOCK + 1, MEMBRANE_BLOCK):
+            lo, hi = 2, MEMBRANE_BLOCK - 3
+            ring = [(x, lo) for x in range(lo, hi)] + [(hi, y) for y in range(lo, hi)] + \
+                   [(x, hi) for x in range(hi, lo, -1)] + [(lo, y) for y in range(hi, lo, -1)]
+            links = [world.Link(world.Point(bx + x, by + y), grid_size) for x, y in ring]
+            for l in links:
+                grid[l.point] = l
+            for l0, l1 in zip(links, links[1:] + links[:1]):
+                l0.addBond(l1)
+                l1.addBond(l0)
+            k = world.Catalyst(world.Point(bx + MEMBRANE_BLOCK // 2, by + MEMBRANE_BLOCK // 2), grid_size)
+            grid[k.point] = k
+
+
+def createWorld(scenario: str, grid_size: int, seed: int, array_grid: bool) -> world.WorldContext:
+    weights, disintegrate_prob = SCENARIOS[scenario]
+    factory = world.WorldFactory(array_grid=array_grid, validation=world.VALIDATION_OFF)
+    grid = factory.createRandomGrid(grid_size, seed, weights=weights)
+    if scenario == 'membrane':
+        stampMembranes(grid, grid_size)
+    hole_process, link_process, catalyst_process, prod_process, disintegrate_process, cycle_observer = \
+        factory.createAllProcesses(grid, seed, disintegrate_prob)
+    return world.WorldContext(max_iter=0, grid=grid, hole_process=hole_process, link_process=link_process,
+                              catalyst_process=catalyst_process, production_process=prod_process,
+                              disintegration_process=disintegrate_process, cycle_observer=cycle_observer,
+                              validation=factory.validation)
+
+
+def timeIterations(ctx: world.WorldContext, exp: world.Experiment, iterations: int) -> Dict[str, List[float]]:
+    """Runs iterations iterations and returns the seconds spent in each phase of every iteration."""
+    times = {phase: [] for phase in PHASES}
+    steps = [(PHASES[0], ctx.hole_process.doStep), (PHASES[1], ctx.link_process.doStep),
+             (PHASES[2], ctx.catalyst_process.doStep), (PHASES[3], ctx.production_process.doStep),
+             (PHASES[4], ctx.disintegration_process.doStep),
+             (PHASES[5], lambda: ctx.cycle_observer.doStep(exp))]
+    for _ in range(iterations):
+        for phase, step in steps:
+            start = time.perf_counter()
+            step()
+            times[phase].append(time.perf_counter() - start)
+        exp.incTime()
+        ctx.iteration += 1
+    return times
+
+
+def summarise(samples: List[float]) -> Dict[str, float]:
+    return {'median': statistics.median(samples), 'mean': statistics.mean(samples), 'min': min(samples)}
+
+
+def runCase(scenario: str, grid_size: int, seed: int, array_grid: bool, warmup: int, iterations: int) -> dict:
+    ctx = createWorld(scenario, grid_size, seed, array_grid)
+    exp = world.AliveDurationExperiment()
+    timeIterations(ctx, exp, warmup)
+    times = timeIterations(ctx, exp, iterations)
+    totals = [sum(step) for step in zip(*times.values())]
+    p = ctx.hole_process
+    return {'scenario': scenario, 'grid_size': grid_size, 'array_grid': array_grid, 'seed': seed,
+            'warmup': warmup, 'iterations': iterations,
+            'elements': {'H': len(p.h_list), 'S': len(p.s_list), 'K': len(p.k_list), 'L': len(p.l_list)},
+            'phases': {phase: summarise(samples) for phase, samples in times.items()},
+            'total': summarise(totals)}
+
+
+def caseKey(case: dict) -> tuple:
+    return case['scenario'], case['grid_size'], case['array_grid']
+
+
+def runBenchmarks(scenarios: List[str], grid_sizes: List[int], array_grids: List[bool], seed: int, warmup: int,
+                  iterations: int) -> dict:
+    cases = []
+    for scenario in scenarios:
+        for grid_size in grid_sizes:
+            for array_grid in array_grids:
+                case = runCase(scenario, grid_size, seed, array_grid, warmup, iterations)
+                print('{0:15} n={1:<4} {2:5} {3:9.4f}s/iter'.format(
+                    scenario, grid_size, 'array' if array_grid else 'dict', case['total']['median']),
+                    file=sys.stderr)
+                cases.append(case)
+    meta = {'python': platform.python_version(), 'numpy': numpy.__version__, 'machine': platform.machine(),
+            'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    return {'meta': meta, 'cases': cases}
+
+
+def compare(before: dict, after: dict, threshold: float) -> List[str]:
+    """Returns a line for every phase whose median got slower by more than threshold (0.1 = 10%)."""
+    old = {caseKey(c): c for c in before['cases']}
+    regressions = []
+    for case in after['cases']:
+        base = old.get(caseKey(case))
+        if base is None:
+            continue
+        for phase in PHASES + ['total']:
+            b = base[phase]['median'] if phase == 'total' else base['phases'][phase]['median']
+            a = case[phase]['median'] if phase == 'total' else case['phases'][phase]['median']
+            ratio = a / b if b > 0 else float('inf')
+            line = '{0:15} n={1:<4} {2:5} {3:22} {4:10.6f} -> {5:10.6f}  x{6:.2f}'.format(
+                case['scenario'], case['grid_size'], 'array' if case['array_grid'] else 'dict', phase, b, a, ratio)
+            print(line)
+            if ratio > 1 + threshold:
+                regressions.append(line)
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the processes of the world model.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='time every process and write the results as JSON')
+    run.add_argument('-o', '--output', help='file to write (default: standard output)')
+    run.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                     help='scenario to run, may be repeated (default: all)')
+    run.add_argument('--size', action='append', type=int, help='grid size, may be repeated (default: %s)' % GRID_SIZES)
+    run.add_argument('--grid', choices=['dict', 'array', 'both'], default='both', help='grid backend')
+    run.add_argument('--seed', type=int, default=1)
+    run.add_argument('--warmup', type=int, default=5, help='iterations run before timing')
+    run.add_argument('--iterations', type=int, default=10, help='iterations timed')
+    cmp = commands.add_parser('compare', help='compare two result files')
+    cmp.add_argument('before')
+    cmp.add_argument('after')
+    cmp.add_argument('--threshold', type=float, default=0.1, help='slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        with open(args.before) as f:
+            before = json.load(f)
+        with open(args.after) as f:
+            after = json.load(f)
+        regressions = compare(before, after, args.threshold)
+        if regressions:
+            print('\n{0} regressions over {1:.0%}:'.format(len(regressions), args.threshold))
+            print('\n'.join(regressions))
+            return 1
+        return 0
+
+    array_grids = {'dict': [False], 'array': [True], 'both': [False, True]}[args.grid]
+    results = runBenchmarks(args.scenario or list(SCENARIOS), args.size or GRID_SIZES, array_grids, args.seed,
+                            args.warmup, args.iterations)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -20,8 +20,10 @@ This is a GUI viewer for Autopoiesis. It uses code grid construction logic from
 https://stackoverflow.com/questions/30023763/how-to-make-an-interactive-2d-grid-in-a-window-in-python
 
 """
-import math
-import time
+import argparse
+from typing import Callable, Optional
+
+import numpy
 from tkinter import *
 
 import helper
@@ -29,6 +31,14 @@ import world_model as world
 import world_presenter as presenter
 import world_viewer as viewer
 
+# largest width of the canvas in pixels, cells shrink to fit bigger worlds
+CANVAS_SIZE = 800
+MIN_CELL_SIZE = 2
+# smallest cells that still show their letter
+TEXT_CELL_SIZE = 14
+# milliseconds between two iterations
+DELAY_MS = 1000
+
 
 class Cell():
     FILLED_COLOR_BG = "green"
@@ -49,6 +59,10 @@ class Cell():
         self.ord = y
         self.size = size
         self.fill = False
+        # canvas items, made once by draw and then only reconfigured
+        self._rect = None
+        self._text = None
+        self._style = None
 
     def _switch(self):
         """ Switch if the cell is filled or not. """
@@ -69,46 +83,44 @@ class Cell():
             ymin = self.ord * self.size
             ymax = ymin + self.size
 
-            self.master.create_rectangle(xmin, ymin, xmax, ymax, fill=fill, outline=outline)
+            self._rect = self.master.create_rectangle(xmin, ymin, xmax, ymax, fill=fill, outline=outline)
+            if self.size >= TEXT_CELL_SIZE:
+                self._text = self.master.create_text(int((xmin + xmax) / 2), int((ymin + ymax) / 2), text='')
+
+    def setStyle(self, fill: str, ch: str):
+        """ recolours the items of the cell, the canvas is only touched if the style changed """
+        if self.master != None and (fill, ch) != self._style:
+            self._style = (fill, ch)
+            self.master.itemconfigure(self._rect, fill=fill)
+            if self._text is not None:
+                self.master.itemconfigure(self._text, text=ch)
+
+
+# fill and letter of a cell by type code * 3 + number of bonds, see cellKeys
+CELL_STYLES = {
+    world.EMPTY * 3: (Cell.EMPTY_COLOR_BG, ''),
+    world.HOLE * 3: (Cell.EMPTY_COLOR_BG, 'H'),
+    world.SUBSTRATE * 3: (Cell.SUBSTRATE, 'S'),
+    world.CATALYST * 3: (Cell.CATALYST, 'K'),
+    world.LINK * 3: (Cell.LINK_FREE, 'L'),
+    world.LINK * 3 + 1: (Cell.LINK_SINGLE, 'b'),
+    world.LINK * 3 + 2: (Cell.LINK_DOUBLE, 'B'),
+}
+
+
+def cellKeys(sim_grid: [world.Point, world.T]) -> numpy.ndarray:
+    """Returns type code * 3 + number of bonds of every cell in row major order."""
+    keys = world.getTypeCodes(sim_grid).astype(numpy.int16) * 3
+    links = keys == world.LINK * 3
+    if isinstance(sim_grid, world.ArrayGrid):
+        keys += links * ((sim_grid.bond0 != world.NO_BOND).astype(numpy.int16) +
+                         (sim_grid.bond1 != world.NO_BOND))
+    else:
+        size = world.getGridSize(sim_grid)
+        for i in numpy.flatnonzero(links).tolist():
+            keys[i] += len(sim_grid[world.Point(i % size, i // size)].getAllBondedLinks())
+    return keys
 
-    def drawCell(self, element: world.T):
-        """ order to the cell to draw its representation on the canvas """
-        if self.master != None:
-            fill = Cell.FILLED_COLOR_BG
-            outline = Cell.FILLED_COLOR_BORDER
-
-            if not self.fill:
-                fill = Cell.EMPTY_COLOR_BG
-                outline = Cell.EMPTY_COLOR_BORDER
-
-            xmin = self.abs * self.size
-            xmax = xmin + self.size
-            ymin = self.ord * self.size
-            ymax = ymin + self.size
-            xmid = int((xmin + xmax) / 2)
-            ymid = int((ymin + ymax) / 2)
-
-            ch = ''
-            if isinstance(element, world.Hole):
-                ch = 'H'
-            elif isinstance(element, world.Substrate):
-                fill = Cell.SUBSTRATE
-                ch = 'S'
-            elif isinstance(element, world.Link):
-                fill = Cell.LINK_FREE
-                if element.isFree():
-                    ch = 'L'
-                elif element.isSinglyBonded():
-                    fill = Cell.LINK_SINGLE
-                    ch = 'b'
-                else:
-                    fill = Cell.LINK_DOUBLE
-                    ch = 'B'
-            elif isinstance(element, world.Catalyst):
-                fill = Cell.CATALYST
-                ch = 'K'
-            self.master.create_rectangle(xmin, ymin, xmax, ymax, fill=fill, outline=outline)
-            self.master.create_text(xmid, ymid, text=ch)
 
 class CellGrid(Canvas):
     def __init__(self, master, rowNumber, columnNumber, cellSize, *args, **kwargs):
@@ -125,7 +137,8 @@ class CellGrid(Canvas):
 
             self.grid.append(line)
 
-
+        # cell keys last shown, see cellKeys
+        self._keys: Optional[numpy.ndarray] = None
         self.draw()
 
     def draw(self):
@@ -139,45 +152,87 @@ class CellGrid(Canvas):
         return row, column
 
     def updateCells(self, sim_grid: [world.Point, world.T]):
-        size = int(math.sqrt(len(sim_grid)))
-        for j in range(size):
-            for i in range(size):
-                e = sim_grid[world.Point(i, j)]
-                cell = self.grid[j][i]
-                cell.drawCell(e)
+        """Recolours the cells that changed since the last update."""
+        keys = cellKeys(sim_grid)
+        if self._keys is None:
+            changed = numpy.arange(len(keys))
+        else:
+            changed = numpy.flatnonzero(keys != self._keys)
+        self._keys = keys
+        size = len(self.grid)
+        for i in changed.tolist():
+            self.grid[i // size][i % size].setStyle(*CELL_STYLES[int(keys[i])])
 
 
 class CellGridViewer(viewer.WorldViewer):
+    """Shows the world in a Tk window, whose size follows the world's grid.
 
-    def __init__(self):
+    The canvas and one rectangle (and letter) per cell are made on the first
+    update, later updates only recolour the cells that changed.
+    """
+
+    def __init__(self, cell_size: Optional[int] = None):
+        """
+        :param cell_size: pixels per cell, by default the canvas is at most
+        CANVAS_SIZE pixels wide
+        """
         super().__init__()
         self._app = Tk()
-        self.size = 10
-        self._cellgrid = CellGrid(self._app, self.size, self.size, self.size * self.size)
-        self._cellgrid.pack()
+        self._cell_size = cell_size
+        self._cellgrid: Optional[CellGrid] = None
 
     def updateView(self, grid: [world.Point, world.T], iteration: int):
+        size = world.getGridSize(grid)
+        if self._cellgrid is None or len(self._cellgrid.grid) != size:
+            if self._cellgrid is not None:
+                self._cellgrid.destroy()
+            cell_size = self._cell_size or max(MIN_CELL_SIZE, CANVAS_SIZE // size)
+            self._cellgrid = CellGrid(self._app, size, size, cell_size)
+            self._cellgrid.pack()
+        self._app.title('iteration {0}'.format(iteration))
         self._cellgrid.updateCells(grid)
         self._app.update_idletasks()
 
+    def schedule(self, delay_ms: int, callback: Callable[[], None]):
+        """Calls callback from the Tk event loop after delay_ms milliseconds."""
+        self._app.after(delay_ms, callback)
+
+    def mainloop(self):
+        self._app.mainloop()
+
 
 class CellGridPresenter(presenter.WorldPresenter):
+    """Runs one iteration every delay_ms milliseconds from the Tk event loop.
 
-    def __init__(self, viewer: viewer.WorldViewer, ctx: world.WorldContext):
+    The window stays responsive in between and open once the simulation is
+    over.
+    """
+
+    def __init__(self, viewer: CellGridViewer, ctx: world.WorldContext, delay_ms: int = DELAY_MS):
         super().__init__(viewer, ctx)
+        self._delay_ms = delay_ms
+
+    def _tick(self):
+        if self.doIteration():
+            self._viewer.schedule(self._delay_ms, self._tick)
+        else:
+            self.finishSimulation()
 
-    def _doSingleStep(self):
-        r = super()._doSingleStep()
-        time.sleep(1)
-        return r
+    def doSimulate(self):
+        self._viewer.schedule(0, self._tick)
+        self._viewer.mainloop()
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Show a simulation in a window.')
+    parser.add_argument('config', nargs='?', default='config.json', help='world configuration')
+    parser.add_argument('--delay', type=int, default=DELAY_MS, help='milliseconds between two iterations')
+    parser.add_argument('--cell-size', type=int, help='pixels per cell (default: fit %d pixels)' % CANVAS_SIZE)
+    args = parser.parse_args()
     # The initial parameters are in the json file
-    path = 'config.json'
-    view = CellGridViewer()
-    ctx = world.WorldFactory().createWorld(helper.Config.loadConfigFromFile(path))
-    presenter = CellGridPresenter(view, ctx)
+    view = CellGridViewer(args.cell_size)
+    ctx = world.WorldFactory().createWorld(helper.Config.loadConfigFromFile(args.config))
+    presenter = CellGridPresenter(view, ctx, args.delay)
     presenter.doSimulate()
 
 
@@ -16,6 +16,7 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 import ast
+import itertools
 
 from python_json_config import ConfigBuilder
 
@@ -95,3 +96,93 @@ class Config(object):
                    list(ast.literal_eval(config.Links))] if config.Links else []
         return Config(grid_size, default_element, iter, h_plist, s_plist,
                       k_plist, l_plist, disint_prob)
+
+
+GRID_SEEDS_CONFIG = 'grid_seeds'
+
+PROC_SEEDS_CONFIG = 'proc_seeds'
+
+DISINTEGRATE_PROBS_CONFIG = 'disintegration_probabilities'
+
+WEIGHTS_CONFIG = 'weights'
+
+PROCESSES_CONFIG = 'processes'
+
+RESULTS_CONFIG = 'results'
+
+SUMMARY_CONFIG = 'summary'
+
+STOP_ABSORBING_CONFIG = 'stop_absorbing'
+
+STOP_NO_CYCLE_CONFIG = 'stop_no_cycle_for'
+
+STOP_SECONDS_CONFIG = 'stop_seconds'
+
+
+# This is a data object
+class SweepSpec(object):
+    """Parameters of a batch run.
+
+    One job is run for every combination of grid seed, process seed,
+    disintegration probability and H S K weights.
+    """
+
+    def __init__(self, grid_seeds: [int], proc_seeds: [int], disint_probs: [float], weights_list: [[int]],
+                 grid_size: int, iter: int, processes: Optional[int] = None, results: str = 'results.jsonl',
+                 summary: str = 'outputfile', stop_absorbing: bool = False,
+                 stop_no_cycle_for: Optional[int] = None, stop_seconds: Optional[float] = None):
+        self.grid_seeds = grid_seeds
+        self.proc_seeds = proc_seeds
+        self.disint_probs = disint_probs
+        self.weights_list = [tuple(w) for w in weights_list]
+        self.grid_size = grid_size
+        self.iter: int = iter
+        # None means one worker per available core
+        self.processes: Optional[int] = processes
+        # result store of the finished jobs
+        self.results = results
+        # pickle of the aggregated results
+        self.summary = summary
+        # see createStopConditions
+        self.stop_absorbing = stop_absorbing
+        self.stop_no_cycle_for = stop_no_cycle_for
+        self.stop_seconds = stop_seconds
+
+    def getJobs(self) -> [tuple]:
+        """Returns the (grid_seed, proc_seed, disint_prob, weights) tuple of every job."""
+        return list(itertools.product(self.grid_seeds, self.proc_seeds, self.disint_probs, self.weights_list))
+
+    def getResultSpec(self) -> dict:
+        """Returns the settings, besides the job parameters, that the result of a job depends on."""
+        return {'grid_size': self.grid_size, 'max_iter': self.iter, 'stop_absorbing': self.stop_absorbing,
+                'stop_no_cycle_for': self.stop_no_cycle_for, 'stop_seconds': self.stop_seconds}
+
+    def createStopConditions(self) -> [StopCondition]:
+        conditions = []
+        if self.stop_absorbing:
+            conditions.append(AbsorbingStateStop())
+        if self.stop_no_cycle_for:
+            conditions.append(NoCycleStop(self.stop_no_cycle_for))
+        if self.stop_seconds:
+            conditions.append(BudgetStop(seconds=self.stop_seconds))
+        return conditions
+
+    @staticmethod
+    def loadSweepFromFile(path) -> 'SweepSpec':
+        # optional fields read as None
+        builder = ConfigBuilder()
+        for field in (GRID_SEEDS_CONFIG, PROC_SEEDS_CONFIG, DISINTEGRATE_PROBS_CONFIG, WEIGHTS_CONFIG, GRID_CONFIG,
+                      MAX_ITER):
+            builder.add_required_field(field)
+        builder.validate_field_type(GRID_SEEDS_CONFIG, list)
+        builder.validate_field_type(PROC_SEEDS_CONFIG, list)
+        builder.validate_field_type(DISINTEGRATE_PROBS_CONFIG, list)
+        builder.validate_field_type(WEIGHTS_CONFIG, list)
+        builder.validate_field_type(GRID_CONFIG, int)
+        builder.validate_field_type(MAX_ITER, int)
+        config = builder.parse_config(path)
+
+        return SweepSpec(config.grid_seeds, config.proc_seeds, config.disintegration_probabilities, config.weights,
+                         config.grid_size, config.max_iter, config.processes,
+                         config.results or 'results.jsonl', config.summary or 'outputfile',
+                         bool(config.stop_absorbing), config.stop_no_cycle_for, config.stop_seconds)
@@ -15,12 +15,16 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import itertools
+import argparse
 import logging
-import math
 import os
+import queue
 import shutil
+import subprocess
+import threading
+from typing import Dict, Optional
 
+import numpy
 from PIL import Image, ImageDraw, ImageFont
 
 import world_model as world
@@ -28,16 +32,46 @@ import world_presenter as presenter
 import world_viewer as viewer
 
 OUT_DIR = './simulation_images'
+ANIMATION_PATH = './video/autopoiesis.mp4'
+FPS = 10
 GRID_SIZE = 50
 HEIGHT = 600
 WIDTH = HEIGHT
 
+FONT_PATH = '/usr/share/fonts/truetype/freefont/FreeMono.ttf'
+BOND_COLOUR = 'orange'
+# frames waiting to be written before updateView blocks
+WRITE_QUEUE_SIZE = 8
 
-def pairwise(iterable):
-    "s -> (s0,s1), (s1,s2), (s2, s3), ..."
-    a, b = itertools.tee(iterable)
-    next(b, None)
-    return zip(a, b)
+# letter of every type code, links are L, b or B by their number of bonds
+TYPE_LETTERS = {world.HOLE: 'H', world.SUBSTRATE: 'S', world.CATALYST: 'K'}
+LINK_LETTERS = ['L', 'b', 'B']
+# white background, grey grid lines, orange bonds and black labels
+GIF_PALETTE = [(255, 255, 255), (128, 128, 128), (255, 165, 0), (0, 0, 0)]
+
+# colours of rasterize, indexed by type code up to LINK, EMPTY cells (255 as uint8) stay white
+RASTER_PALETTE = [(255, 255, 255), (205, 225, 250), (220, 40, 40), (90, 90, 200), (200, 100, 0), (128, 128, 128),
+                  (255, 165, 0)] + [(255, 255, 255)] * 249
+RASTER_BONDED_LINK = 4
+RASTER_GRID = 5
+RASTER_BOND = 6
+# smallest cells, in pixels, with grid lines, with bond lines and with 2 pixel wide bond lines
+RASTER_GRID_MIN = 4
+RASTER_BOND_MIN = 3
+RASTER_THICK_BOND_MIN = 8
+
+_font = None
+
+
+def get_font() -> ImageFont.ImageFont:
+    """Loads the label font once, falling back to the default PIL font."""
+    global _font
+    if _font is None:
+        try:
+            _font = ImageFont.truetype(FONT_PATH, 16)
+        except OSError:
+            _font = ImageFont.load_default()
+    return _font
 
 
 def create_grid_lines(image: Image, grid_size: int):
@@ -61,79 +95,408 @@ def create_grid_lines(image: Image, grid_size: int):
     del draw
 
 
-def draw_line(image: Image, draw: ImageDraw, pstart: world.Point, pend: world.Point, grid_size: int, style: int):
-    step_size = int(image.width / grid_size)
-    x0 = step_size * pstart.x + int(step_size / 2)
-    y0 = step_size * pstart.y + int(step_size / 2)
-    x1 = step_size * pend.x + int(step_size / 2)
-    y1 = step_size * pend.y + int(step_size / 2)
-    draw.line(((x0, y0), (x1, y1)), fill='orange', width=2)
+def get_cell_arrays(grid: [world.Point, world.T]) -> (numpy.ndarray, numpy.ndarray, numpy.ndarray):
+    """Returns the type codes and the two bond partners of every cell, see world.ArrayGrid."""
+    if isinstance(grid, world.ArrayGrid):
+        return grid.types.copy(), grid.bond0.copy(), grid.bond1.copy()
+    n = world.getGridSize(grid)
+    types = world.getTypeCodes(grid)
+    bond0 = numpy.full(n * n, world.NO_BOND, dtype=numpy.int32)
+    bond1 = numpy.full(n * n, world.NO_BOND, dtype=numpy.int32)
+    for i in numpy.flatnonzero(types == world.LINK).tolist():
+        bonded = grid[world.Point(i % n, i // n)].getAllBondedLinks()
+        if len(bonded) > 0:
+            bond0[i] = bonded[0].point.y * n + bonded[0].point.x
+        if len(bonded) > 1:
+            bond1[i] = bonded[1].point.y * n + bonded[1].point.x
+    return types, bond0, bond1
 
 
-def draw_on_grid(image: Image, grid: [world.Point, world.T], grid_size: int):
-    font = ImageFont.truetype('/usr/share/fonts/truetype/freefont/FreeMono.ttf', 16)
-    draw: ImageDraw = ImageDraw.Draw(image)
-    step_size = int(image.width / grid_size)
-    grid_x = 0
-    for x0, x1 in pairwise(range(0, image.width + 1, step_size)):
-        grid_y = 0
-        for y0, y1 in pairwise(range(0, image.height + 1, step_size)):
-            xmid = x0 + int((x1 - x0) / 2)
-            ymid = y0 + int((y1 - y0) / 2)
-            grid_element: world.T = grid[(grid_x, grid_y)]
-            p = 'U'
-            if isinstance(grid_element, world.Hole):
-                p = 'H'
-            elif isinstance(grid_element, world.Substrate):
-                p = 'S'
-            elif isinstance(grid_element, world.Link):
-                if grid_element.isFree():
-                    p = 'L'
-                elif grid_element.isSinglyBonded():
-                    p = 'b'
-                    friend = grid[grid_element.getBondedLink(0).point]
-                    draw_line(image, draw, pstart=grid_element.point, pend=friend.point, grid_size=grid_size, style=100)
-                else:
-                    p = 'B'
-                    friend = grid[grid_element.getBondedLink(0).point]
-                    draw_line(image, draw, pstart=grid_element.point, pend=friend.point, grid_size=grid_size, style=150)
-                    friend = grid[grid_element.getBondedLink(1).point]
-                    draw_line(image, draw, pstart=grid_element.point, pend=friend.point, grid_size=grid_size, style=150)
-            elif isinstance(grid_element, world.Catalyst):
-                p = 'K'
-            # draw.text((xmid, ymid), p, font=font, fill='black')
-
-            grid_y += 1
-        grid_x += 1
-    del draw
+class GridRenderer(object):
+    """Draws frames of one grid size, only redrawing what changed since the previous frame.
+
+    The background with the grid lines and the image of every kind of cell
+    are drawn once. For a new frame the cells whose type or bonds changed are
+    painted again, together with the cells a bond line through them can
+    reach, and the bonds ending near them are drawn again, so every frame is
+    identical to one drawn from scratch.
+    """
+
+    def __init__(self, grid_size: int, width: int = WIDTH, labels: bool = False):
+        self.grid_size = grid_size
+        self.step = int(width / grid_size)
+        self.labels = labels
+        self.background: Image = Image.new(mode='RGB', size=(width, width), color='white')
+        create_grid_lines(self.background, grid_size)
+        self.image: Image = self.background.copy()
+        self._draw: ImageDraw = ImageDraw.Draw(self.image)
+        # one cell with its grid lines, the same everywhere on the grid
+        self._blank: Image = self.background.crop((0, 0, self.step + 1, self.step + 1))
+        self._tiles: Dict[str, Image] = {}
+        # cells a bond line drawn from a cell centre can spill over to
+        self._reach = 1 + 2 // self.step
+        self._types: Optional[numpy.ndarray] = None
+        self._bond0: Optional[numpy.ndarray] = None
+        self._bond1: Optional[numpy.ndarray] = None
+
+    def _centre(self, i: int) -> (int, int):
+        n, step = self.grid_size, self.step
+        return step * (i % n) + int(step / 2), step * (i // n) + int(step / 2)
+
+    def _dilate(self, mask: numpy.ndarray, times: int) -> numpy.ndarray:
+        n = self.grid_size
+        mask = mask.reshape(n, n)
+        for _ in range(times):
+            mask = mask | (world.mooreSum(mask) > 0)
+        return mask.reshape(-1)
+
+    def _hasLongBonds(self, bond0: numpy.ndarray, bond1: numpy.ndarray) -> bool:
+        # bonds between cells that are not neighbours cross cells far from their ends
+        n = self.grid_size
+        cells = numpy.arange(len(bond0))
+        for bonds in (bond0, bond1):
+            bonded = bonds != world.NO_BOND
+            other = bonds[bonded]
+            if numpy.any((abs(cells[bonded] % n - other % n) > 1) | (abs(cells[bonded] // n - other // n) > 1)):
+                return True
+        return False
+
+    def render(self, grid: [world.Point, world.T]) -> Image:
+        """Returns the frame of grid, the image is reused by the next call."""
+        types, bond0, bond1 = get_cell_arrays(grid)
+        full = self._types is None or self._hasLongBonds(self._bond0, self._bond1) or \
+            self._hasLongBonds(bond0, bond1)
+        if not full:
+            changed = (types != self._types) | (bond0 != self._bond0) | (bond1 != self._bond1)
+        self._types, self._bond0, self._bond1 = types, bond0, bond1
+        if full:
+            return self._renderAll()
+        if not changed.any():
+            return self.image
+        repaint = self._dilate(changed, self._reach)
+        redraw = self._dilate(repaint, self._reach) & (types == world.LINK)
+        painted = numpy.count_nonzero(repaint)
+        # pasting a cell costs about as much as two bond lines
+        if 2 * painted + numpy.count_nonzero(redraw) > numpy.count_nonzero(types == world.LINK) + \
+                (2 * len(types) if self.labels else 0):
+            return self._renderAll()
+        for i in numpy.flatnonzero(repaint).tolist():
+            self._paintCell(i)
+        self._drawBonds(numpy.flatnonzero(redraw).tolist())
+        return self.image
+
+    def _renderAll(self) -> Image:
+        self.image.paste(self.background)
+        if self.labels:
+            for i in range(len(self._types)):
+                self._paintCell(i)
+        self._drawBonds(numpy.flatnonzero(self._types == world.LINK).tolist())
+        return self.image
+
+    def _paintCell(self, i: int):
+        n, step = self.grid_size, self.step
+        self.image.paste(self._getTile(i), (step * (i % n), step * (i // n)))
+
+    def _getTile(self, i: int) -> Image:
+        if not self.labels:
+            return self._blank
+        code = int(self._types[i])
+        if code == world.LINK:
+            letter = LINK_LETTERS[int(self._bond0[i] != world.NO_BOND) + int(self._bond1[i] != world.NO_BOND)]
+        else:
+            letter = TYPE_LETTERS[code]
+        tile = self._tiles.get(letter)
+        if tile is None:
+            # the letter is clipped to the inside of the cell so tiles never overlap
+            inside = Image.new(mode='RGB', size=(self.step - 1, self.step - 1), color='white')
+            ImageDraw.Draw(inside).text((int(self.step / 2) - 1, int(self.step / 2) - 1), letter, font=get_font(),
+                                        fill='black', anchor='mm')
+            tile = self._blank.copy()
+            tile.paste(inside, (1, 1))
+            self._tiles[letter] = tile
+        return tile
+
+    def _drawBonds(self, cells: [int]):
+        draw = self._draw
+        for i in cells:
+            for j in (int(self._bond0[i]), int(self._bond1[i])):
+                if j != world.NO_BOND:
+                    draw.line((self._centre(i), self._centre(j)), fill=BOND_COLOUR, width=2)
+
+
+def rasterize(types: numpy.ndarray, bond0: numpy.ndarray, bond1: numpy.ndarray, grid_size: int,
+              cell_size: int) -> numpy.ndarray:
+    """Returns the RASTER_PALETTE index of every pixel of a grid drawn with cell_size pixels per cell.
+
+    Cells are coloured by type, bonded links apart from free ones, then grid
+    lines and bond lines are drawn over them once cells are large enough to
+    show them. The image is grid_size * cell_size pixels wide.
+    """
+    n, c = grid_size, cell_size
+    codes = types.astype(numpy.uint8)
+    bonded = (types == world.LINK) & (bond0 != world.NO_BOND)
+    codes[bonded] = RASTER_BONDED_LINK
+    # nearest neighbour scaling, every cell becomes a c x c block
+    pixels = numpy.broadcast_to(codes.reshape(n, 1, n, 1), (n, c, n, c)).reshape(n * c, n * c).copy()
+    if c >= RASTER_GRID_MIN:
+        pixels[::c, :] = RASTER_GRID
+        pixels[:, ::c] = RASTER_GRID
+    if c >= RASTER_BOND_MIN:
+        cells = numpy.flatnonzero(bonded)
+        src = numpy.concatenate((cells, cells))
+        dst = numpy.concatenate((bond0[cells], bond1[cells]))
+        src, dst = src[dst != world.NO_BOND], dst[dst != world.NO_BOND]
+        dx, dy = dst % n - src % n, dst // n - src // n
+        # every pixel from the centre of one cell to the centre of its partner
+        steps = numpy.arange(c + 1)
+        xs = ((src % n) * c + c // 2)[:, None] + dx[:, None] * steps
+        ys = ((src // n) * c + c // 2)[:, None] + dy[:, None] * steps
+        pixels[ys, xs] = RASTER_BOND
+        if c >= RASTER_THICK_BOND_MIN:
+            pixels[ys + 1, xs] = RASTER_BOND
+            pixels[ys, xs + 1] = RASTER_BOND
+    return pixels
+
+
+class RasterRenderer(object):
+    """Draws frames with rasterize, fast enough for grids far larger than GridRenderer can draw.
+
+    One pixel per cell still shows where the bonded links are.
+    """
+
+    def __init__(self, grid_size: int, cell_size: int = 1):
+        assert cell_size > 0
+        self.grid_size = grid_size
+        self.cell_size = cell_size
+        self.image: Optional[Image] = None
+
+    def render(self, grid: [world.Point, world.T]) -> Image:
+        types, bond0, bond1 = get_cell_arrays(grid)
+        pixels = rasterize(types, bond0, bond1, self.grid_size, self.cell_size)
+        size = self.grid_size * self.cell_size
+        self.image = Image.frombuffer('P', (size, size), pixels.tobytes(), 'raw', 'P', 0, 1)
+        self.image.putpalette([c for colour in RASTER_PALETTE for c in colour])
+        return self.image
+
+
+class FrameWriter(object):
+    """Encodes and writes frames on a background thread.
+
+    At most queue_size frames wait to be written, write blocks when the queue
+    is full so a slow disk or encoder cannot exhaust memory.
+    """
+
+    def __init__(self, queue_size: int = WRITE_QUEUE_SIZE):
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name='frame-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._writeFrame(*item)
+            except OSError:
+                logging.getLogger('world').exception('cannot write frame %s', item[1])
+        try:
+            self._finish()
+        except OSError:
+            logging.getLogger('world').exception('cannot finish writing')
+
+    def _writeFrame(self, image: Image, iteration: int):
+        pass
 
+    def _finish(self):
+        pass
+
+    def write(self, image: Image, iteration: int):
+        """Queues a copy of image, it can be drawn on again right away."""
+        self._queue.put((image.copy(), iteration))
+
+    def close(self):
+        """Waits until every queued frame is written."""
+        self._queue.put(None)
+        self._thread.join()
+
+
+class ImageWriter(FrameWriter):
+    """Writes every frame to its own PNG file."""
+
+    def __init__(self, out_dir: str, queue_size: int = WRITE_QUEUE_SIZE):
+        self._out_dir = out_dir
+        super().__init__(queue_size)
+
+    def _writeFrame(self, image: Image, iteration: int):
+        image.save('{0}/out_{1}.png'.format(self._out_dir, iteration))
+
+
+class GifWriter(FrameWriter):
+    """Writes the frames as one looping GIF when it is closed.
+
+    RGB frames are mapped to the colours of GIF_PALETTE, which holds every
+    colour GridRenderer draws with, palette frames keep their own palette.
+    Frames wait for close as palette images, one byte per pixel.
+    """
+
+    def __init__(self, path: str, fps: int = FPS, queue_size: int = WRITE_QUEUE_SIZE):
+        self.path = path
+        self._duration = int(1000 / fps)
+        self._frames: [Image] = []
+        self._palette = Image.new('P', (1, 1))
+        self._palette.putpalette([c for colour in GIF_PALETTE for c in colour])
+        super().__init__(queue_size)
+
+    def _writeFrame(self, image: Image, iteration: int):
+        if image.mode == 'P':
+            frame = image
+        else:
+            # dither=0: no dithering, every pixel takes the nearest palette colour
+            frame = image.quantize(palette=self._palette, dither=0)
+        self._frames.append(frame)
+
+    def _finish(self):
+        if self._frames:
+            self._frames[0].save(self.path, save_all=True, append_images=self._frames[1:], duration=self._duration,
+                                 loop=0)
+            self._frames = []
+
+
+class FfmpegWriter(FrameWriter):
+    """Pipes raw RGB frames into an ffmpeg process, which encodes the video at path."""
+
+    def __init__(self, path: str, fps: int = FPS, queue_size: int = WRITE_QUEUE_SIZE, ffmpeg: str = 'ffmpeg'):
+        self.path = path
+        self._fps = fps
+        self._ffmpeg = ffmpeg
+        self._process: Optional[subprocess.Popen] = None
+        super().__init__(queue_size)
 
-def write_grid_to_disk(image: Image, iteration: int):
-    with open('{0}/out_{1}.png'.format(OUT_DIR, iteration), 'wb') as f:
-        image.save(f)
+    def _writeFrame(self, image: Image, iteration: int):
+        if self._process is None:
+            # yuv420p, which most players need, wants an even width and height
+            self._process = subprocess.Popen(
+                [self._ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                 '-s', '{0}x{1}'.format(*image.size), '-r', str(self._fps), '-i', '-',
+                 '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', self.path],
+                stdin=subprocess.PIPE)
+        self._process.stdin.write(image.convert('RGB').tobytes())
 
+    def _finish(self):
+        if self._process is not None:
+            self._process.stdin.close()
+            if self._process.wait() != 0:
+                logging.getLogger('world').error('ffmpeg failed to write %s', self.path)
+            self._process = None
 
-class PngViewer(viewer.WorldViewer):
+
+def create_animation_writer(path: str, fps: int = FPS, queue_size: int = WRITE_QUEUE_SIZE) -> FrameWriter:
+    """Returns a GIF writer for a .gif path, otherwise an ffmpeg writer if ffmpeg is installed.
+
+    Without ffmpeg the frames go to a GIF next to path instead.
+    """
+    if path.endswith('.gif'):
+        return GifWriter(path, fps, queue_size)
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is not None:
+        return FfmpegWriter(path, fps, queue_size, ffmpeg)
+    gif_path = os.path.splitext(path)[0] + '.gif'
+    logging.getLogger('world').warning('ffmpeg not found, writing %s instead of %s', gif_path, path)
+    return GifWriter(gif_path, fps, queue_size)
+
+
+class FrameViewer(viewer.WorldViewer):
+    """Renders every every-th iteration and hands the frame to a FrameWriter."""
 
     def updateView(self, grid: [world.Point, world.T], iteration):
-        n = int(math.sqrt(len(grid)))
         print('iter:{0}'.format(iteration))
-        image: Image = Image.new(mode='RGB', size=(HEIGHT, WIDTH), color='white')
-        create_grid_lines(image, n)
-        draw_on_grid(image, grid, n)
-        write_grid_to_disk(image, iteration)
+        if iteration % self._every != 0:
+            return
+        n = world.getGridSize(grid)
+        if self._renderer is None or self._renderer.grid_size != n:
+            if self._raster:
+                self._renderer = RasterRenderer(n, self._cell_size or max(1, WIDTH // n))
+            else:
+                self._renderer = GridRenderer(n, WIDTH, self._labels)
+        if self._writer is None:
+            self._writer = self.createWriter()
+        self._writer.write(self._renderer.render(grid), iteration)
 
-    def __init__(self):
+    def createWriter(self) -> FrameWriter:
+        """Returns the writer of the frames, called when the first frame is drawn."""
         pass
 
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __init__(self, every: int = 1, labels: bool = False, raster: bool = False, cell_size: Optional[int] = None):
+        """
+        :param raster: draw with RasterRenderer, labels are not drawn then
+        :param cell_size: pixels per cell of RasterRenderer, by default the
+        grid is about WIDTH pixels wide
+        """
+        super().__init__()
+        assert every > 0
+        self._every = every
+        self._labels = labels
+        self._raster = raster
+        self._cell_size = cell_size
+        self._renderer: Optional[GridRenderer] = None
+        self._writer: Optional[FrameWriter] = None
+
+
+class PngViewer(FrameViewer):
+
+    def createWriter(self) -> FrameWriter:
+        return ImageWriter(self._out_dir)
+
+    def __init__(self, out_dir: str = OUT_DIR, every: int = 1, labels: bool = False, raster: bool = False,
+                 cell_size: Optional[int] = None):
+        super().__init__(every, labels, raster, cell_size)
+        self._out_dir = out_dir
+
+
+class AnimationViewer(FrameViewer):
+    """Writes the frames into one animation, see create_animation_writer."""
+
+    def createWriter(self) -> FrameWriter:
+        return create_animation_writer(self._path, self._fps, self._queue_size)
+
+    def __init__(self, path: str = ANIMATION_PATH, fps: int = FPS, every: int = 1, labels: bool = False,
+                 raster: bool = False, cell_size: Optional[int] = None, queue_size: int = WRITE_QUEUE_SIZE):
+        super().__init__(every, labels, raster, cell_size)
+        self._path = path
+        self._fps = fps
+        self._queue_size = queue_size
+
+
+def parseArgs(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Draw a simulation as PNG files or as one animation.')
+    parser.add_argument('-a', '--animation', nargs='?', const=ANIMATION_PATH,
+                        help='write the frames into one .gif, or any video ffmpeg can write '
+                             '(default: one PNG per frame in %s)' % OUT_DIR)
+    parser.add_argument('--every', type=int, default=1, help='draw every n-th iteration')
+    parser.add_argument('--fps', type=int, default=FPS, help='frames per second of the animation')
+    parser.add_argument('--raster', action='store_true', help='colour cells by type, fast on large grids')
+    parser.add_argument('--cell-size', type=int, help='pixels per cell with --raster (default: fit %d pixels)' % WIDTH)
+    return parser.parse_args(argv)
+
 
 def main():
-    if os.path.isdir(OUT_DIR):
-        shutil.rmtree(OUT_DIR)
-    os.mkdir(OUT_DIR)
+    args = parseArgs()
     path = 'config.json'
     logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
-    view = PngViewer()
+    if args.animation is None:
+        if os.path.isdir(OUT_DIR):
+            shutil.rmtree(OUT_DIR)
+        os.mkdir(OUT_DIR)
+        view = PngViewer(every=args.every, raster=args.raster, cell_size=args.cell_size)
+    else:
+        view = AnimationViewer(args.animation, fps=args.fps, every=args.every, raster=args.raster,
+                               cell_size=args.cell_size)
     # ctx = world.WorldFactory(logging_level='INFO').createWorld(helper.Config.loadConfigFromFile(path))
     grid_size = GRID_SIZE
     # weights = [14, 80, 6]  # H S K
@@ -0,0 +1,124 @@
+"""
+Copyright 2020 Siddharth Priya
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""Append-only on-disk store for the results of a parameter sweep.
+
+The first line of a store records the settings the results depend on, e.g.
+{"spec": {"grid_size": 10, "max_iter": 1000}}, the other lines one job each.
+"""
+import json
+import os
+from typing import IO, Dict, Iterator, Optional
+
+
+class SweepMismatchError(ValueError):
+    """The store holds results of a sweep run with other settings."""
+    pass
+
+
+def _toKey(params) -> tuple:
+    # lists (from JSON) become tuples so keys can be hashed
+    return tuple(_toKey(p) if isinstance(p, (list, tuple)) else p for p in params)
+
+
+class ResultStore(object):
+    """Results of finished jobs, one JSON line per job.
+
+    A job is saved as soon as it completes, so a sweep interrupted at any
+    point can be resumed by skipping the jobs already in the store. A line
+    left incomplete by a crash is dropped when the store is opened.
+    """
+
+    def __init__(self, path: str, spec: Optional[dict] = None):
+        """
+        :param spec: settings, other than the job parameters, that the results
+        depend on. A store written with other settings is not resumed,
+        SweepMismatchError is raised instead.
+        """
+        self.path = path
+        # JSON round trip so tuples compare equal to the lists read back
+        self.spec: Optional[dict] = json.loads(json.dumps(spec)) if spec is not None else None
+        self._stored_spec: Optional[dict] = None
+        self._results: Dict[tuple, object] = {}
+        self._stop_reasons: Dict[tuple, Optional[str]] = {}
+        self._load()
+        if self.spec is not None and self._stored_spec != self.spec and (self._stored_spec is not None or
+                                                                            self._results):
+            stored = self._stored_spec if self._stored_spec is not None else 'not recorded'
+            raise SweepMismatchError('{0} holds results of a sweep with settings {1}, not {2}; use another '
+                                     'results file'.format(self.path, stored, self.spec))
+        # opened on the first add
+        self._out: Optional[IO[str]] = None
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            complete = data.rfind(b'\n') + 1
+            if complete < len(data):
+                f.truncate(complete)
+        for line in data[:complete].decode().splitlines():
+            record = json.loads(line)
+            if 'spec' in record:
+                self._stored_spec = record['spec']
+                continue
+            self._results[_toKey(record['params'])] = record['result']
+            self._stop_reasons[_toKey(record['params'])] = record.get('stop')
+
+    def __contains__(self, params) -> bool:
+        return _toKey(params) in self._results
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def __iter__(self) -> Iterator[tuple]:
+        return iter(self._results)
+
+    def __getitem__(self, params):
+        return self._results[_toKey(params)]
+
+    def getStopReason(self, params) -> Optional[str]:
+        """Returns why the simulation of a job ended, None if that was not recorded."""
+        return self._stop_reasons[_toKey(params)]
+
+    def add(self, params, result, stop_reason: Optional[str] = None):
+        """Saves the result of a job, it is on disk when this returns."""
+        if self._out is None:
+            self._out = open(self.path, 'a')
+            if self.spec is not None and self._stored_spec is None:
+                self._out.write(json.dumps({'spec': self.spec}) + '\n')
+                self._stored_spec = self.spec
+        record = {'params': params, 'result': result}
+        if stop_reason is not None:
+            record['stop'] = stop_reason
+        self._out.write(json.dumps(record) + '\n')
+        self._out.flush()
+        os.fsync(self._out.fileno())
+        self._results[_toKey(params)] = result
+        self._stop_reasons[_toKey(params)] = stop_reason
+
+    def close(self):
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+
+    def __enter__(self) -> 'ResultStore':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -18,9 +18,24 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 Unit/integration tests for the world model.
 """
+import collections.abc
+import contextlib
+import io
+import json
 import os
+import tempfile
+import time
 from unittest import TestCase
 
+import benchmark
+import cellgrid
+import helper
+import png_visualiser
+import result_store
+import world_metrics
+import world_presenter
+import world_snapshot
+import world_viewer
 from world_model import *
 
 
@@ -35,6 +50,18 @@ def InitGird(c: typing.Type[T], grid_size) -> ([T], Dict[Point, T]):
     return elem_list, grid
 
 
+def AssertValueEqual(test: TestCase, expected, actual):
+    """Compares grids or element lists by value, elements compare by identity."""
+    if isinstance(expected, collections.abc.Mapping):
+        test.assertCountEqual(expected.keys(), actual.keys())
+        pairs = [(expected[p], actual[p]) for p in expected]
+    else:
+        test.assertEqual(len(expected), len(actual))
+        pairs = zip(expected, actual)
+    for e, a in pairs:
+        test.assertTrue(e.valueEquals(a), '{0} != {1}'.format(e, a))
+
+
 class ChooseFirstStrategy(ChooseStrategy):
 
     def chooseDisintegrate(self) -> bool:
@@ -76,6 +103,38 @@ class TestElement(TestCase):
         e = Element(Point(4, 0), 5)
         self.assertCountEqual([(3, 0), (4, 1), (3, 1)], e.getNeighbours())
 
+    def test_get_ortho_and_extended_neighbours(self):
+        e = Element(Point(1, 2), 4)
+        self.assertEqual([(1, 1), (2, 2), (1, 3), (0, 2)], e.getOrthoNeighbours())
+        self.assertEqual([(1, 0), (3, 2)], e.getExtendedNeighbours())
+        # one table per grid size, the points of a cell are shared
+        self.assertIs(NeighbourTable.forGridSize(4), Element(Point(0, 0), 4)._neighbours)
+        self.assertIs(e.getNeighbours()[0], Element(Point(2, 1), 4).getOrthoNeighbours()[3])
+
+    def test_neighbour_table(self):
+        n = 5
+        table = NeighbourTable.forGridSize(n)
+        self.assertEqual((n * n, 8), table.moore.shape)
+        self.assertEqual((n * n, 4), table.extended.shape)
+        self.assertEqual(numpy.int32, table.moore.dtype)
+        # N E S W NW NE SE SW of the corner cell (0, 0), -1 off the grid
+        self.assertEqual([-1, 1, n, -1, -1, -1, n + 1, -1], table.moore[0].tolist())
+        for i in range(n * n):
+            x, y = i % n, i // n
+            moore = [(x + dx, y + dy) for dx, dy in NeighbourTable.MOORE_OFFSETS]
+            extended = [(x + dx, y + dy) for dx, dy in NeighbourTable.EXTENDED_OFFSETS]
+            for row, cells in ((table.moore[i], moore), (table.extended[i], extended)):
+                self.assertEqual([qy * n + qx if 0 <= qx < n and 0 <= qy < n else -1 for qx, qy in cells],
+                                 row.tolist())
+            self.assertEqual([j for j in table.moore[i].tolist() if j >= 0], table.getNeighbourCells(i))
+
+    def test_is_neighbour(self):
+        e = Element(Point(1, 1), 4)
+        self.assertTrue(e.isNeighbour(Element(Point(0, 0), 4)))
+        self.assertTrue(e.isNeighbour(Element(Point(2, 1), 4)))
+        self.assertFalse(e.isNeighbour(Element(Point(1, 1), 4)))
+        self.assertFalse(e.isNeighbour(Element(Point(3, 1), 4)))
+
 
 class TestHoleProcess(TestCase):
     def test_do_step(self):
@@ -90,13 +149,14 @@ class TestHoleProcess(TestCase):
         catalyst_list = [k]
         choose_strategy = ChooseFirstStrategy()
         logger = logging.getLogger('test')
-        hp = HoleProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy, logger)
+        index = WorldIndex(grid, link_list)
+        hp = HoleProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy, logger, index)
         hp.doStep()
-        self.assertDictEqual({Point(0, 0): Substrate(Point(0, 0), 2),
-                              Point(0, 1): k,
-                              Point(1, 0): h,
-                              Point(1, 1): l},
-                             grid)
+        AssertValueEqual(self, {Point(0, 0): Substrate(Point(0, 0), 2),
+                                Point(0, 1): k,
+                                Point(1, 0): h,
+                                Point(1, 1): l},
+                         grid)
 
 
 class TestLink(TestCase):
@@ -128,6 +188,47 @@ class TestLink(TestCase):
         self.assertTrue(l.isBondingAngleOk(l1, grid))
         self.assertFalse(l.isBondingAngleOk(l2, grid))
 
+    def test_is_bonding_angle_ok_matches_element_lookup(self):
+        def ElementLookupAngleOk(this: Link, other: Link, grid) -> bool:
+            # the check as written before it compared cells, reading every neighbour from the grid
+            ortho_list = [grid[n] for n in this.getOrthoNeighbours()]
+            n_list = [grid[n] for n in this.getNeighbours()]
+            l1 = other.getBondedLink(0)
+            if other in ortho_list:
+                return l1 not in ortho_list
+            return l1 not in n_list
+
+        size = 3
+        cells = [Point(x, y) for y in range(size) for x in range(size)]
+        checked = 0
+        for p in cells:
+            for q in Link(p, size).getNeighbours():
+                for r in Link(q, size).getNeighbours():
+                    if r == p:
+                        continue
+                    _, grid = InitGird(Hole, size)
+                    this, other, l1 = Link(p, size), Link(q, size), Link(r, size)
+                    for l in (this, other, l1):
+                        grid[l.point] = l
+                    other.addBond(l1)
+                    l1.addBond(other)
+                    expected = ElementLookupAngleOk(this, other, grid)
+                    self.assertEqual(expected, this.isBondingAngleOk(other, grid))
+                    self.assertEqual(expected, other.isBondingAngleOk(this, grid))
+                    checked += 1
+        self.assertGreater(checked, 100)
+
+    def test_identity_and_value_equality(self):
+        l0 = Link(Point(0, 0), 2)
+        l1 = Link(Point(1, 0), 2)
+        l0.addBond(l1)
+        copy = Link(Point(0, 0), 2)
+        self.assertNotEqual(l0, copy)
+        self.assertFalse(l0.valueEquals(copy))
+        copy.addBond(Link(Point(1, 0), 2))
+        self.assertTrue(l0.valueEquals(copy))
+        self.assertEqual(2, len({l0, l1, l0}))
+
 
 class TestProcess(TestCase):
     def test_form_bond1(self):
@@ -147,7 +248,8 @@ class TestProcess(TestCase):
         catalyst_list = []
         choose_strategy = ChooseFirstStrategy()
         logger = logging.getLogger('test')
-        p = HoleProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy, logger)
+        index = WorldIndex(grid, link_list)
+        p = HoleProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy, logger, index)
         p.formBond(l_target, m_list, n_list)
         self.assertCountEqual([l1, l3], l_target.getAllBondedLinks())
 
@@ -171,7 +273,8 @@ class TestProcess(TestCase):
         catalyst_list = []
         choose_strategy = ChooseFirstStrategy()
         logger = logging.getLogger('test')
-        p = HoleProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy, logger)
+        index = WorldIndex(grid, link_list)
+        p = HoleProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy, logger, index)
         p.formBond(l_target, m_list, n_list)
         self.assertCountEqual([l1, l3], l_target.getAllBondedLinks())
 
@@ -202,12 +305,30 @@ class TestProcess(TestCase):
         link_list = [e for e in e_list if isinstance(e, Link)]
         choose_strategy = ChooseFirstStrategy()
         logger = logging.getLogger('test')
-        hp = LinkProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy, logger)
+        index = WorldIndex(grid, link_list)
+        hp = LinkProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy, logger, index)
         hp.displaceSubstrate(l, s)
         expected_grid[Point(3, 2)] = Substrate(Point(3, 2), size)
         expected_grid[Point(1, 2)] = Link(Point(1, 2), size)
         expected_grid[Point(0, 3)] = Hole(Point(0, 3), size)
-        self.assertDictEqual(expected_grid, grid)
+        AssertValueEqual(self, expected_grid, grid)
+
+    def test_link_bonded_during_the_step_stays(self):
+        size = 3
+        hole_list, grid = InitGird(Hole, size)
+        l0 = Link(Point(0, 0), size)
+        l1 = Link(Point(1, 0), size)
+        for l in (l0, l1):
+            hole_list.remove(grid[l.point])
+            grid[l.point] = l
+        index = WorldIndex(grid, [l0, l1])
+        lp = LinkProcess(grid, hole_list, [], [], [l0, l1], ChooseFirstStrategy(), logging.getLogger('test'), index)
+        # l0 can not move onto l1 and bonds with it, l1 would then move east onto the hole at (2, 0)
+        lp.doStep()
+        self.assertEqual([l1], l0.getAllBondedLinks())
+        self.assertEqual(Point(1, 0), l1.point)
+        self.assertIs(l1, grid[Point(1, 0)])
+        self.assertEqual([], findInconsistencies(grid, hole_list, [], [], [l0, l1], index))
 
 
 class TestCombined(TestCase):
@@ -239,9 +360,11 @@ class TestCombined(TestCase):
         logging.basicConfig(level=os.environ.get("LOGLEVEL", "DEBUG"))
         logger = logging.getLogger('test')
         logger.setLevel('DEBUG')
-        hp = HoleProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy, logger)
-        lp = LinkProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy, logger)
-        kp = CatalystProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy, logger)
+        index = WorldIndex(grid, link_list)
+        hp = HoleProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy, logger, index)
+        lp = LinkProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy, logger, index)
+        kp = CatalystProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy, logger,
+                             index)
         hp.doStep()
         print(GridPrettyPrintHelper(grid))
         h_e1 = Hole(Point(2, 1), s)
@@ -251,7 +374,7 @@ class TestCombined(TestCase):
         e_list = [h_e1, sb1, h_e2, l_e1]
         for e in e_list:
             expected_grid[e.point] = e
-        self.assertDictEqual(expected_grid, grid)
+        AssertValueEqual(self, expected_grid, grid)
 
         lp.doStep()
         print(GridPrettyPrintHelper(grid))
@@ -259,7 +382,7 @@ class TestCombined(TestCase):
         l = Link(Point(1, 1), s)
         expected_grid[h.point] = h
         expected_grid[l.point] = l
-        self.assertDictEqual(expected_grid, grid)
+        AssertValueEqual(self, expected_grid, grid)
 
         kp.doStep()
         print(GridPrettyPrintHelper(grid))
@@ -267,7 +390,7 @@ class TestCombined(TestCase):
         k = Catalyst(Point(0, 1), s)
         expected_grid[h.point] = h
         expected_grid[k.point] = k
-        self.assertDictEqual(expected_grid, grid)
+        AssertValueEqual(self, expected_grid, grid)
 
 
 class TestDisintegrationProcess(TestCase):
@@ -285,7 +408,9 @@ class TestDisintegrationProcess(TestCase):
         catalyst_list = []
         choose_strategy = ChooseFirstStrategy()
         logger = logging.getLogger('test')
-        dp = DisintegrationProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy, logger)
+        index = WorldIndex(grid, link_list)
+        dp = DisintegrationProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy,
+                                   logger, index)
         dp.dobondTwo(l_02, l_12)
         dp.dobondTwo(l_10, l_20)
         dp.doRebond(s.point)
@@ -306,10 +431,12 @@ class TestDisintegrationProcess(TestCase):
         orig_hole_list = hole_list.copy()
         choose_strategy = ChooseFirstStrategy()
         logger = logging.getLogger('test')
-        dp = DisintegrationProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy, logger)
+        index = WorldIndex(grid, link_list)
+        dp = DisintegrationProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy,
+                                   logger, index)
         dp.dobondTwo(l0, l1)
         dp.disintegrate(l0)
-        self.assertEqual([s], dp.s_list)
+        AssertValueEqual(self, [s], dp.s_list)
         self.assertEqual([l1], dp.l_list)
         self.assertEqual([], dp.k_list)
         self.assertEqual(orig_hole_list, dp.h_list)
@@ -332,10 +459,835 @@ class TestProductionProcess(TestCase):
         orig_hole_list = hole_list.copy()
         choose_strategy = ChooseFirstStrategy()
         logger = logging.getLogger('test')
-        pp = ProductionProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy, logger)
+        index = WorldIndex(grid, link_list)
+        pp = ProductionProcess(grid, hole_list, substrate_list, catalyst_list, link_list, choose_strategy,
+                               logger, index)
         pp.doStep()
         self.assertEqual([], pp.s_list)
-        self.assertEqual([l], pp.l_list)
+        AssertValueEqual(self, [l], pp.l_list)
         self.assertEqual([k], pp.k_list)
         self.assertEqual(orig_hole_list, pp.h_list)
         self.assertEqual("L K \nH H \n", GridPrettyPrintHelper(grid))
+
+
+def RunWorld(ctx: WorldContext, iterations: int,
+             exp: Optional[AliveDurationExperiment] = None) -> AliveDurationExperiment:
+    exp = exp if exp is not None else AliveDurationExperiment()
+    for _ in range(iterations):
+        ctx.hole_process.doStep()
+        ctx.link_process.doStep()
+        ctx.catalyst_process.doStep()
+        ctx.production_process.doStep()
+        ctx.disintegration_process.doStep()
+        ctx.cycle_observer.doStep(exp)
+        exp.incTime()
+        ctx.iteration += 1
+    return exp
+
+
+class TestArrayGrid(TestCase):
+    def createWorld(self, array_grid: bool) -> WorldContext:
+        return WorldFactory(array_grid=array_grid).createRandomWorld(12, [10, 80, 10], grid_random_seed=3,
+                                                                     max_iter=40, proc_random_seed=7,
+                                                                     disintegrate_prob=0.02)
+
+    def test_matches_dict_grid(self):
+        dict_ctx = self.createWorld(array_grid=False)
+        dict_exp = RunWorld(dict_ctx, 40)
+        array_ctx = self.createWorld(array_grid=True)
+        array_exp = RunWorld(array_ctx, 40)
+        self.assertIsInstance(array_ctx.grid, ArrayGrid)
+        self.assertEqual(GridPrettyPrintHelper(dict_ctx.grid), GridPrettyPrintHelper(array_ctx.grid))
+        self.assertEqual(dict_exp.process(), array_exp.process())
+
+    def test_bond_arrays_follow_links(self):
+        grid = ArrayGrid(3)
+        l0 = Link(Point(0, 0), 3)
+        l1 = Link(Point(1, 0), 3)
+        grid[l0.point] = l0
+        grid[l1.point] = l1
+        l0.addBond(l1)
+        l1.addBond(l0)
+        self.assertEqual([LINK, LINK, SUBSTRATE], grid.types[:3].tolist())
+        self.assertEqual((1, NO_BOND), (grid.bond0[0], grid.bond1[0]))
+        self.assertEqual((0, NO_BOND), (grid.bond0[1], grid.bond1[1]))
+        l0.removeBond(l1)
+        self.assertEqual([NO_BOND, NO_BOND], grid.bond0[:2].tolist())
+
+    def test_substrates_are_views(self):
+        grid = ArrayGrid(2)
+        h = Hole(Point(1, 1), 2)
+        grid[h.point] = h
+        self.assertTrue(Substrate(Point(0, 1), 2).valueEquals(grid[Point(0, 1)]))
+        self.assertIs(h, grid[Point(1, 1)])
+        self.assertEqual(3, len(grid.substrates()))
+        self.assertEqual("S S \nS H \n", GridPrettyPrintHelper(grid))
+
+    def test_getitem(self):
+        dict_ctx = self.createWorld(array_grid=False)
+        RunWorld(dict_ctx, 10)
+        array_ctx = self.createWorld(array_grid=True)
+        RunWorld(array_ctx, 10)
+        for p, e in dict_ctx.grid.items():
+            a = array_ctx.grid[p]
+            self.assertTrue(e.valueEquals(a))
+            self.assertEqual(p, a.point)
+            if not isinstance(a, Substrate):
+                # only substrates are created on access
+                self.assertIs(a, array_ctx.grid[(p.x, p.y)])
+        for p in (Point(-1, 0), Point(0, -1), Point(12, 0), Point(0, 12)):
+            self.assertRaises(KeyError, array_ctx.grid.__getitem__, p)
+            self.assertEqual(dict_ctx.grid.get(p), array_ctx.grid.get(p))
+
+
+class TestWorldIndex(TestCase):
+    def test_bond_candidates_follow_changes(self):
+        size = 5
+        hole_list, grid = InitGird(Hole, size)
+        l0 = Link(Point(0, 0), size)
+        l1 = Link(Point(4, 4), size)
+        grid[l0.point] = l0
+        grid[l1.point] = l1
+        index = WorldIndex(grid, [l0, l1])
+        # everything is new on the first pass
+        self.assertCountEqual([l0, l1], index.popBondCandidates())
+        self.assertEqual([], index.popBondCandidates())
+        index.swapped(grid[Point(3, 3)], grid[Point(2, 2)])
+        self.assertEqual([l1], index.popBondCandidates())
+
+    def test_free_links_follow_bonds(self):
+        size = 2
+        _, grid = InitGird(Hole, size)
+        l0 = Link(Point(0, 0), size)
+        l1 = Link(Point(1, 0), size)
+        grid[l0.point] = l0
+        grid[l1.point] = l1
+        p = DisintegrationProcess(grid, [], [], [], [l0, l1], ChooseFirstStrategy(), logging.getLogger('test'),
+                                  WorldIndex(grid, [l0, l1]))
+        self.assertCountEqual([l0, l1], p.index.getFreeLinks())
+        p.dobondTwo(l0, l1)
+        self.assertEqual([], p.index.getFreeLinks())
+        p.disintegrate(l0)
+        self.assertEqual([l1], p.index.getFreeLinks())
+
+    def test_processes_share_the_index(self):
+        ctx = WorldFactory().createRandomWorld(8, [10, 80, 10], grid_random_seed=1, max_iter=5, proc_random_seed=1,
+                                               disintegrate_prob=0.1)
+        self.assertEqual({id(ctx.hole_process.index)}, {id(p.index) for p in ctx.getProcesses()})
+        p = ctx.hole_process
+        # a process can not be built with an index of its own by leaving it out
+        self.assertRaises(TypeError, LinkProcess, ctx.grid, p.h_list, p.s_list, p.k_list, p.l_list, p.chooser,
+                          p.logger)
+
+    def test_neighbour_counts_follow_changes(self):
+        for array_grid in (False, True):
+            ctx = WorldFactory(array_grid=array_grid).createRandomWorld(10, [10, 80, 10], grid_random_seed=1,
+                                                                        max_iter=20, proc_random_seed=2,
+                                                                        disintegrate_prob=0.1)
+            RunWorld(ctx, 20)
+            index = ctx.hole_process.index
+            self.assertEqual(countNeighbourTypes(ctx.grid).tobytes(), index._counts.tobytes())
+            k = ctx.production_process.k_list[0]
+            self.assertEqual(len(k.getNeighboursOfType(Substrate, ctx.grid)),
+                             index.countNeighboursOfType(k, Substrate))
+
+    def test_select_with_neighbour_of_type(self):
+        selected = []
+        for array_grid in (False, True):
+            ctx = WorldFactory(array_grid=array_grid).createRandomWorld(12, [10, 60, 30], grid_random_seed=6,
+                                                                        max_iter=10, proc_random_seed=6,
+                                                                        disintegrate_prob=0.1)
+            RunWorld(ctx, 10)
+            k_list = ctx.production_process.k_list
+            expected = sorted((k.point for k in k_list if k.hasNeighbourOfType(Substrate, ctx.grid)),
+                              key=lambda p: (p.y, p.x))
+            actual = [k.point for k in ctx.hole_process.index.selectWithNeighbourOfType(k_list, Substrate)]
+            self.assertEqual(expected, actual)
+            self.assertLess(len(actual), len(k_list))
+            selected.append(actual)
+        self.assertEqual(selected[0], selected[1])
+
+
+    def test_array_grid_lookups_filter_by_type(self):
+        ctxs = [WorldFactory(array_grid=array_grid).createRandomWorld(12, [10, 70, 20], grid_random_seed=2,
+                                                                      max_iter=5, proc_random_seed=3,
+                                                                      disintegrate_prob=0.05)
+                for array_grid in (False, True)]
+        for ctx in ctxs:
+            RunWorld(ctx, 5)
+        dict_index, array_index = (ctx.hole_process.index for ctx in ctxs)
+        for c in (Hole, Substrate, Catalyst, Link):
+            for p in ctxs[0].grid:
+                expected = dict_index.getNeighboursOfType(ctxs[0].grid[p], c)
+                actual = array_index.getNeighboursOfType(ctxs[1].grid[p], c)
+                self.assertEqual([e.point for e in expected], [e.point for e in actual])
+                self.assertTrue(all(isinstance(e, c) for e in actual))
+        for ctx in ctxs:
+            for p in ctx.grid:
+                ctx.hole_process.index.markDirty(p)
+        candidates = sorted(l.point for l in array_index.popBondCandidates())
+        self.assertEqual(sorted(l.point for l in dict_index.popBondCandidates()), candidates)
+        self.assertEqual(sorted(l.point for l in array_index.getFreeLinks()), candidates)
+        self.assertTrue(candidates)
+
+
+class TestCycleObserver(TestCase):
+    def test_incremental_matches_full_scan(self):
+        for seed in range(3):
+            results = []
+            for incremental in (True, False):
+                ctx = WorldFactory().createRandomWorld(12, [10, 80, 10], grid_random_seed=seed, max_iter=60,
+                                                       proc_random_seed=seed, disintegrate_prob=0.05)
+                if not incremental:
+                    # re-examine every cycle and link on every step
+                    ctx.cycle_observer.index.popBondChanges = lambda: None
+                exp = RunWorld(ctx, 60)
+                results.append((exp.alive_durations, ctx.cycle_observer.born, ctx.cycle_observer.cycle_size))
+            self.assertEqual(results[0], results[1])
+            self.assertTrue(results[0][0])
+
+    def test_find_cycle_on_long_membrane(self):
+        size = 400
+        # ring of links around the border of the grid, longer than the recursion limit
+        ring = [Point(x, 0) for x in range(size)] + [Point(size - 1, y) for y in range(1, size)] + \
+               [Point(x, size - 1) for x in range(size - 2, -1, -1)] + [Point(0, y) for y in range(size - 2, 0, -1)]
+        links = [Link(p, size) for p in ring]
+        for l0, l1 in zip(links, links[1:] + links[:1]):
+            l0.addBond(l1)
+            l1.addBond(l0)
+        cycle = CycleObserver.FindCycle(links[5])
+        self.assertEqual(len(ring), len(cycle))
+        self.assertEqual(CycleObserver.getCycleKey(cycle), CycleObserver.getCycleKey(CycleObserver.FindCycle(links[0])))
+        links[7].removeBond(links[8])
+        self.assertEqual([], CycleObserver.FindCycle(links[5]))
+
+    def test_cycle_keys_hold_the_cells(self):
+        size = 4
+        square = [Link(Point(x, y), size) for x, y in ((0, 0), (1, 0), (1, 1), (0, 1))]
+        other = [Link(Point(x, y), size) for x, y in ((0, 0), (1, 0), (2, 1), (1, 1))]
+        key = CycleObserver.getCycleKey(square)
+        self.assertEqual(CycleKey(0, 4, (0, 1, 4, 5)), key)
+        self.assertEqual(key, CycleObserver.getCycleKey(list(reversed(square))))
+        # same start and length, told apart by the cells rather than by a hash of them
+        other_key = CycleObserver.getCycleKey(other)
+        self.assertEqual((key.start, key.length), (other_key.start, other_key.length))
+        self.assertNotEqual(key, other_key)
+        self.assertEqual(2, len({key: 0, other_key: 1}))
+
+
+    def test_cycles_sharing_a_cell(self):
+        size = 4
+        hole_list, grid = InitGird(Hole, size)
+        ring = [Link(p, size) for p in (Point(1, 1), Point(2, 1), Point(2, 2), Point(1, 2))]
+        for l in ring:
+            grid[l.point] = l
+        for l0, l1 in zip(ring, ring[1:] + ring[:1]):
+            l0.addBond(l1)
+            l1.addBond(l0)
+        observer = CycleObserver(grid, hole_list, [], [], ring, ChooseFirstStrategy(), logging.getLogger('test'),
+                                 WorldIndex(grid, ring))
+        exp = AliveDurationExperiment()
+        observer.doStep(exp)
+        ring_key = CycleObserver.getCycleKey(ring)
+        self.assertEqual([ring_key], list(observer.cycles))
+        # an out of date cycle sharing cell (1, 1) with the ring
+        stale = [grid[p] for p in (Point(0, 0), Point(1, 0), Point(1, 1), Point(0, 1))]
+        observer._addCycle(CycleObserver.getCycleKey(stale), stale, 0)
+        observer.index._bondChanged(Point(0, 0))
+        observer.doStep(exp)
+        self.assertEqual([ring_key], list(observer.cycles))
+        self.assertEqual({ring_key}, observer._cycle_at[Point(1, 1)])
+        # a change at the shared cell alone still re-checks the ring
+        ring[0].removeBond(ring[1])
+        ring[1].removeBond(ring[0])
+        observer.index._bondChanged(Point(1, 1))
+        exp.incTime()
+        observer.doStep(exp)
+        self.assertEqual({}, observer.cycles)
+        self.assertEqual([Life(0, 1, 4)], exp.alive_durations)
+
+
+class TestElementRegistry(TestCase):
+    def test_append_remove(self):
+        holes = [Hole(Point(i, 0), 4) for i in range(4)]
+        registry = ElementRegistry(holes)
+        registry.remove(holes[1])
+        # last element takes the free slot
+        self.assertEqual([holes[0], holes[3], holes[2]], registry)
+        self.assertNotIn(holes[1], registry)
+        self.assertIn(holes[3], registry)
+        registry.append(holes[1])
+        self.assertEqual(holes[1], registry[3])
+        self.assertRaises(ValueError, registry.remove, Hole(Point(0, 1), 4))
+        self.assertEqual(4, len(ChooseFirstStrategy().shuffleList(registry)))
+
+
+class TestValidation(TestCase):
+    def test_sampled_checks(self):
+        v = Validation(VALIDATION_SAMPLED, interval=3)
+        self.assertEqual([True, False, False, True], [v.isDue(i) for i in range(4)])
+        self.assertFalse(Validation(VALIDATION_OFF).isDue(0))
+        self.assertTrue(Validation(VALIDATION_FULL).full)
+
+    def test_one_default(self):
+        ctx = WorldFactory().createRandomWorld(6, [10, 80, 10], grid_random_seed=1, max_iter=1, proc_random_seed=1,
+                                               disintegrate_prob=0.1)
+        direct = WorldContext(1, ctx.grid, ctx.hole_process, ctx.link_process, ctx.catalyst_process,
+                              ctx.production_process, ctx.disintegration_process, ctx.cycle_observer)
+        index = WorldIndex(ctx.grid, ctx.hole_process.l_list)
+        process = HoleProcess(ctx.grid, [], [], [], [], ChooseFirstStrategy(), logging.getLogger('test'), index)
+        for v in (Validation(), ctx.validation, direct.validation, process.validation, ctx.hole_process.validation):
+            self.assertEqual((VALIDATION_DEFAULT, VALIDATION_INTERVAL), (v.level, v.interval))
+        self.assertEqual(VALIDATION_SAMPLED, VALIDATION_DEFAULT)
+
+    def test_full_validation_runs(self):
+        # checkWorld after every iteration, links bonded earlier in a step must not move
+        for array_grid in (False, True):
+            for seed in range(10):
+                ctx = WorldFactory(array_grid=array_grid, validation=VALIDATION_FULL).createRandomWorld(
+                    10, [10, 80, 10], grid_random_seed=seed, max_iter=50, proc_random_seed=seed,
+                    disintegrate_prob=0.1)
+                exp = AliveDurationExperiment()
+                world_presenter.ConsolePresenter(world_viewer.NullViewer(), ctx, exp).doSimulate()
+                self.assertEqual(50, ctx.iteration)
+
+    def test_check_world(self):
+        for array_grid in (False, True):
+            ctx = WorldFactory(array_grid=array_grid).createRandomWorld(10, [10, 80, 10], grid_random_seed=4,
+                                                                        max_iter=20, proc_random_seed=5,
+                                                                        disintegrate_prob=0.1)
+            RunWorld(ctx, 20)
+            checkWorld(ctx)
+            # holes are never created or destroyed, so there is always one to drop from the list
+            h_list = ctx.hole_process.h_list
+            h = h_list[0]
+            h_list.remove(h)
+            self.assertRaisesRegex(AssertionError, 'Hole listed', checkWorld, ctx)
+            h_list.append(h)
+            checkWorld(ctx)
+
+    def test_one_sided_bond(self):
+        size = 3
+        hole_list, grid = InitGird(Hole, size)
+        l0 = Link(Point(0, 0), size)
+        l1 = Link(Point(1, 0), size)
+        for l in (l0, l1):
+            hole_list.remove(grid[l.point])
+            grid[l.point] = l
+        l0.addBond(l1)
+        self.assertEqual(['bond from Link:(0,0) to Link:(1,0) is one sided'],
+                         findInconsistencies(grid, hole_list, [], [], [l0, l1]))
+        l1.addBond(l0)
+        self.assertEqual([], findInconsistencies(grid, hole_list, [], [], [l0, l1]))
+
+
+class ListTraceSink(trace.TraceSink):
+    def __init__(self):
+        self.events = []
+
+    def write(self, event: tuple):
+        self.events.append(event)
+
+
+class TestChooseRandomStrategy(TestCase):
+    def test_same_seed_same_draws(self):
+        a = ChooseRandomStrategy(seed=11, disintegration_prob=0.5, block_size=8)
+        b = ChooseRandomStrategy(seed=11, disintegration_prob=0.5, block_size=8)
+        items = list(range(50))
+        for _ in range(20):
+            self.assertEqual(a.chooseOne(items), b.chooseOne(items))
+            self.assertEqual(a.chooseDisintegrate(), b.chooseDisintegrate())
+            self.assertEqual(a.shuffleList(items[:5]), b.shuffleList(items[:5]))
+            self.assertEqual(a.shuffleList(items), b.shuffleList(items))
+        self.assertEqual(items, sorted(a.shuffleList(items)))
+        self.assertIsNone(a.chooseOne([]))
+
+    def test_worlds_do_not_share_stream(self):
+        def create():
+            return WorldFactory().createRandomWorld(10, [10, 80, 10], grid_random_seed=2, max_iter=15,
+                                                    proc_random_seed=3, disintegrate_prob=0.05)
+
+        alone = create()
+        RunWorld(alone, 15)
+        first, second = create(), create()
+        for _ in range(15):
+            RunWorld(first, 1)
+            RunWorld(second, 1)
+        self.assertEqual(GridPrettyPrintHelper(alone.grid), GridPrettyPrintHelper(first.grid))
+        self.assertEqual(GridPrettyPrintHelper(alone.grid), GridPrettyPrintHelper(second.grid))
+
+
+class TestDisintegrationSampling(TestCase):
+    def test_default_follows_choose_disintegrate(self):
+        self.assertEqual([1, 2, 3], ChooseFirstStrategy().sampleDisintegrations([1, 2, 3]))
+
+    def test_random_sample(self):
+        chooser = ChooseRandomStrategy(seed=1, disintegration_prob=0.02)
+        items = list(range(5000))
+        sample = chooser.sampleDisintegrations(items)
+        self.assertEqual(len(sample), len(set(sample)))
+        self.assertTrue(50 < len(sample) < 150)
+        self.assertNotEqual(sorted(sample), sample)
+        self.assertEqual([], ChooseRandomStrategy(seed=1, disintegration_prob=0).sampleDisintegrations(items))
+        self.assertEqual(items, sorted(ChooseRandomStrategy(seed=1, disintegration_prob=1).sampleDisintegrations(items)))
+
+
+class TestTracing(TestCase):
+    def test_no_sink_disables_tracer(self):
+        ctx = WorldFactory().createRandomWorld(8, [10, 80, 10], grid_random_seed=1, max_iter=5, proc_random_seed=1,
+                                               disintegrate_prob=0.1)
+        self.assertFalse(ctx.tracer.enabled)
+        self.assertIs(ctx.tracer, ctx.link_process.tracer)
+
+    def test_events_reach_sink(self):
+        sink = ListTraceSink()
+        ctx = WorldFactory(trace_sink=sink).createRandomWorld(10, [10, 80, 10], grid_random_seed=4, max_iter=20,
+                                                              proc_random_seed=5, disintegrate_prob=0.1)
+        RunWorld(ctx, 20)
+        kinds = {type(e) for e in sink.events}
+        self.assertTrue({trace.SwapEvent, trace.BondEvent, trace.ProduceEvent} <= kinds)
+        for e in sink.events:
+            if isinstance(e, trace.BondEvent):
+                self.assertTrue(ctx.grid[Point(*e.first)].isNeighbour(ctx.grid[Point(*e.second)]))
+
+    def test_events_flushed_when_simulation_ends(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            path = os.path.join(out_dir, 'trace.jsonl')
+            sink = trace.JsonLinesTraceSink(path)
+            factory = WorldFactory(trace_sink=sink)
+            for seed in (1, 2):
+                ctx = factory.createRandomWorld(8, [10, 80, 10], grid_random_seed=seed, max_iter=5,
+                                                proc_random_seed=seed, disintegrate_prob=0.1)
+                world_presenter.WorldPresenter(world_viewer.NullViewer(), ctx).doSimulate()
+                with open(path) as f:
+                    iterations = [json.loads(line) for line in f if '"IterationEvent"' in line]
+                self.assertEqual(5 * seed, len(iterations))
+            sink.close()
+
+    def test_json_lines(self):
+        out = io.StringIO()
+        sink = trace.JsonLinesTraceSink(out)
+        sink.write(trace.BondEvent(Point(1, 2), Point(2, 2)))
+        sink.write(trace.CycleEvent(trace.CYCLE_FOUND, CycleKey(3, 4, (3, 4, 8, 9)), 4, 12))
+        sink.close()
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual({'event': 'BondEvent', 'first': [1, 2], 'second': [2, 2]}, lines[0])
+        self.assertEqual(['found', [3, 4, [3, 4, 8, 9]], 4, 12],
+                         [lines[1][k] for k in ('kind', 'key', 'length', 'time')])
+
+
+class TestSnapshot(TestCase):
+    def createWorld(self, array_grid: bool) -> WorldContext:
+        return WorldFactory(array_grid=array_grid).createRandomWorld(12, [10, 70, 20], grid_random_seed=5,
+                                                                     max_iter=60, proc_random_seed=9,
+                                                                     disintegrate_prob=0.05)
+
+    def assertSameWorld(self, a: WorldContext, a_exp: Experiment, b: WorldContext, b_exp: Experiment):
+        self.assertEqual(GridPrettyPrintHelper(a.grid), GridPrettyPrintHelper(b.grid))
+        self.assertEqual([l.point for l in a.link_process.l_list], [l.point for l in b.link_process.l_list])
+        self.assertEqual(a.cycle_observer.cycles, b.cycle_observer.cycles)
+        self.assertEqual(a_exp.process(), b_exp.process())
+        self.assertEqual((a.iteration, a_exp.getTime()), (b.iteration, b_exp.getTime()))
+
+    def test_restored_world_continues_identically(self):
+        for array_grid in (False, True):
+            ctx = self.createWorld(array_grid)
+            exp = RunWorld(ctx, 30)
+            out = io.BytesIO()
+            world_snapshot.saveWorld(ctx, exp, out)
+            out.seek(0)
+            restored, restored_exp = world_snapshot.loadWorld(out)
+            self.assertIsInstance(restored.grid, ArrayGrid if array_grid else dict)
+            self.assertSameWorld(ctx, exp, restored, restored_exp)
+            RunWorld(ctx, 30, exp)
+            RunWorld(restored, 30, restored_exp)
+            self.assertSameWorld(ctx, exp, restored, restored_exp)
+            checkWorld(restored)
+
+    def test_restored_random_draws(self):
+        ctx = self.createWorld(array_grid=True)
+        exp = RunWorld(ctx, 7)
+        out = io.BytesIO()
+        world_snapshot.saveWorld(ctx, exp, out)
+        out.seek(0)
+        snapshot = world_snapshot.WorldSnapshot.load(out)
+        self.assertNotIn('block', snapshot.meta['chooser'])
+        block = snapshot.arrays['random_block']
+        self.assertEqual(numpy.float64, block.dtype)
+        self.assertLess(0, len(block))
+        self.assertLess(len(block), RANDOM_BLOCK_SIZE)
+        restored, restored_exp = world_snapshot.restoreSnapshot(snapshot)
+        chooser = ctx.hole_process.chooser
+        restored_chooser = restored.hole_process.chooser
+        items = list(range(1000))
+        # past the end of the saved block, into the draws of the saved generator
+        for _ in range(RANDOM_BLOCK_SIZE + 10):
+            self.assertEqual(chooser.chooseOne(items), restored_chooser.chooseOne(items))
+        self.assertEqual(chooser.shuffleList(items), restored_chooser.shuffleList(items))
+        self.assertEqual(chooser.sampleDisintegrations(items), restored_chooser.sampleDisintegrations(items))
+
+    def test_fork_is_independent(self):
+        ctx = self.createWorld(array_grid=False)
+        exp = RunWorld(ctx, 20)
+        before = GridPrettyPrintHelper(ctx.grid)
+        fork, fork_exp = world_snapshot.forkWorld(ctx, exp, proc_random_seed=1)
+        RunWorld(fork, 20, fork_exp)
+        self.assertEqual(before, GridPrettyPrintHelper(ctx.grid))
+        self.assertEqual(40, fork.iteration)
+        self.assertNotEqual(before, GridPrettyPrintHelper(fork.grid))
+
+
+class TestStopConditions(TestCase):
+    def test_absorbing_state(self):
+        ctx = WorldFactory().createRandomWorld(8, [10, 90, 0], grid_random_seed=1, max_iter=50, proc_random_seed=1,
+                                               disintegrate_prob=0.1)
+        exp = RunWorld(ctx, 1)
+        self.assertEqual(STOP_ABSORBING, AbsorbingStateStop().check(ctx, exp))
+        ctx = WorldFactory().createRandomWorld(8, [10, 80, 10], grid_random_seed=1, max_iter=50,
+                                               proc_random_seed=1, disintegrate_prob=0.1)
+        self.assertIsNone(AbsorbingStateStop().check(ctx, RunWorld(ctx, 1)))
+
+    def test_budget_and_no_cycle(self):
+        ctx = WorldFactory().createRandomWorld(8, [10, 80, 10], grid_random_seed=1, max_iter=50, proc_random_seed=1,
+                                               disintegrate_prob=0.1)
+        exp = AliveDurationExperiment()
+        budget = BudgetStop(iterations=3)
+        no_cycle = NoCycleStop(2)
+        budget.start(ctx, exp)
+        no_cycle.start(ctx, exp)
+        RunWorld(ctx, 2, exp)
+        self.assertIsNone(budget.check(ctx, exp))
+        self.assertEqual(STOP_NO_CYCLE if not ctx.cycle_observer.cycles else None, no_cycle.check(ctx, exp))
+        RunWorld(ctx, 1, exp)
+        self.assertEqual(STOP_STEP_BUDGET, budget.check(ctx, exp))
+
+class TestInstrumentation(TestCase):
+    def createWorld(self) -> WorldContext:
+        return WorldFactory().createRandomWorld(10, [10, 70, 20], grid_random_seed=3, max_iter=25,
+                                                proc_random_seed=4, disintegrate_prob=0.05)
+
+    def test_records_every_iteration(self):
+        plain = AliveDurationExperiment()
+        world_presenter.ConsolePresenter(world_viewer.NullViewer(), self.createWorld(), plain).doSimulate()
+        out = io.StringIO()
+        instrumentation = world_metrics.Instrumentation(world_metrics.JsonLinesMetricsWriter(out))
+        exp = AliveDurationExperiment()
+        world_presenter.ConsolePresenter(world_viewer.NullViewer(), self.createWorld(), exp,
+                                         instrumentation=instrumentation).doSimulate()
+        instrumentation.close()
+        self.assertEqual(plain.process(), exp.process())
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(list(range(25)), [r['iteration'] for r in records])
+        self.assertTrue(all(r[phase] >= 0 for r in records for phase in world_metrics.PHASES))
+        self.assertEqual(sum(r['productions'] for r in records), instrumentation.count_totals['productions'])
+        self.assertGreater(instrumentation.count_totals['swaps'], 0)
+        self.assertEqual(len(exp.alive_durations), instrumentation.count_totals['cycles_broken'] +
+                         instrumentation.count_totals['cycles_discarded'])
+
+    def test_csv(self):
+        out = io.StringIO()
+        writer = world_metrics.CsvMetricsWriter(out)
+        writer.write({'iteration': 0, 'HoleProcess': 0.5, 'swaps': 2})
+        lines = out.getvalue().splitlines()
+        self.assertEqual(world_metrics.FIELDS, lines[0].split(','))
+        self.assertEqual(['0', '0.5', '0', '0'], lines[1].split(',')[:4])
+
+    def test_sweep_job_metrics(self):
+        params = (3, 4, 0.05, (10, 70, 20))
+        plain = world_presenter.runJob(params, 10, 25)
+        args = world_presenter.parseArgs(['--metrics', 'out', '--metrics-format', 'csv'])
+        self.assertEqual(('out', 'csv'), (args.metrics, args.metrics_format))
+        with tempfile.TemporaryDirectory() as out_dir:
+            for metrics_format in ('jsonl', 'csv'):
+                self.assertEqual(plain, world_presenter.runJob(params, 10, 25, metrics_dir=out_dir,
+                                                               metrics_format=metrics_format))
+                path = world_presenter.metricsPath(out_dir, params, metrics_format)
+                self.assertEqual(os.path.join(out_dir, 'g3_p4_d0.05_w10-70-20.' + metrics_format), path)
+                with open(path) as f:
+                    lines = f.read().splitlines()
+                # the csv file starts with a header line
+                self.assertEqual(25 + (metrics_format == 'csv'), len(lines))
+
+
+class TestPngViewer(TestCase):
+    def test_incremental_frames_match_full_redraw(self):
+        for array_grid, labels in ((False, False), (True, True)):
+            ctx = WorldFactory(array_grid=array_grid).createRandomWorld(12, [10, 70, 20], grid_random_seed=3,
+                                                                        max_iter=30, proc_random_seed=4,
+                                                                        disintegrate_prob=0.05)
+            renderer = png_visualiser.GridRenderer(12, 240, labels)
+            for i in range(30):
+                frame = renderer.render(ctx.grid).tobytes()
+                self.assertEqual(png_visualiser.GridRenderer(12, 240, labels).render(ctx.grid).tobytes(), frame)
+                RunWorld(ctx, 1)
+
+    def test_writes_every_frame(self):
+        ctx = WorldFactory().createRandomWorld(10, [10, 70, 20], grid_random_seed=3, max_iter=5,
+                                               proc_random_seed=4, disintegrate_prob=0.05)
+        with tempfile.TemporaryDirectory() as out_dir:
+            world_presenter.WorldPresenter(png_visualiser.PngViewer(out_dir), ctx).doSimulate()
+            self.assertEqual(sorted('out_{0}.png'.format(i) for i in range(6)), sorted(os.listdir(out_dir)))
+
+    def test_streams_animation(self):
+        ctx = WorldFactory().createRandomWorld(10, [10, 70, 20], grid_random_seed=3, max_iter=10,
+                                               proc_random_seed=4, disintegrate_prob=0.05)
+        with tempfile.TemporaryDirectory() as out_dir:
+            path = os.path.join(out_dir, 'world.gif')
+            world_presenter.WorldPresenter(png_visualiser.AnimationViewer(path, every=2), ctx).doSimulate()
+            with png_visualiser.Image.open(path) as animation:
+                self.assertEqual(6, animation.n_frames)
+                animation.seek(5)
+                last = animation.convert('RGB').tobytes()
+        self.assertEqual(png_visualiser.GridRenderer(10).render(ctx.grid).tobytes(), last)
+
+    def test_rasterize(self):
+        # cells 1 and 2 are bonded neighbours in the top row
+        types = numpy.array([HOLE, LINK, LINK, SUBSTRATE, CATALYST, LINK, HOLE, HOLE, HOLE], dtype=numpy.int8)
+        bond0 = numpy.full(9, NO_BOND, dtype=numpy.int32)
+        bond0[1], bond0[2] = 2, 1
+        bond1 = numpy.full(9, NO_BOND, dtype=numpy.int32)
+        pixels = png_visualiser.rasterize(types, bond0, bond1, 3, 1)
+        self.assertEqual([[HOLE, png_visualiser.RASTER_BONDED_LINK, png_visualiser.RASTER_BONDED_LINK],
+                          [SUBSTRATE, CATALYST, LINK], [HOLE, HOLE, HOLE]], pixels.tolist())
+        pixels = png_visualiser.rasterize(types, bond0, bond1, 3, 4)
+        self.assertEqual((12, 12), pixels.shape)
+        self.assertEqual(png_visualiser.RASTER_GRID, pixels[4, 5])
+        self.assertEqual(CATALYST, pixels[5, 5])
+        self.assertEqual(LINK, pixels[5, 9])
+        self.assertEqual([png_visualiser.RASTER_BOND] * 5, pixels[2, 6:11].tolist())
+        self.assertEqual(png_visualiser.RASTER_BONDED_LINK, pixels[1, 6])
+
+    def test_raster_frames(self):
+        frames = []
+        for array_grid in (False, True):
+            ctx = WorldFactory(array_grid=array_grid).createRandomWorld(12, [10, 70, 20], grid_random_seed=3,
+                                                                        max_iter=10, proc_random_seed=4,
+                                                                        disintegrate_prob=0.05)
+            RunWorld(ctx, 10)
+            frames.append(png_visualiser.RasterRenderer(12, 5).render(ctx.grid))
+        self.assertEqual(frames[0].tobytes(), frames[1].tobytes())
+        self.assertEqual((60, 60), frames[0].size)
+        self.assertEqual('P', frames[0].mode)
+
+
+class ScheduledViewer(world_viewer.NullViewer):
+    """Stands in for CellGridViewer, mainloop runs the scheduled callbacks in order."""
+
+    def __init__(self):
+        super().__init__()
+        self.callbacks = []
+        self.iterations = []
+
+    def updateView(self, grid: [Point, T], iteration: int):
+        self.iterations.append(iteration)
+
+    def schedule(self, delay_ms, callback):
+        self.callbacks.append(callback)
+
+    def mainloop(self):
+        while self.callbacks:
+            self.callbacks.pop(0)()
+
+
+class TestCellGrid(TestCase):
+    def createWorld(self, array_grid=False) -> WorldContext:
+        return WorldFactory(array_grid=array_grid).createRandomWorld(10, [10, 70, 20], grid_random_seed=3,
+                                                                     max_iter=20, proc_random_seed=4,
+                                                                     disintegrate_prob=0.05)
+
+    def test_cell_keys(self):
+        ctx, actx = self.createWorld(), self.createWorld(array_grid=True)
+        RunWorld(ctx, 20)
+        RunWorld(actx, 20)
+        keys = cellgrid.cellKeys(ctx.grid)
+        self.assertEqual(keys.tolist(), cellgrid.cellKeys(actx.grid).tolist())
+        for i, key in enumerate(keys.tolist()):
+            e = ctx.grid[Point(i % 10, i // 10)]
+            self.assertEqual(TYPE_CODES[type(e)] * 3 + (len(e.getAllBondedLinks()) if isinstance(e, Link) else 0),
+                             key)
+
+    def test_event_loop_matches_blocking_run(self):
+        ctx = self.createWorld()
+        world_presenter.WorldPresenter(world_viewer.NullViewer(), ctx).doSimulate()
+        view = ScheduledViewer()
+        scheduled = self.createWorld()
+        cellgrid.CellGridPresenter(view, scheduled, delay_ms=0).doSimulate()
+        self.assertEqual(list(range(21)), view.iterations)
+        self.assertEqual(getTypeCodes(ctx.grid).tolist(), getTypeCodes(scheduled.grid).tolist())
+
+
+class TestResultStore(TestCase):
+    def test_resume_needs_same_spec(self):
+        spec = {'grid_size': 10, 'max_iter': 100}
+        params = (0, 1, 0.02, (9, 90, 1))
+        with tempfile.TemporaryDirectory() as out_dir:
+            path = os.path.join(out_dir, 'results.jsonl')
+            with result_store.ResultStore(path, spec) as store:
+                store.add(params, [[3, 4]], STOP_MAX_ITER)
+            with result_store.ResultStore(path, dict(spec)) as store:
+                self.assertIn(params, store)
+                self.assertEqual(STOP_MAX_ITER, store.getStopReason(params))
+            self.assertRaises(result_store.SweepMismatchError, result_store.ResultStore, path,
+                              {'grid_size': 20, 'max_iter': 100})
+            self.assertRaises(result_store.SweepMismatchError, result_store.ResultStore, path,
+                              {'grid_size': 10, 'max_iter': 200})
+            # a store without spec line cannot be checked
+            with open(path) as f:
+                lines = f.readlines()
+            with open(path, 'w') as f:
+                f.writelines(lines[1:])
+            self.assertRaises(result_store.SweepMismatchError, result_store.ResultStore, path, spec)
+            self.assertEqual(1, len(result_store.ResultStore(path)))
+
+    def test_sweep_spec(self):
+        spec = helper.SweepSpec([0], [1], [0.02], [[9, 90, 1]], grid_size=10, iter=100, stop_no_cycle_for=20)
+        self.assertEqual({'grid_size': 10, 'max_iter': 100, 'stop_absorbing': False, 'stop_no_cycle_for': 20,
+                          'stop_seconds': None}, spec.getResultSpec())
+        with tempfile.TemporaryDirectory() as out_dir:
+            path = os.path.join(out_dir, 'results.jsonl')
+            with result_store.ResultStore(path, spec.getResultSpec()) as store:
+                store.add((0, 1, 0.02, (9, 90, 1)), [[3, 4]], STOP_MAX_ITER)
+            for changed in (dict(stop_absorbing=True), dict(stop_no_cycle_for=30), dict(stop_seconds=60.0)):
+                options = dict(grid_size=10, iter=100, stop_no_cycle_for=20)
+                options.update(changed)
+                other = helper.SweepSpec([0], [1], [0.02], [[9, 90, 1]], **options)
+                self.assertRaises(result_store.SweepMismatchError, result_store.ResultStore, path,
+                                  other.getResultSpec())
+
+    def test_torn_line_dropped(self):
+        spec = {'grid_size': 10, 'max_iter': 100}
+        with tempfile.TemporaryDirectory() as out_dir:
+            path = os.path.join(out_dir, 'results.jsonl')
+            with result_store.ResultStore(path, spec) as store:
+                store.add((0, 1, 0.02, (9, 90, 1)), [[3, 4]], STOP_MAX_ITER)
+            # a crash while the next job was written
+            with open(path, 'a') as f:
+                f.write('{"params": [1, 1, 0.02, [9, 90, 1]], "res')
+            with result_store.ResultStore(path, spec) as store:
+                self.assertEqual(1, len(store))
+                self.assertNotIn((1, 1, 0.02, (9, 90, 1)), store)
+                store.add((1, 1, 0.02, (9, 90, 1)), [[5, 6]])
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual([{'spec': spec},
+                              {'params': [0, 1, 0.02, [9, 90, 1]], 'result': [[3, 4]], 'stop': STOP_MAX_ITER},
+                              {'params': [1, 1, 0.02, [9, 90, 1]], 'result': [[5, 6]]}], records)
+            with result_store.ResultStore(path, spec) as store:
+                self.assertEqual([[5, 6]], store[1, 1, 0.02, (9, 90, 1)])
+
+    def test_load_sweep_dry_run(self):
+        spec = helper.SweepSpec.loadSweepFromFile(os.path.join(os.path.dirname(__file__), 'sweep.json'))
+        self.assertEqual(5 * 5 * 5 * 9, len(spec.getJobs()))
+        self.assertTrue(spec.stop_absorbing)
+        with tempfile.TemporaryDirectory() as out_dir:
+            path = os.path.join(out_dir, 'sweep.json')
+            with open(path, 'w') as f:
+                json.dump({'grid_seeds': [0, 1], 'proc_seeds': [1], 'disintegration_probabilities': [0.02, 0.04],
+                           'weights': [[9, 90, 1]], 'grid_size': 10, 'max_iter': 10, 'processes': 2,
+                           'stop_no_cycle_for': 5, 'results': os.path.join(out_dir, 'results.jsonl')}, f)
+            spec = helper.SweepSpec.loadSweepFromFile(path)
+            self.assertEqual([(0, 1, 0.02, (9, 90, 1)), (0, 1, 0.04, (9, 90, 1)), (1, 1, 0.02, (9, 90, 1)),
+                              (1, 1, 0.04, (9, 90, 1))], spec.getJobs())
+            self.assertEqual({'grid_size': 10, 'max_iter': 10, 'stop_absorbing': False, 'stop_no_cycle_for': 5,
+                              'stop_seconds': None}, spec.getResultSpec())
+            self.assertEqual('outputfile', spec.summary)
+            # the stop conditions do not lower the estimate
+            self.assertEqual(4 * 10 * 10 * 10, world_presenter.estimatedCellUpdates(spec, 4))
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                world_presenter.batch_run(spec, dry_run=True)
+            self.assertEqual(['4 jobs, 0 already done, 4 to run on 2 workers',
+                              'estimated cost: 4e+03 cell updates, 2e+03 per worker'], out.getvalue().splitlines())
+            self.assertFalse(os.path.exists(spec.results))
+
+    def test_batch_run_skips_stored_jobs(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            spec = helper.SweepSpec([0, 1], [1], [0.02], [[9, 90, 1]], grid_size=5, iter=10, processes=1,
+                                    results=os.path.join(out_dir, 'results.jsonl'),
+                                    summary=os.path.join(out_dir, 'summary'))
+            done = (0, 1, 0.02, (9, 90, 1))
+            with result_store.ResultStore(spec.results, spec.getResultSpec()) as store:
+                store.add(done, [[99, 99]], STOP_MAX_ITER)
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                world_presenter.batch_run(spec)
+            self.assertIn('2 jobs, 1 already done, 1 to run on 1 workers', out.getvalue())
+            with result_store.ResultStore(spec.results, spec.getResultSpec()) as store:
+                self.assertEqual(2, len(store))
+                self.assertEqual([[99, 99]], store[done])
+                params, alive, stop_reason = world_presenter.runJob((1, 1, 0.02, (9, 90, 1)), 5, 10)
+                self.assertEqual(alive, store[params])
+
+
+def RecordStartJob(params, grid_size, iter, **kwargs):
+    """A job for scheduleJobs that returns when it started instead of the alive counts.
+
+    Only the most expensive job of TestScheduler starts at once, the others
+    wait first, so it starts first only if it was handed out first.
+    """
+    if params[2] != 0.001:
+        time.sleep(0.5)
+    return params, [[time.monotonic()]], STOP_MAX_ITER
+
+
+class TestScheduler(TestCase):
+    params_list = [(0, 1, 0.1, (9, 90, 1)), (1, 1, 0.05, (9, 90, 1)), (2, 1, 0.02, (9, 90, 1)),
+                   (3, 1, 0.001, (9, 90, 1))]
+
+    def test_expected_cost(self):
+        self.assertLess(world_presenter.expectedCost((0, 1, 0.1, (9, 90, 1))),
+                        world_presenter.expectedCost((0, 1, 0.01, (9, 90, 1))))
+        self.assertLess(world_presenter.expectedCost((0, 1, 0.1, (9, 90, 1))),
+                        world_presenter.expectedCost((0, 1, 0.1, (9, 90, 5))))
+        self.assertGreaterEqual(world_presenter.availableCores(), 1)
+
+    def test_every_job_once(self):
+        results = list(world_presenter.scheduleJobs(self.params_list, 5, 10, processes=2))
+        self.assertEqual(sorted(self.params_list), sorted(params for params, alive, stop_reason in results))
+        # results come in order of completion, so match them to the jobs by their params
+        for params, alive, stop_reason in results:
+            self.assertEqual(world_presenter.runJob(params, 5, 10), (params, alive, stop_reason))
+
+    def test_longest_job_first(self):
+        results = list(world_presenter.scheduleJobs(self.params_list, 5, 10, processes=2, job=RecordStartJob))
+        self.assertEqual(sorted(self.params_list), sorted(params for params, alive, stop_reason in results))
+        started = {params: alive[0][0] for params, alive, stop_reason in results}
+        self.assertEqual(self.params_list[-1], min(started, key=started.get))
+
+
+def BenchmarkCase(grid_size, medians, total):
+    summaries = {phase: {'median': medians.get(phase, 1.0), 'mean': 1.0, 'min': 1.0} for phase in benchmark.PHASES}
+    return {'scenario': 'default', 'grid_size': grid_size, 'array_grid': True, 'phases': summaries,
+            'total': {'median': total, 'mean': total, 'min': total}}
+
+
+class TestBenchmark(TestCase):
+    def test_run_case(self):
+        for scenario in benchmark.SCENARIOS:
+            case = benchmark.runCase(scenario, 10, 1, True, warmup=1, iterations=2)
+            self.assertEqual((scenario, 10, True), benchmark.caseKey(case))
+            self.assertEqual(100, sum(case['elements'].values()))
+            self.assertEqual(benchmark.PHASES, list(case['phases']))
+            for summary in list(case['phases'].values()) + [case['total']]:
+                self.assertLessEqual(0, summary['min'])
+                self.assertLessEqual(summary['min'], summary['median'])
+
+    def test_compare(self):
+        before = {'cases': [BenchmarkCase(10, {}, 6.0)]}
+        after = {'cases': [BenchmarkCase(10, {'HoleProcess': 1.05, 'LinkProcess': 1.5}, 6.55),
+                           # not in before, not compared
+                           BenchmarkCase(50, {'LinkProcess': 9.0}, 14.0)]}
+        with contextlib.redirect_stdout(io.StringIO()):
+            regressions = benchmark.compare(before, after, 0.1)
+            self.assertEqual(1, len(regressions))
+            self.assertIn('LinkProcess', regressions[0])
+            self.assertEqual([], benchmark.compare(before, after, 0.6))
+            with tempfile.TemporaryDirectory() as out_dir:
+                before_path = os.path.join(out_dir, 'before.json')
+                after_path = os.path.join(out_dir, 'after.json')
+                for path, results in ((before_path, before), (after_path, after)):
+                    with open(path, 'w') as f:
+                        json.dump(results, f)
+                self.assertEqual(1, benchmark.main(['compare', before_path, after_path]))
+                self.assertEqual(0, benchmark.main(['compare', before_path, after_path, '--threshold', '0.6']))
+                self.assertEqual(0, benchmark.main(['compare', before_path, before_path]))
@@ -0,0 +1,114 @@
+"""
+Copyright 2020 Siddharth Priya
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""Per iteration timings and event counts of a simulation.
+
+A presenter given an Instrumentation times each of its phases and counts
+the events of the world through a CountingTraceSink. One record per
+iteration, e.g. {"iteration": 3, "HoleProcess": 0.0012, ..., "swaps": 40,
+...}, goes to a MetricsWriter. A presenter without one runs untouched.
+"""
+import csv
+import json
+from typing import IO, Dict, List, Optional, Union
+
+import world_model as world
+import world_trace as trace
+
+PHASES = ['HoleProcess', 'LinkProcess', 'CatalystProcess', 'ProductionProcess', 'DisintegrationProcess',
+          'postProcess']
+
+FIELDS = ['iteration'] + PHASES + trace.COUNTERS
+
+
+class MetricsWriter(object):
+
+    def __init__(self, out: Union[str, IO[str]]):
+        self._owned = isinstance(out, str)
+        self._out: IO[str] = open(out, 'w', newline='') if self._owned else out
+
+    def write(self, record: dict):
+        pass
+
+    def close(self):
+        if self._owned:
+            self._out.close()
+        else:
+            self._out.flush()
+
+
+class JsonLinesMetricsWriter(MetricsWriter):
+
+    def write(self, record: dict):
+        self._out.write(json.dumps(record, separators=(',', ':')))
+        self._out.write('\n')
+
+
+class CsvMetricsWriter(MetricsWriter):
+    """Writes the columns in FIELDS, with a header line."""
+
+    def __init__(self, out: Union[str, IO[str]]):
+        super().__init__(out)
+        self._writer = csv.DictWriter(self._out, FIELDS, restval=0, extrasaction='ignore')
+        self._writer.writeheader()
+
+    def write(self, record: dict):
+        self._writer.writerow(record)
+
+
+def createWriter(path: str) -> MetricsWriter:
+    """Returns a CSV writer for a .csv path and a JSON lines writer otherwise."""
+    if path.endswith('.csv'):
+        return CsvMetricsWriter(path)
+    return JsonLinesMetricsWriter(path)
+
+
+class Instrumentation(object):
+    """Collects the timings and counts of the iterations of one world."""
+
+    def __init__(self, writer: Optional[MetricsWriter] = None):
+        self.writer = writer
+        self.counter = trace.CountingTraceSink()
+        # sums over all recorded iterations
+        self.phase_totals: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+        self.count_totals: Dict[str, int] = dict.fromkeys(trace.COUNTERS, 0)
+        self.iterations: int = 0
+
+    def attach(self, ctx: world.WorldContext):
+        """Starts counting the events of ctx, this enables its tracer."""
+        ctx.tracer.addSink(self.counter)
+
+    def record(self, iteration: int, phase_times: Dict[str, float]):
+        counts = self.counter.popCounts()
+        counts.pop('iterations', None)
+        for phase, seconds in phase_times.items():
+            self.phase_totals[phase] = self.phase_totals.get(phase, 0.0) + seconds
+        for name, n in counts.items():
+            self.count_totals[name] = self.count_totals.get(name, 0) + n
+        self.iterations += 1
+        if self.writer is not None:
+            record = {'iteration': iteration}
+            record.update(phase_times)
+            record.update(counts)
+            self.writer.write(record)
+
+    def getSlowestPhases(self) -> List[str]:
+        return sorted(self.phase_totals, key=self.phase_totals.get, reverse=True)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
@@ -22,19 +22,40 @@ World model.
 This contains the definition of basic constructs like Elements and then uses
 Processes to work on those Elements.
 """
+import array
 import collections
+import collections.abc
 import itertools
 import logging
 import math
 import random
+import time
 import typing
 from typing import Dict, List, TypeVar, Optional
 
+import numpy
+
+import world_trace as trace
+
 Point = collections.namedtuple('Point', ['x', 'y'])
 Life = collections.namedtuple('Life', ['born', 'dead', 'length'])
+# smallest cell index, length and sorted cell indices of a cycle, keys of
+# different cycles mostly differ in start or length and compare unequal early
+CycleKey = collections.namedtuple('CycleKey', ['start', 'length', 'cells'])
 
 T = TypeVar('T', bound='Element')  # Declare type variable
 DISINTEGRATE_PROB = 0.1
+# invariant checking levels, see Validation
+VALIDATION_OFF = 'off'
+VALIDATION_SAMPLED = 'sampled'
+VALIDATION_FULL = 'full'
+# level and sampling interval used wherever no validation is given
+VALIDATION_DEFAULT = VALIDATION_SAMPLED
+VALIDATION_INTERVAL = 100
+# uniform numbers drawn at once by ChooseRandomStrategy
+RANDOM_BLOCK_SIZE = 4096
+# lists at least this long are shuffled with one numpy permutation
+SHUFFLE_PERMUTATION_MIN = 32
 
 
 class ChooseStrategy(object):
@@ -66,6 +87,94 @@ class ChooseStrategy(object):
         :return: True with some probability
         """
 
+    def sampleDisintegrations(self, args: [T]) -> [T]:
+        """Returns the elements of args that disintegrate, in a 'shuffled' order.
+
+        Every element is selected as if by chooseDisintegrate.
+        :param args:
+        :return:
+        """
+        return [e for e in self.shuffleList(args) if self.chooseDisintegrate()]
+
+
+class NeighbourTable(object):
+    """Neighbours of every cell of an n x n grid as flat cell indices, y * n + x.
+
+    There is one table per grid size, built once with numpy and shared by
+    all elements of that size. Row i of `moore` holds the N, E, S, W, NW,
+    NE, SE and SW neighbours of cell i, -1 where a neighbour would lie off
+    the grid, so its first four columns are the orthogonal neighbours.
+    `extended` holds the N, E, S and W cells at distance 2 the same way.
+    Queries keep that clockwise order and skip the -1 entries. moore_flat
+    and extended_flat hold the same rows back to back, 8 and 4 entries per
+    cell, as arrays that are quicker to slice from Python.
+
+    The Point of a cell is created the first time a query returns it and
+    then reused, so callers must not rely on getting new objects.
+    """
+    _tables: Dict[int, 'NeighbourTable'] = {}
+
+    # (dx, dy) of the columns of moore and extended
+    MOORE_OFFSETS = [(0, -1), (1, 0), (0, 1), (-1, 0), (-1, -1), (1, -1), (1, 1), (-1, 1)]
+    EXTENDED_OFFSETS = [(0, -2), (2, 0), (0, 2), (-2, 0)]
+
+    @staticmethod
+    def forGridSize(n: int) -> 'NeighbourTable':
+        table = NeighbourTable._tables.get(n)
+        if table is None:
+            table = NeighbourTable._tables[n] = NeighbourTable(n)
+        return table
+
+    def __init__(self, n: int):
+        self.grid_size: int = n
+        self.moore_flat = array.array('i', [-1]) * (n * n * 8)
+        self.extended_flat = array.array('i', [-1]) * (n * n * 4)
+        # numpy views sharing the memory of the flat arrays
+        self.moore: numpy.ndarray = numpy.frombuffer(self.moore_flat, dtype=numpy.int32).reshape(n * n, 8)
+        self.extended: numpy.ndarray = numpy.frombuffer(self.extended_flat, dtype=numpy.int32).reshape(n * n, 4)
+        NeighbourTable.fillTable(self.moore, n, NeighbourTable.MOORE_OFFSETS)
+        NeighbourTable.fillTable(self.extended, n, NeighbourTable.EXTENDED_OFFSETS)
+        self._points: List[Optional[Point]] = [None] * (n * n)
+
+    @staticmethod
+    def fillTable(table: numpy.ndarray, n: int, offsets: [typing.Tuple[int, int]]):
+        """Writes the cells at offsets of every cell into the columns of table, leaving -1 off the grid."""
+        y, x = numpy.divmod(numpy.arange(n * n, dtype=numpy.int32), n)
+        for column, (dx, dy) in enumerate(offsets):
+            nx = x + dx
+            ny = y + dy
+            inside = (nx >= 0) & (nx < n) & (ny >= 0) & (ny < n)
+            table[inside, column] = (ny * n + nx)[inside]
+
+    def getNeighbourCells(self, i: int) -> [int]:
+        """Returns the flat indices of the Moore neighbours of cell i."""
+        return [j for j in self.moore_flat[i * 8:i * 8 + 8] if j >= 0]
+
+    def getPoint(self, i: int) -> Point:
+        q = self._points[i]
+        if q is None:
+            q = self._points[i] = Point(i % self.grid_size, i // self.grid_size)
+        return q
+
+    def _toPoints(self, row: typing.Iterable[int]) -> [Point]:
+        points = self._points
+        return [points[j] or self.getPoint(j) for j in row if j >= 0]
+
+    def getNeighbours(self, p: Point) -> [Point]:
+        i = (p.y * self.grid_size + p.x) * 8
+        return self._toPoints(self.moore_flat[i:i + 8])
+
+    def getOrthoNeighbours(self, p: Point) -> [Point]:
+        i = (p.y * self.grid_size + p.x) * 8
+        return self._toPoints(self.moore_flat[i:i + 4])
+
+    def getExtendedNeighbours(self, p: Point) -> [Point]:
+        i = (p.y * self.grid_size + p.x) * 4
+        return self._toPoints(self.extended_flat[i:i + 4])
+
+
+_element_ids = itertools.count()
+
 
 # TODO: Do I need to mark cells as non-existent to help debugging?
 class Element(object):
@@ -85,6 +194,9 @@ class Element(object):
         assert n > p.x > -1 and n > p.y > -1
         self.point: Point = p
         self._grid_size: int = n
+        # unique for the lifetime of the process
+        self.uid: int = next(_element_ids)
+        self._neighbours: NeighbourTable = NeighbourTable.forGridSize(n)
 
     def canDisplace(self, o: T) -> bool:
         pass
@@ -93,9 +205,7 @@ class Element(object):
         return self._grid_size
 
     def isNeighbour(self, o: T) -> bool:
-        if o.point in self.getNeighbours():
-            return True
-        return False
+        return max(abs(o.point.x - self.point.x), abs(o.point.y - self.point.y)) == 1
 
     # TODO: this fn may not be needed
     def hasNeighbourOfType(self, c: typing.Type[T],
@@ -109,7 +219,6 @@ class Element(object):
 
     def getNeighboursOfType(self, c: typing.Type[T], grid: Dict[Point, T]) -> [
         T]:
-        assert self.hasNeighbourOfType(c, grid)
         nbours = self.getNeighbours()
         l = []
         for n in nbours:
@@ -119,53 +228,13 @@ class Element(object):
         return l
 
     def getNeighbours(self) -> [Point]:
-        return self._getNeighbours(1)
+        return self._neighbours.getNeighbours(self.point)
 
     def getOrthoNeighbours(self) -> [Point]:
-        return self._getNeighbours(1, ortho=True)
-
-    def _getNeighbours(self, d: int, ortho: bool = False) -> [Point]:
-        """
-
-          :return: A list of Points in 2D clockwise order
-          """
-        n = []
-        x = self.point.x
-        y = self.point.y
-
-        # north
-        if y - d >= 0:
-            n.append(Point(x, y - d))
-
-        # east
-        if x + d < self._grid_size:
-            n.append(Point(x + d, y))
-
-        # south
-        if y + d < self._grid_size:
-            n.append(Point(x, y + d))
-
-        # west
-        if x - d >= 0:
-            n.append(Point(x - d, y))
-
-        if d < 2 and not ortho:
-            # NW
-            if y - d >= 0 and x - d >= 0:
-                n.append(Point(x - d, y - d))
-            # NE
-            if y - d >= 0 and x + d < self._grid_size:
-                n.append(Point(x + d, y - d))
-            # SE
-            if y + d < self._grid_size and x + d < self._grid_size:
-                n.append(Point(x + d, y + d))
-            # SW
-            if y + d < self._grid_size and x - d >= 0:
-                n.append(Point(x - d, y + d))
-        return n
+        return self._neighbours.getOrthoNeighbours(self.point)
 
     def getExtendedNeighbours(self) -> [Point]:
-        return self._getNeighbours(2)
+        return self._neighbours.getExtendedNeighbours(self.point)
 
     def chooseNeighbour(self, chooser: ChooseStrategy) -> T:
         return chooser.chooseOne(self.getNeighbours())
@@ -179,10 +248,12 @@ class Element(object):
         return '{0}:({1},{2})'.format(self.__class__.__name__, self.point.x,
                                       self.point.y)
 
-    def __eq__(self, other):
-        if type(self) == type(other) and self.point == other.point:
-            return True
-        return False
+    # Elements compare by identity, use valueEquals to compare contents
+    def __hash__(self):
+        return self.uid
+
+    def valueEquals(self, other) -> bool:
+        return type(self) == type(other) and self.point == other.point
 
 
 class Hole(Element):
@@ -233,6 +304,8 @@ class Link(Element):
 
     def __init__(self, p: Point, n: int):
         self._bonded: ['Link'] = []
+        # grid that mirrors our bonds, see ArrayGrid
+        self._bond_observer: Optional['ArrayGrid'] = None
         super().__init__(p, n)
 
     def canDisplace(self, o):
@@ -260,15 +333,26 @@ class Link(Element):
             # TODO: log a warning here
             return
         self._bonded.append(l)
+        if self._bond_observer is not None:
+            self._bond_observer.bondsChanged(self)
 
     def removeBond(self, l: 'Link') -> bool:
         if l in self._bonded:
             self._bonded.remove(l)
+            if self._bond_observer is not None:
+                self._bond_observer.bondsChanged(self)
             l.removeBond(self)
 
     def getAllBondedLinks(self) -> ['Link']:
         return self._bonded
 
+    def setBonds(self, links: ['Link']):
+        """Replaces the bonds of this link, without any checks, when restoring a saved world."""
+        assert len(links) <= 2
+        self._bonded = list(links)
+        if self._bond_observer is not None:
+            self._bond_observer.bondsChanged(self)
+
     def getBondedLink(self, index: int) -> 'Link':
         assert -1 < index < 2
         return self._bonded[index]
@@ -293,19 +377,506 @@ class Link(Element):
                              key=lambda x: len(x.getAllBondedLinks()))
         assert other.isSinglyBonded()
         l1 = other.getBondedLink(0)
-        ortho_list = [grid[n] for n in this.getOrthoNeighbours()]
-        n_list = [grid[n] for n in this.getNeighbours()]
-        assert other in n_list
-        if other in ortho_list:
-            if l1 in ortho_list:
+        # elements are compared by cell, grid[e.point] is e for any placed element
+        ortho_list = this.getOrthoNeighbours()
+        n_list = this.getNeighbours()
+        assert other.point in n_list and grid[other.point] is other
+        if other.point in ortho_list:
+            if l1.point in ortho_list:
                 return False
         else:
-            if l1 in n_list:
+            if l1.point in n_list:
                 return False
         return True
 
+    def valueEquals(self, other) -> bool:
+        if self is other:
+            return True
+        return super().valueEquals(other) and [l.point for l in self._bonded] == [l.point for l in other._bonded]
+
+
+class ElementRegistry(collections.abc.Sequence):
+    """Ordered collection of elements with constant time append and remove.
+
+    Removing an element moves the last element into its slot, so the order
+    only depends on the sequence of operations and runs stay reproducible.
+    Membership is by identity, see Element.__hash__.
+    """
+
+    def __init__(self, elements: typing.Iterable[T] = ()):
+        self._items: List[T] = []
+        self._positions: Dict[T, int] = {}
+        for e in elements:
+            self.append(e)
+
+    def append(self, e: T):
+        assert e not in self._positions
+        self._positions[e] = len(self._items)
+        self._items.append(e)
+
+    def remove(self, e: T):
+        try:
+            i = self._positions.pop(e)
+        except KeyError:
+            raise ValueError('{0} is not registered'.format(e))
+        last = self._items.pop()
+        if last is not e:
+            self._items[i] = last
+            self._positions[last] = i
+
+    def copy(self) -> List[T]:
+        return self._items.copy()
+
+    def __contains__(self, e) -> bool:
+        return e in self._positions
+
+    def __getitem__(self, i):
+        return self._items[i]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
     def __eq__(self, other):
-        return super().__eq__(other) and self._bonded == other._bonded
+        if isinstance(other, (list, ElementRegistry)):
+            return self._items == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return 'ElementRegistry({0})'.format(self._items)
+
+
+# type codes used by the array backed grid
+HOLE = 0
+SUBSTRATE = 1
+CATALYST = 2
+LINK = 3
+TYPE_CODES = {Hole: HOLE, Substrate: SUBSTRATE, Catalyst: CATALYST, Link: LINK}
+CODE_TYPES = {code: c for c, code in TYPE_CODES.items()}
+NO_BOND = -1
+# marks cells missing from a dict grid
+EMPTY = -1
+
+
+class ArrayGrid(collections.abc.MutableMapping):
+    """Grid backend that stores cells in NumPy arrays instead of a dict.
+
+    Every cell has an int8 type code in `types` and the flat indices of its
+    bond partners in the parallel int32 arrays `bond0` and `bond1`
+    (NO_BOND if unused). The flat index of Point(x, y) is y * n + x.
+
+    Processes only ever iterate over H, K and L so only those elements are
+    kept as objects. A Substrate is created on demand when its cell is read,
+    which means two reads of the same substrate cell return equal but
+    distinct objects.
+    """
+
+    def __init__(self, grid_size: int):
+        self.grid_size: int = grid_size
+        self.types = numpy.full(grid_size * grid_size, SUBSTRATE, dtype=numpy.int8)
+        self.bond0 = numpy.full(grid_size * grid_size, NO_BOND, dtype=numpy.int32)
+        self.bond1 = numpy.full(grid_size * grid_size, NO_BOND, dtype=numpy.int32)
+        # every non substrate cell, keyed by flat index
+        self._elements: Dict[int, Element] = {}
+
+    @staticmethod
+    def fromTypeCodes(grid_size: int, codes: [int]) -> 'ArrayGrid':
+        """Build a grid from row major type codes, L must not be present."""
+        grid = ArrayGrid(grid_size)
+        grid.types[:] = codes
+        for i in numpy.flatnonzero(grid.types != SUBSTRATE).tolist():
+            c = CODE_TYPES[int(grid.types[i])]
+            assert c is not Link
+            grid._elements[i] = c(Point(i % grid_size, i // grid_size), grid_size)
+        return grid
+
+    def index(self, p: Point) -> int:
+        x, y = p
+        if not (-1 < x < self.grid_size and -1 < y < self.grid_size):
+            raise KeyError(p)
+        return y * self.grid_size + x
+
+    def __getitem__(self, p: Point) -> Element:
+        # index() inlined, this is the hottest method of the grid
+        x, y = p
+        n = self.grid_size
+        if not (-1 < x < n and -1 < y < n):
+            raise KeyError(p)
+        e = self._elements.get(y * n + x)
+        if e is None:
+            return Substrate(Point(x, y), n)
+        return e
+
+    def __setitem__(self, p: Point, e: Element):
+        i = self.index(p)
+        code = TYPE_CODES[type(e)]
+        self.types[i] = code
+        if code == SUBSTRATE:
+            self._elements.pop(i, None)
+        else:
+            self._elements[i] = e
+        if code == LINK:
+            e._bond_observer = self
+            self.bondsChanged(e)
+        else:
+            self.bond0[i] = NO_BOND
+            self.bond1[i] = NO_BOND
+
+    def __delitem__(self, p: Point):
+        raise TypeError('cells of an ArrayGrid cannot be deleted')
+
+    def __iter__(self):
+        n = self.grid_size
+        for i in range(n * n):
+            yield Point(i % n, i // n)
+
+    def __len__(self) -> int:
+        return self.grid_size * self.grid_size
+
+    def bondsChanged(self, link: Link):
+        i = self.index(link.point)
+        if self._elements.get(i) is not link:
+            # link is not placed on this grid (yet)
+            return
+        bonded = link.getAllBondedLinks()
+        self.bond0[i] = self.index(bonded[0].point) if len(bonded) > 0 else NO_BOND
+        self.bond1[i] = self.index(bonded[1].point) if len(bonded) > 1 else NO_BOND
+
+    def getElements(self) -> [Element]:
+        """Returns every non substrate element in row major order."""
+        return [self._elements[i] for i in sorted(self._elements)]
+
+    def substrates(self) -> 'CellTypeView':
+        return CellTypeView(self, SUBSTRATE)
+
+
+class CellTypeView(object):
+    """Live, list like view of all cells of one type in an ArrayGrid.
+
+    Membership is derived from the type array so `append` and `remove` only
+    check that the grid has already been updated.
+    """
+
+    def __init__(self, grid: ArrayGrid, code: int):
+        self._grid = grid
+        self._code = code
+
+    def __len__(self) -> int:
+        return int(numpy.count_nonzero(self._grid.types == self._code))
+
+    def __iter__(self):
+        n = self._grid.grid_size
+        for i in numpy.flatnonzero(self._grid.types == self._code).tolist():
+            yield self._grid[Point(i % n, i // n)]
+
+    def append(self, e: Element):
+        assert self._grid.types[self._grid.index(e.point)] == self._code
+
+    def remove(self, e: Element):
+        assert self._grid.types[self._grid.index(e.point)] != self._code
+
+
+def getTypeCodes(grid: Dict[Point, Element]) -> numpy.ndarray:
+    """Returns the type code of every cell in row major order."""
+    if isinstance(grid, ArrayGrid):
+        return grid.types
+    n = getGridSize(grid)
+    codes = numpy.full(n * n, EMPTY, dtype=numpy.int8)
+    for p, e in grid.items():
+        codes[p[1] * n + p[0]] = TYPE_CODES[type(e)]
+    return codes
+
+
+def getGridSize(grid: Dict[Point, Element]) -> int:
+    if isinstance(grid, ArrayGrid):
+        return grid.grid_size
+    for e in grid.values():
+        return e.getGridSize()
+    return 0
+
+
+def mooreSum(mask: numpy.ndarray) -> numpy.ndarray:
+    """Returns, for every cell of a 2D mask, the number of set cells in its Moore neighbourhood."""
+    padded = numpy.pad(mask.astype(numpy.uint8), 1)
+    rows, cols = mask.shape
+    total = numpy.zeros(mask.shape, dtype=numpy.uint8)
+    for dy, dx in itertools.product((-1, 0, 1), repeat=2):
+        if dy == 0 and dx == 0:
+            continue
+        total += padded[1 + dy:1 + dy + rows, 1 + dx:1 + dx + cols]
+    return total
+
+
+def countNeighbourTypes(grid: Dict[Point, Element]) -> numpy.ndarray:
+    """Returns the number of neighbours of each type for every cell, see WorldIndex."""
+    n = getGridSize(grid)
+    types = getTypeCodes(grid).reshape(n, n)
+    counts = numpy.zeros((n, n, len(TYPE_CODES)), dtype=numpy.uint8)
+    for code in CODE_TYPES:
+        counts[:, :, code] = mooreSum(types == code)
+    return counts.reshape(-1)
+
+
+class WorldIndex(object):
+    """Incrementally maintained indexes over one world.
+
+    All processes of a world share one index, WorldFactory.createProcesses
+    hands the same one to each, and report every change they make to the
+    grid, the links and the bonds, so lookups never rescan the whole world.
+
+    For every cell the index counts the neighbours of each type, stored as
+    `counts[flat index * 4 + type code]`.
+    """
+
+    def __init__(self, grid: Dict[Point, Element], link_list: [Link]):
+        self.grid: Dict[Point, Element] = grid
+        self.grid_size: int = getGridSize(grid)
+        self._neighbours: NeighbourTable = NeighbourTable.forGridSize(self.grid_size)
+        self._counts = array.array('B', countNeighbourTypes(grid).tobytes())
+        # numpy view sharing the memory of _counts
+        self._counts_view: numpy.ndarray = numpy.frombuffer(self._counts, dtype=numpy.uint8)
+        # free links in a reproducible order
+        self._free_links: Dict[Link, None] = dict.fromkeys(l for l in link_list if l.isFree())
+        # cells whose neighbourhood changed since the last bonding pass
+        self._dirty: typing.Set[Point] = set()
+        self._all_dirty: bool = True
+        # cells whose bonds changed since the last cycle observation, None if all did
+        self._bond_changes: Optional[typing.Set[Point]] = None
+
+    def getFreeLinks(self) -> [Link]:
+        return list(self._free_links)
+
+    def countNeighboursOfType(self, e: Element, c: typing.Type[T]) -> int:
+        return self._counts[(e.point.y * self.grid_size + e.point.x) * 4 + TYPE_CODES[c]]
+
+    def hasNeighbourOfType(self, e: Element, c: typing.Type[T]) -> bool:
+        return self._counts[(e.point.y * self.grid_size + e.point.x) * 4 + TYPE_CODES[c]] > 0
+
+    def selectWithNeighbourOfType(self, elements: typing.Sequence[T], c: typing.Type[T]) -> [T]:
+        """Returns the elements having a neighbour of type c, ordered by cell.
+
+        All elements must be of one type. On an ArrayGrid the cells are found
+        with one mask over the type array and the neighbour counts.
+        """
+        if not elements:
+            return []
+        n = self.grid_size
+        if isinstance(self.grid, ArrayGrid):
+            code = TYPE_CODES[type(elements[0])]
+            cells = numpy.flatnonzero((self.grid.types == code) & (self._counts_view[TYPE_CODES[c]::4] > 0))
+            return [self.grid[Point(i % n, i // n)] for i in cells.tolist()]
+        selected = [e for e in elements if self.hasNeighbourOfType(e, c)]
+        selected.sort(key=lambda e: e.point.y * n + e.point.x)
+        return selected
+
+    def getNeighboursOfType(self, e: Element, c: typing.Type[T]) -> [T]:
+        if not self.hasNeighbourOfType(e, c):
+            return []
+        if isinstance(self.grid, ArrayGrid):
+            # only read the cells of type c, see popBondCandidates
+            types = self.grid.types
+            code = TYPE_CODES[c]
+            n = self.grid_size
+            return [self.grid[q] for q in e.getNeighbours() if types[q.y * n + q.x] == code]
+        l = []
+        for n in e.getNeighbours():
+            n_o = self.grid[n]
+            if isinstance(n_o, c):
+                l.append(n_o)
+        return l
+
+    def _cellChanged(self, p: Point, old: int, new: int):
+        counts = self._counts
+        k = (p.y * self.grid_size + p.x) * 8
+        for j in self._neighbours.moore_flat[k:k + 8]:
+            if j >= 0:
+                i = j * 4
+                counts[i + old] -= 1
+                counts[i + new] += 1
+
+    def popBondCandidates(self) -> [Link]:
+        """Returns the free links that may be able to bond and forgets the changes.
+
+        A free link that could not bond during the previous pass can only bond
+        once something in its Moore neighbourhood has changed.
+        """
+        if self._all_dirty:
+            self._all_dirty = False
+            self._dirty.clear()
+            return self.getFreeLinks()
+        n = self.grid_size
+        table = self._neighbours
+        # dirty neighbourhoods overlap, every cell is read once
+        cells: typing.Set[int] = set()
+        for p in self._dirty:
+            i = p.y * n + p.x
+            cells.add(i)
+            cells.update(table.getNeighbourCells(i))
+        self._dirty.clear()
+        ordered = sorted(cells)
+        if isinstance(self.grid, ArrayGrid):
+            # the type array is checked first, reading a substrate cell creates an element
+            ordered = numpy.asarray(ordered, dtype=numpy.int64)
+            ordered = ordered[self.grid.types[ordered] == LINK].tolist()
+        candidates = []
+        for i in ordered:
+            e = self.grid[table.getPoint(i)]
+            if isinstance(e, Link) and e.isFree():
+                candidates.append(e)
+        return candidates
+
+    def popBondChanges(self) -> Optional[typing.Set[Point]]:
+        """Returns the cells whose bonds changed since the last call, None means every cell."""
+        changes = self._bond_changes
+        self._bond_changes = set()
+        return changes
+
+    def getState(self) -> dict:
+        """Returns the changes tracked by the index, by flat cell index."""
+        n = self.grid_size
+        return {'free_links': [l.point.y * n + l.point.x for l in self._free_links],
+                'dirty': sorted(p.y * n + p.x for p in self._dirty),
+                'all_dirty': self._all_dirty,
+                'bond_changes': None if self._bond_changes is None else sorted(
+                    p.y * n + p.x for p in self._bond_changes)}
+
+    def setState(self, state: dict):
+        n = self.grid_size
+        self._free_links = dict.fromkeys(self.grid[Point(i % n, i // n)] for i in state['free_links'])
+        self._dirty = {Point(i % n, i // n) for i in state['dirty']}
+        self._all_dirty = state['all_dirty']
+        changes = state['bond_changes']
+        self._bond_changes = None if changes is None else {Point(i % n, i // n) for i in changes}
+
+    def _bondChanged(self, p: Point):
+        if self._bond_changes is not None:
+            self._bond_changes.add(p)
+
+    def markDirty(self, p: Point):
+        self._dirty.add(p)
+
+    def swapped(self, this: Element, other: Element):
+        """Called once this and other have swapped places."""
+        self._dirty.add(this.point)
+        self._dirty.add(other.point)
+        a = TYPE_CODES[type(this)]
+        b = TYPE_CODES[type(other)]
+        if a != b:
+            self._cellChanged(this.point, b, a)
+            self._cellChanged(other.point, a, b)
+
+    def bonded(self, l1: Link, l2: Link):
+        for l in (l1, l2):
+            self._free_links.pop(l, None)
+            self._dirty.add(l.point)
+            self._bondChanged(l.point)
+
+    def unbonded(self, l1: Link, l2: Link):
+        for l in (l1, l2):
+            if l.isFree():
+                self._free_links[l] = None
+            self._dirty.add(l.point)
+            self._bondChanged(l.point)
+
+    def produced(self, s: Substrate, link: Link):
+        """Called once link has replaced s on the grid."""
+        if link.isFree():
+            self._free_links[link] = None
+        self._dirty.add(link.point)
+        self._cellChanged(link.point, SUBSTRATE, LINK)
+
+    def disintegrated(self, link: Link, s: Substrate):
+        """Called once s has replaced link on the grid."""
+        self._free_links.pop(link, None)
+        self._dirty.add(s.point)
+        self._bondChanged(s.point)
+        self._cellChanged(s.point, LINK, SUBSTRATE)
+
+
+class Validation(object):
+    """How much invariant checking the processes of a world do.
+
+    VALIDATION_OFF checks nothing, VALIDATION_SAMPLED checks bond symmetry on
+    every `interval`th step of each process and VALIDATION_FULL checks it on
+    every step, re-checks bond angles before bonding and lets the presenter
+    run checkWorld after every iteration.
+
+    Validation(), WorldFactory and WorldContext all default to
+    VALIDATION_DEFAULT, sampling every VALIDATION_INTERVAL steps.
+    """
+
+    def __init__(self, level: str = VALIDATION_DEFAULT, interval: int = VALIDATION_INTERVAL):
+        assert level in (VALIDATION_OFF, VALIDATION_SAMPLED, VALIDATION_FULL)
+        assert interval > 0
+        self.level: str = level
+        self.interval: int = interval
+
+    @property
+    def full(self) -> bool:
+        return self.level == VALIDATION_FULL
+
+    def isDue(self, step: int) -> bool:
+        if self.level == VALIDATION_SAMPLED:
+            return step % self.interval == 0
+        return self.level == VALIDATION_FULL
+
+
+def findInconsistencies(grid: Dict[Point, Element], hole_list: [Hole], substrate_list: [Substrate],
+                        catalyst_list: [Catalyst], link_list: [Link], index: Optional[WorldIndex] = None) -> [str]:
+    """Checks the whole world and returns a description of every broken invariant."""
+    problems = []
+    n = getGridSize(grid)
+    if len(grid) != n * n:
+        problems.append('grid has {0} cells, expected {1}'.format(len(grid), n * n))
+    for p, e in grid.items():
+        if e.point != p:
+            problems.append('{0} is stored at {1}'.format(e, p))
+    type_counts = collections.Counter(type(e) for e in grid.values())
+    for c, elements in ((Hole, hole_list), (Substrate, substrate_list), (Catalyst, catalyst_list),
+                        (Link, link_list)):
+        if len(elements) != type_counts[c]:
+            problems.append('{0} {1} listed, {2} on the grid'.format(len(elements), c.__name__, type_counts[c]))
+        if isinstance(elements, CellTypeView):
+            # substrates of an ArrayGrid are created on demand
+            continue
+        for e in elements:
+            if grid.get(e.point) is not e:
+                problems.append('{0} is listed but not on the grid'.format(e))
+    for l in link_list:
+        bonded = l.getAllBondedLinks()
+        if len(bonded) > 2 or len(set(bonded)) != len(bonded):
+            problems.append('{0} has bonds {1}'.format(l, bonded))
+        for b in bonded:
+            if not isinstance(b, Link) or grid.get(b.point) is not b:
+                problems.append('{0} is bonded to {1} which is not on the grid'.format(l, b))
+            elif not l.isNeighbour(b):
+                problems.append('{0} is bonded to {1} which is not a neighbour'.format(l, b))
+            elif l not in b.getAllBondedLinks():
+                problems.append('bond from {0} to {1} is one sided'.format(l, b))
+    if isinstance(grid, ArrayGrid):
+        for l in link_list:
+            if not isinstance(grid.get(l.point), Link):
+                continue
+            i = grid.index(l.point)
+            expected = [grid.index(b.point) for b in l.getAllBondedLinks()] + [NO_BOND, NO_BOND]
+            if [grid.bond0[i], grid.bond1[i]] != expected[:2]:
+                problems.append('bond arrays of {0} do not match its bonds'.format(l))
+    if index is not None:
+        if index._counts.tobytes() != countNeighbourTypes(grid).tobytes():
+            problems.append('neighbour type counts are stale')
+        if set(index.getFreeLinks()) != {l for l in link_list if l.isFree()}:
+            problems.append('free link index is stale')
+    return problems
+
+
+def checkWorld(ctx: 'WorldContext'):
+    """Raises an AssertionError listing every broken invariant of the world."""
+    p = ctx.hole_process
+    problems = findInconsistencies(ctx.grid, p.h_list, p.s_list, p.k_list, p.l_list, p.index)
+    if problems:
+        raise AssertionError('inconsistent world:\n' + '\n'.join(problems))
 
 
 # base class for creating the overall algorithm
@@ -318,7 +889,16 @@ class Process(object):
                  catalyst_list: List[Catalyst],
                  link_list: [List],
                  choose_strategy: ChooseStrategy,
-                 logger: logging.Logger):
+                 logger: logging.Logger,
+                 index: 'WorldIndex',
+                 validation: Optional['Validation'] = None,
+                 tracer: Optional[trace.EventTracer] = None):
+        """
+        :param index: world index shared with all other processes of the world,
+        a process with an index of its own would miss their changes
+        :param validation: invariant checks to run, defaults to Validation()
+        :param tracer: receives the events of the world, defaults to logging them to logger
+        """
         self.grid: Dict[Point, Element] = grid
         self.h_list: List[Hole] = hole_list
         self.s_list: List[substrate_list] = substrate_list
@@ -326,22 +906,37 @@ class Process(object):
         self.l_list: List[Link] = link_list
         self.chooser: ChooseStrategy = choose_strategy
         self.logger: logging.Logger = logger
+        self.index: WorldIndex = index
+        self.validation: Validation = validation if validation is not None else Validation()
+        self.tracer: trace.EventTracer = tracer if tracer is not None else trace.EventTracer.forLogger(logger)
+        self._steps: int = 0
+
+    def getState(self) -> dict:
+        return {'steps': self._steps}
+
+    def setState(self, state: dict):
+        self._steps = state['steps']
 
     def doSwap(self, this: Element, other: Element):
-        self.logger.debug('Swapping {0} and {1}'.format(this, other))
+        if self.tracer.enabled:
+            self.tracer.emit(trace.SwapEvent(type(this).__name__, this.point, type(other).__name__, other.point))
         temp = self.grid[this.point]
         self.grid[this.point] = other
         self.grid[other.point] = temp
         this.swap(other)
+        self.index.swapped(this, other)
 
     def checkBondAngle(self, l1: Link, l2: Link):
         return l1.isBondingAngleOk(l2, self.grid) and l2.isBondingAngleOk(l1, self.grid)
 
     def dobondTwo(self, l1: Link, l2: Link):
-        self.logger.debug('Bonding {0} and {1}'.format(l1, l2))
-        assert l1.isBondingAngleOk(l2, self.grid) and l2.isBondingAngleOk(l1, self.grid)
+        if self.tracer.enabled:
+            self.tracer.emit(trace.BondEvent(l1.point, l2.point))
+        if self.validation.full:
+            assert l1.isBondingAngleOk(l2, self.grid) and l2.isBondingAngleOk(l1, self.grid)
         l1.addBond(l2)
         l2.addBond(l1)
+        self.index.bonded(l1, l2)
 
     def formBond(self, target: Link, m_list: [Link], n_list: [Link]):
         def bondWithFreeL(target: Link, n_list: [Link]):
@@ -377,19 +972,25 @@ class Process(object):
 
     def doBond(self):
         # 6
-        new_list = [l for l in self.l_list if l.isFree()]
+        # only free links whose neighbourhood changed since the last pass can bond
+        new_list = self.index.popBondCandidates()
         if not new_list:
             return
         for link in self.chooser.shuffleList(new_list):
             # 6.1
-            if link.hasNeighbourOfType(Link, self.grid):
-                m_list = [n for n in link.getNeighboursOfType(Link, self.grid)
-                          if n.isSinglyBonded()]
-                n_list = [n for n in link.getNeighboursOfType(Link, self.grid)
-                          if n.isFree()]
+            if self.index.hasNeighbourOfType(link, Link):
+                links = self.index.getNeighboursOfType(link, Link)
+                m_list = [n for n in links if n.isSinglyBonded()]
+                n_list = [n for n in links if n.isFree()]
                 self.formBond(link, m_list, n_list)
 
     def doStep(self):
+        step = self._steps
+        self._steps += 1
+        if self.validation.isDue(step):
+            self.checkBonds()
+
+    def checkBonds(self):
         # check grid is valid
         bonded_l_list = [l for l in self.l_list if not l.isFree()]
         for l in bonded_l_list:
@@ -402,14 +1003,14 @@ class Process(object):
     def displaceSubstrate(self, element: T, neighbour: T):
 
         # 2.321
-        if neighbour.hasNeighbourOfType(Hole, self.grid):
+        if self.index.hasNeighbourOfType(neighbour, Hole):
             neighbour_hole = self.chooser.chooseOne(
-                neighbour.getNeighboursOfType(Hole, self.grid))
+                self.index.getNeighboursOfType(neighbour, Hole))
             self.doSwap(neighbour, neighbour_hole)
             self.doSwap(element, neighbour_hole)
         # 2.322
-        elif neighbour.hasNeighbourOfType(Link, self.grid):
-            links = neighbour.getNeighboursOfType(Link, self.grid)
+        elif self.index.hasNeighbourOfType(neighbour, Link):
+            links = self.index.getNeighboursOfType(neighbour, Link)
             # remove 'this'
             links.remove(element) if element in links else None
             l = self.chooser.chooseOne([l for l in links if not l.isFree()])
@@ -417,9 +1018,8 @@ class Process(object):
                 # 2.323
                 self.doSwap(element, neighbour)
                 return
-            h = self.chooser.chooseOne([h for h in l.getNeighboursOfType(Hole,
-                                                                         self.grid)]) if l.hasNeighbourOfType(
-                Hole, self.grid) else []
+            h = self.chooser.chooseOne(self.index.getNeighboursOfType(l, Hole)) if self.index.hasNeighbourOfType(
+                l, Hole) else []
             if not h:
                 # 2.323
                 self.doSwap(element, neighbour)
@@ -475,9 +1075,10 @@ class HoleProcess(Process):
                  substrate_list: List[Substrate],
                  catalyst_list: List[Catalyst], link_list: [List],
                  choose_strategy: ChooseStrategy,
-                 logger: logging.Logger):
+                 logger: logging.Logger, index: 'WorldIndex',
+                 validation: Optional['Validation'] = None, tracer: Optional[trace.EventTracer] = None):
         super().__init__(grid, hole_list, substrate_list, catalyst_list,
-                         link_list, choose_strategy, logger)
+                         link_list, choose_strategy, logger, index, validation, tracer)
 
     def doStep(self):
         super().doStep()
@@ -490,9 +1091,8 @@ class HoleProcess(Process):
                 if n.isFree():
                     self.doSwap(hole, n)
                 # 1.32 'L is bonded, swap with extended neighbour S'
-                elif n.hasNeighbourOfType(Substrate, self.grid):
-                    s_list = [s for s in
-                              n.getNeighboursOfType(Substrate, self.grid)]
+                elif self.index.hasNeighbourOfType(n, Substrate):
+                    s_list = self.index.getNeighboursOfType(n, Substrate)
                     en_list = hole.getExtendedNeighbours()
                     # find the right extended neighbour
                     common_s = [e for e in en_list if e in s_list]
@@ -511,14 +1111,18 @@ class LinkProcess(Process):
                  substrate_list: List[Substrate],
                  catalyst_list: List[Catalyst], link_list: [List],
                  choose_strategy: ChooseStrategy,
-                 logger: logging.Logger):
+                 logger: logging.Logger, index: 'WorldIndex',
+                 validation: Optional['Validation'] = None, tracer: Optional[trace.EventTracer] = None):
         super().__init__(grid, hole_list, substrate_list, catalyst_list,
-                         link_list, choose_strategy, logger)
+                         link_list, choose_strategy, logger, index, validation, tracer)
 
     def doStep(self):
         super().doStep()
-        free_l_list = [l for l in self.l_list if l.isFree()]
+        free_l_list = self.index.getFreeLinks()
         for link in self.chooser.shuffleList(free_l_list):
+            if not link.isFree():
+                # bonded by an earlier link of this step, a bonded link must not move
+                continue
             # only choose one neighbour to operate upon
             n = self.grid[link.chooseNeighbour(self.chooser)]
             # this is best effort so don't care about return type
@@ -533,9 +1137,10 @@ class CatalystProcess(Process):
                  substrate_list: List[Substrate],
                  catalyst_list: List[Catalyst], link_list: [List],
                  choose_strategy: ChooseStrategy,
-                 logger: logging.Logger):
+                 logger: logging.Logger, index: 'WorldIndex',
+                 validation: Optional['Validation'] = None, tracer: Optional[trace.EventTracer] = None):
         super().__init__(grid, hole_list, substrate_list, catalyst_list,
-                         link_list, choose_strategy, logger)
+                         link_list, choose_strategy, logger, index, validation, tracer)
 
     def doStep(self):
         super().doStep()
@@ -575,17 +1180,20 @@ class ProductionProcess(Process):
                  substrate_list: List[Substrate],
                  catalyst_list: List[Catalyst], link_list: [List],
                  choose_strategy: ChooseStrategy,
-                 logger: logging.Logger):
+                 logger: logging.Logger, index: 'WorldIndex',
+                 validation: Optional['Validation'] = None, tracer: Optional[trace.EventTracer] = None):
         super().__init__(grid, hole_list, substrate_list, catalyst_list,
-                         link_list, choose_strategy, logger)
+                         link_list, choose_strategy, logger, index, validation, tracer)
 
     def doStep(self):
         super().doStep()
-        for catalyst in self.chooser.shuffleList(self.k_list):
+        # production only consumes S, so no other K can gain an S neighbour
+        candidates = self.index.selectWithNeighbourOfType(self.k_list, Substrate)
+        for catalyst in self.chooser.shuffleList(candidates):
             # !! Use only 1 S instead of 2 to avoid non-local effects during disintegration
             # K + S ->  K + L
-            # 4.1
-            if catalyst.hasNeighbourOfType(Substrate, self.grid):
+            # 4.1 recheck since an earlier K may have used the last S
+            if self.index.hasNeighbourOfType(catalyst, Substrate):
                 # execute action with some probability
                 if self.chooser.chooseIntegrate():
                     # 4.2
@@ -595,12 +1203,14 @@ class ProductionProcess(Process):
 
     def produce(self, catalyst):
         s = self.chooser.chooseOne(
-            catalyst.getNeighboursOfType(Substrate, self.grid))
+            self.index.getNeighboursOfType(catalyst, Substrate))
         l = Link.createlink(s.point.x, s.point.y, s.getGridSize())
-        self.logger.debug('{0} becomes {1}'.format(s, l))
+        if self.tracer.enabled:
+            self.tracer.emit(trace.ProduceEvent(catalyst.point, l.point))
         self.grid[l.point] = l
         self.l_list.append(l)
         self.s_list.remove(s)
+        self.index.produced(s, l)
         del s  # delete the substrate element
 
 
@@ -610,32 +1220,25 @@ class DisintegrationProcess(Process):
                  substrate_list: List[Substrate],
                  catalyst_list: List[Catalyst], link_list: [List],
                  choose_strategy: ChooseStrategy,
-                 logger: logging.Logger):
+                 logger: logging.Logger, index: 'WorldIndex',
+                 validation: Optional['Validation'] = None, tracer: Optional[trace.EventTracer] = None):
         super().__init__(grid, hole_list, substrate_list, catalyst_list,
-                         link_list, choose_strategy, logger)
+                         link_list, choose_strategy, logger, index, validation, tracer)
 
     def doRebond(self, p: Point):
         element = self.grid[p]
         # 7.1 start with singly bonded Ls
-        candidate_l_list = [typing.cast(Link, e) for e in
-                            element.getNeighboursOfType(Link, self.grid) if
-                            typing.cast(Link,
-                                        e).isSinglyBonded()] if element.hasNeighbourOfType(
-            Link,
-            self.grid) else []
-        free_l_list = [typing.cast(Link, e) for e in
-                       element.getNeighboursOfType(Link, self.grid) if
-                       typing.cast(Link,
-                                   e).isFree()] if element.hasNeighbourOfType(
-            Link, self.grid) else []
-
-        used_links = []
+        links = self.index.getNeighboursOfType(element, Link)
+        candidate_l_list = [l for l in links if l.isSinglyBonded()]
+        free_l_list = [l for l in links if l.isFree()]
+
+        used_links: typing.Set[Link] = set()
         while candidate_l_list:
             for c in candidate_l_list:
                 if c in used_links:
                     # if we ever reach a condition where a link is
                     # both used and available for use then likely
-                    # __eq__ fails
+                    # __hash__ fails
                     assert False
             candidate_pairs: [(Link, Link)] = itertools.combinations(
                 candidate_l_list, 2)
@@ -654,8 +1257,8 @@ class DisintegrationProcess(Process):
                     continue
                 if l0.canBond():
                     self.dobondTwo(l0, l1)
-                    used_links.append(l0)
-                    used_links.append(l1)
+                    used_links.add(l0)
+                    used_links.add(l1)
             # 7.4
             new_candidate_l_list = candidate_l_list.copy()
             if free_l_list:
@@ -668,29 +1271,35 @@ class DisintegrationProcess(Process):
             if new_candidate_l_list == candidate_l_list:
                 break
             candidate_l_list = new_candidate_l_list
+        if self.tracer.enabled and used_links:
+            self.tracer.emit(trace.RebondEvent(p, len(used_links) // 2))
 
     def doStep(self):
         super().doStep()
-        for link in self.chooser.shuffleList(self.l_list):
-            if self.chooser.chooseDisintegrate():
-                self.logger.debug('{0} is disintegrating'.format(link))
-                p = self.disintegrate(link)
-                self.doRebond(p)
+        for link in self.chooser.sampleDisintegrations(self.l_list):
+            p = self.disintegrate(link)
+            self.doRebond(p)
 
     def disintegrate(self, link):
         p = link.point
+        if self.tracer.enabled:
+            self.tracer.emit(trace.DisintegrateEvent(p))
         bb = link.getAllBondedLinks().copy()
         for bonded in bb:
             # TODO: Revisit if I have to care about return type
             # probably not since bonded is guaranteed to be in link bonded list
             # and we assume that we formed bond correctly and put link in bonded_list of bonded
             link.removeBond(bonded)
+            self.index.unbonded(link, bonded)
+            if self.tracer.enabled:
+                self.tracer.emit(trace.UnbondEvent(link.point, bonded.point))
         # disintegrate L to S
         new_s = Substrate.createsubstrate(p.x, p.y, link.getGridSize())
         self.grid[p] = new_s
         self.s_list.append(new_s)
         self.l_list.remove(
             link)  # ok to remove this since iterating through copy
+        self.index.disintegrated(link, new_s)
         # destroy L
         del link
         return p
@@ -701,138 +1310,250 @@ class CycleObserver(Process):
     def __init__(self, grid: Dict[Point, Element], hole_list: List[Hole],
                  substrate_list: List[Substrate], catalyst_list: List[Catalyst],
                  link_list: [List], choose_strategy: ChooseStrategy,
-                 logger: logging.Logger):
+                 logger: logging.Logger, index: 'WorldIndex',
+                 validation: Optional['Validation'] = None, tracer: Optional[trace.EventTracer] = None):
         super().__init__(grid, hole_list, substrate_list, catalyst_list,
-                         link_list, choose_strategy, logger)
+                         link_list, choose_strategy, logger, index, validation, tracer)
         self.min_cycle_length = 4
-        self.cycles = []
-        self.born = {}
-        self.cycle_size = {}
+        # cells of every recorded cycle in bond order
+        self.cycles: Dict[CycleKey, typing.Tuple[Point, ...]] = {}
+        self.born: Dict[CycleKey, int] = {}
+        self.cycle_size: Dict[CycleKey, int] = {}
+        # keys of the recorded cycles each cell belongs to, a cell may be in
+        # several while a recorded cycle is out of date
+        self._cycle_at: Dict[Point, typing.Set[CycleKey]] = {}
 
-    def getCycleKey(self, cycle: [Link]) -> frozenset([Point]):
-        # sort by distance from origin
-        return frozenset(sorted([i.point for i in cycle], key=lambda p: math.sqrt((p.x) ** 2 + (p.y) ** 2)))
+    @staticmethod
+    def getCycleKey(cycle: [Link]) -> CycleKey:
+        """Returns an identifier that only depends on the cells of the cycle."""
+        if not cycle:
+            return CycleKey(-1, 0, ())
+        n = cycle[0].getGridSize()
+        cells = tuple(sorted(l.point.y * n + l.point.x for l in cycle))
+        return CycleKey(cells[0], len(cells), cells)
 
     def cycEq(self, cycle1: [Link], cycle2: [Link]) -> bool:
         return self.getCycleKey(cycle1) == self.getCycleKey(cycle2)
 
     @staticmethod
-    def FindCycle(link: 'Link', visited: ['Link']) -> List['Link']:
-        if link.isFree():
-            return []
-        if link.isSinglyBonded():
-            return []
-        if len(link.getAllBondedLinks()) == 2:
-            if not link.getBondedLink(0) in visited:
-                r = CycleObserver.FindCycle(link.getBondedLink(0), visited + [link])
-            elif not link.getBondedLink(1) in visited:
-                r = CycleObserver.FindCycle(link.getBondedLink(1), visited + [link])
-            else:
-                return [link]
-            if not r:
+    def FindCycle(link: 'Link') -> List['Link']:
+        """Returns the cycle through link in bond order, [] if link is not on a cycle."""
+        cycle = []
+        visited = set()
+        while True:
+            bonded = link.getAllBondedLinks()
+            if len(bonded) != 2:
                 return []
+            cycle.append(link)
+            visited.add(link)
+            if bonded[0] not in visited:
+                link = bonded[0]
+            elif bonded[1] not in visited:
+                link = bonded[1]
             else:
-                return [link] + r
+                return cycle
+
+    def _addCycle(self, key: CycleKey, cycle: [Link], born: int):
+        self.cycles[key] = tuple(l.point for l in cycle)
+        self.born[key] = born
+        self.cycle_size[key] = len(cycle)
+        for p in self.cycles[key]:
+            self._cycle_at.setdefault(p, set()).add(key)
+
+    def _removeCycle(self, key: CycleKey):
+        for p in self.cycles.pop(key):
+            keys = self._cycle_at[p]
+            keys.discard(key)
+            if not keys:
+                del self._cycle_at[p]
+        del self.born[key]
+        del self.cycle_size[key]
+
+    def getState(self) -> dict:
+        state = super().getState()
+        n = self.index.grid_size
+        # recorded cycles in the order they were found, cells by flat index,
+        # the keys are rebuilt from the cells
+        state['cycles'] = [[[p.y * n + p.x for p in cells], self.born[key], self.cycle_size[key]]
+                           for key, cells in self.cycles.items()]
+        return state
+
+    def setState(self, state: dict):
+        super().setState(state)
+        n = self.index.grid_size
+        self.cycles, self.born, self.cycle_size, self._cycle_at = {}, {}, {}, {}
+        for cells, born, size in state['cycles']:
+            key_cells = tuple(sorted(cells))
+            key = CycleKey(key_cells[0], len(key_cells), key_cells)
+            self.cycles[key] = tuple(Point(i % n, i // n) for i in cells)
+            self.born[key] = born
+            self.cycle_size[key] = size
+            for p in self.cycles[key]:
+                self._cycle_at.setdefault(p, set()).add(key)
+
+    def _trace(self, kind: str, key: CycleKey, length: int, exp: 'Experiment'):
+        if self.tracer.enabled:
+            self.tracer.emit(trace.CycleEvent(kind, key, length, exp.getTime()))
 
     def doStep(self, exp: 'Experiment'):
         super().doStep()
+        # only cycles and links whose bonds changed since the last step can differ
+        changed = self.index.popBondChanges()
+        if changed is None:
+            touched = set(self.cycles)
+        else:
+            touched = set()
+            for p in changed:
+                touched.update(self._cycle_at.get(p, ()))
         # process existing/bad cycles
-        cycles_copy = [inner.copy() for inner in self.cycles.copy()]
-        for cycle in cycles_copy:
-            links = [e for e in [self.grid[p] for p in cycle] if isinstance(e, Link) and not typing.cast(Link,
-                                                                                                         e).canBond()]
+        for cycle in [c for c in self.cycles if c in touched]:
+            links = [e for e in [self.grid[p] for p in self.cycles[cycle]] if
+                     isinstance(e, Link) and not typing.cast(Link, e).canBond()]
             if links:
-                r = CycleObserver.FindCycle(links[0], [])
+                r = CycleObserver.FindCycle(links[0])
                 if not r:
                     b = self.born[cycle]
                     d = exp.getTime()
                     l = self.cycle_size[cycle]
                     exp.addRecord(b, d, l)
-                    self.cycles.remove(cycle)
-                    del self.born[cycle]
-                    del self.cycle_size[cycle]
-                    self.logger.info('cycle broken:{0} len:{1} iter:{2}'.format(cycle, len(cycle), exp.getTime()))
+                    self._removeCycle(cycle)
+                    self._trace(trace.CYCLE_BROKEN, cycle, l, exp)
                 elif self.getCycleKey(r) != cycle and len(r) >= self.min_cycle_length and self.getCycleKey(r) not in \
                         self.cycles:
                     # cycle has mutated but is still a cycle
-                    # Add new cycle
-                    self.cycles.append(self.getCycleKey(r))
-                    self.born[self.getCycleKey(r)] = self.born[cycle]
-                    self.cycle_size[self.getCycleKey(r)] = len(r)
-
+                    born = self.born[cycle]
                     # delete old cycle
-                    self.cycles.remove(cycle)
-                    del self.born[cycle]
-                    del self.cycle_size[cycle]
-                    self.logger.info('Repaired cycle:{0} len:{1} iter:{2}'.format(r, len(r), exp.getTime()))
+                    self._removeCycle(cycle)
+                    # Add new cycle
+                    self._addCycle(self.getCycleKey(r), r, born)
+                    self._trace(trace.CYCLE_REPAIRED, self.getCycleKey(r), len(r), exp)
                 elif self.getCycleKey(r) == cycle:
                     # nothing to do here
-                    self.logger.info('Maintained cycle:{0} len:{1} iter:{2}'.format(r,
-                                                                                    len(
-                                                                                        r), exp.getTime()))
+                    self._trace(trace.CYCLE_MAINTAINED, cycle, len(r), exp)
                 else:  # cycle length < self.min_cycle_length
                     # delete old cycle
-                    self.cycles.remove(cycle)
-                    del self.born[cycle]
-                    del self.cycle_size[cycle]
-                    self.logger.info(
-                        'cycle discarded:{0} len:{1} iter:{2}'.format(r, len(r), exp.getTime()))
+                    self._removeCycle(cycle)
+                    self._trace(trace.CYCLE_DISCARDED, cycle, len(r), exp)
             else:  # no links found
                 b = self.born[cycle]
                 d = exp.getTime()
                 l = self.cycle_size[cycle]
                 exp.addRecord(b, d, l)
-                self.cycles.remove(cycle)
-                del self.born[cycle]
-                del self.cycle_size[cycle]
-                self.logger.info('cycle broken:{0} len:{1} iter:{2}'.format(cycle, len(cycle), exp.getTime()))
-
-        # process new cycles
-        link_list = [l for l in self.l_list if
-                     len(l.getAllBondedLinks()) == 2]
+                self._removeCycle(cycle)
+                self._trace(trace.CYCLE_BROKEN, cycle, l, exp)
+
+        # process new cycles, every new cycle contains a link whose bonds changed
+        if changed is None:
+            link_list = [l for l in self.l_list if
+                         len(l.getAllBondedLinks()) == 2]
+        else:
+            link_list = [e for e in [self.grid[p] for p in sorted(changed, key=lambda p: (p.y, p.x))] if
+                         isinstance(e, Link) and len(e.getAllBondedLinks()) == 2]
         for l in link_list:
-            r = CycleObserver.FindCycle(l, [])
-            if self.getCycleKey(r) in self.cycles:
+            if l.point in self._cycle_at:
                 # we already recorded this link, goto next
                 continue
+            r = CycleObserver.FindCycle(l)
+            if self.getCycleKey(r) in self.cycles:
+                continue
             if len(r) >= self.min_cycle_length:
-                self.logger.info('Found cycle:{0} len:{1} iter:{2}'.format(r, len(r), exp.getTime()))
-                self.cycles.append(self.getCycleKey(r))
-                self.born[self.getCycleKey(r)] = exp.getTime()
-                self.cycle_size[self.getCycleKey(r)] = len(r)
+                self._addCycle(self.getCycleKey(r), r, exp.getTime())
+                self._trace(trace.CYCLE_FOUND, self.getCycleKey(r), len(r), exp)
+
 
 class ChooseRandomStrategy(ChooseStrategy):
+    """Draws from a generator owned by this strategy, so worlds sharing a
+    process do not disturb each other's random stream.
+
+    Uniform draws are taken from blocks of RANDOM_BLOCK_SIZE numbers generated
+    at once, lists of SHUFFLE_PERMUTATION_MIN or more elements are shuffled with a
+    single permutation of the generator.
+    """
 
-    def __init__(self, seed, disintegration_prob=DISINTEGRATE_PROB):
-        self._rng = random.seed(seed)
+    def __init__(self, seed, disintegration_prob=DISINTEGRATE_PROB, block_size: int = RANDOM_BLOCK_SIZE):
+        self._rng: numpy.random.Generator = numpy.random.default_rng(seed)
         self._disint_prob = disintegration_prob
+        self._block_size = block_size
+        self._block: [float] = []
+        self._pos = 0
+
+    def getState(self) -> dict:
+        return {'disintegration_prob': self._disint_prob, 'block_size': self._block_size,
+                'generator': self._rng.bit_generator.state, 'block': self._block[self._pos:]}
+
+    def setState(self, state: dict):
+        self._disint_prob = state['disintegration_prob']
+        self._block_size = state['block_size']
+        self._rng.bit_generator.state = state['generator']
+        self._block = list(state['block'])
+        self._pos = 0
+
+    def _uniform(self) -> float:
+        if self._pos == len(self._block):
+            self._block = self._rng.random(self._block_size).tolist()
+            self._pos = 0
+        u = self._block[self._pos]
+        self._pos += 1
+        return u
 
     def chooseDisintegrate(self) -> bool:
-        return random.random() < self._disint_prob
+        return self._uniform() < self._disint_prob
 
     def chooseIntegrate(self) -> bool:
-        return random.random() >= self._disint_prob
+        return self._uniform() >= self._disint_prob
 
     def chooseOne(self, args: [T]) -> Optional[T]:
         if not args:
             return None
-        return random.choice(args)
+        return args[int(self._uniform() * len(args))]
+
+    def sampleDisintegrations(self, args: [T]) -> [T]:
+        # the number of links disintegrating is binomial, they are then picked
+        # in random order
+        k = int(self._rng.binomial(len(args), self._disint_prob))
+        if k == 0:
+            return []
+        return [args[i] for i in self._rng.choice(len(args), size=k, replace=False).tolist()]
 
     def shuffleList(self, args: [T]) -> [T]:
-        return random.sample(args, k=len(args))
+        n = len(args)
+        if n >= SHUFFLE_PERMUTATION_MIN:
+            return [args[i] for i in self._rng.permutation(n).tolist()]
+        result = list(args)
+        # Fisher-Yates
+        for i in range(n - 1, 0, -1):
+            j = int(self._uniform() * (i + 1))
+            result[i], result[j] = result[j], result[i]
+        return result
 
 
 class WorldFactory(object):
 
-    def __init__(self, logging_level='WARNING'):
+    def __init__(self, logging_level='WARNING', array_grid: bool = False, validation: str = VALIDATION_DEFAULT,
+                 validation_interval: int = VALIDATION_INTERVAL, trace_sink: Optional[trace.TraceSink] = None):
+        """
+        :param logging_level: level of the 'world' logger
+        :param array_grid: if True worlds are built on an ArrayGrid instead of a dict
+        :param validation: one of VALIDATION_OFF, VALIDATION_SAMPLED and VALIDATION_FULL
+        :param validation_interval: steps between checks when sampling
+        :param trace_sink: receives the events of every world built, they are
+        also logged if the 'world' logger shows INFO. The caller owns the sink
+        and closes it once the last of these worlds is done, presenters only
+        flush it when a simulation ends
+        """
         self.logging_level = logging_level
+        self.array_grid = array_grid
+        self.validation = Validation(validation, validation_interval)
+        self.trace_sink = trace_sink
 
     def createRandomGrid(self, grid_size: int, random_seed: int = 0, weights: [int] = [9, 90, 1]) -> Dict[Point, T]:
         # this grid will not have L starting out
-        random.seed(random_seed)
+        rng = random.Random(random_seed)
         grid = {}
-        element_list = random.choices([Hole, Substrate, Catalyst], weights=weights, \
+        element_list = rng.choices([Hole, Substrate, Catalyst], weights=weights, \
                                       k=grid_size * grid_size)
+        if self.array_grid:
+            return ArrayGrid.fromTypeCodes(grid_size, [TYPE_CODES[e] for e in element_list])
         for i, e in enumerate(element_list):
             y: int = int(i / grid_size)
             x: int = i % grid_size
@@ -844,10 +1565,16 @@ class WorldFactory(object):
                    catalyst_list: [Catalyst], link_list: [Link],
                    default: typing.TypeVar(T), grid_size: int) -> Dict[
         Point, T]:
-        grid = {}
-        for j in range(grid_size):
-            for i in range(grid_size):
-                grid[Point(i, j)] = default(Point(i, j), grid_size)
+        if self.array_grid:
+            grid = ArrayGrid(grid_size)
+            if default is not Substrate:
+                for p in grid:
+                    grid[p] = default(p, grid_size)
+        else:
+            grid = {}
+            for j in range(grid_size):
+                for i in range(grid_size):
+                    grid[Point(i, j)] = default(Point(i, j), grid_size)
         for e in itertools.chain(hole_list, substrate_list, catalyst_list,
                                  link_list):
             grid[e.point] = e
@@ -859,8 +1586,12 @@ class WorldFactory(object):
         s_list = []
         k_list = []
         l_list = []
-        for p in grid.keys():
-            e = grid[p]
+        if isinstance(grid, ArrayGrid):
+            s_list = grid.substrates()
+            elements = grid.getElements()
+        else:
+            elements = grid.values()
+        for e in elements:
             if isinstance(e, Hole):
                 h_list.append(e)
             elif isinstance(e, Substrate):
@@ -879,7 +1610,8 @@ class WorldFactory(object):
             = self.createAllProcesses(grid, proc_random_seed, disintegrate_prob)
         return WorldContext(max_iter=max_iter, grid=grid, hole_process=hole_process, link_process=link_process,
                             catalyst_process=catalyst_process, production_process=prod_process,
-                            disintegration_process=disintegrate_process, cycle_observer=cycle_observer)
+                            disintegration_process=disintegrate_process, cycle_observer=cycle_observer,
+                            validation=self.validation)
 
     def createWorld(self, config: 'helper.Config'):
         grid = self.createGrid(config.h_plist,
@@ -893,7 +1625,8 @@ class WorldFactory(object):
             = self.createAllProcesses(grid, config.disintegrate_prob)
         return WorldContext(max_iter=config.iter, grid=grid, hole_process=hole_process, link_process=link_process,
                             catalyst_process=catalyst_process, production_process=prod_process,
-                            disintegration_process=disintegrate_process, cycle_observer=cycle_observer)
+                            disintegration_process=disintegrate_process, cycle_observer=cycle_observer,
+                            validation=self.validation)
 
     def createAllProcesses(self, grid, random_seed: int, disintegration_prob: float = DISINTEGRATE_PROB) -> (
             HoleProcess, LinkProcess, CatalystProcess, ProductionProcess,
@@ -901,16 +1634,29 @@ class WorldFactory(object):
         choose_strategy = ChooseRandomStrategy(seed=random_seed,
                                                disintegration_prob=
                                                disintegration_prob)
+        return self.createProcesses(grid, *self.getListsFromGrid(grid), choose_strategy)
+
+    def createProcesses(self, grid, hh: [Hole], ss: [Substrate], kk: [Catalyst], ll: [Link],
+                        choose_strategy: ChooseStrategy) -> (
+            HoleProcess, LinkProcess, CatalystProcess, ProductionProcess,
+            DisintegrationProcess, CycleObserver):
         logger = logging.getLogger('world')
         logger.setLevel(self.logging_level)
-        (hh, ss, kk, ll) = self.getListsFromGrid(grid)
-        hp = HoleProcess(grid, hh, ss, kk, ll, choose_strategy, logger)
-        lp = LinkProcess(grid, hh, ss, kk, ll, choose_strategy, logger)
-        kp = CatalystProcess(grid, hh, ss, kk, ll, choose_strategy, logger)
-        pp = ProductionProcess(grid, hh, ss, kk, ll, choose_strategy, logger)
+        # all processes share these, so they must support cheap removal
+        hh, kk, ll = ElementRegistry(hh), ElementRegistry(kk), ElementRegistry(ll)
+        if not isinstance(ss, CellTypeView):
+            ss = ElementRegistry(ss)
+        # every process must see the changes made by the others
+        index = WorldIndex(grid, ll)
+        v = self.validation
+        tracer = trace.EventTracer.forLogger(logger, self.trace_sink)
+        hp = HoleProcess(grid, hh, ss, kk, ll, choose_strategy, logger, index, v, tracer)
+        lp = LinkProcess(grid, hh, ss, kk, ll, choose_strategy, logger, index, v, tracer)
+        kp = CatalystProcess(grid, hh, ss, kk, ll, choose_strategy, logger, index, v, tracer)
+        pp = ProductionProcess(grid, hh, ss, kk, ll, choose_strategy, logger, index, v, tracer)
         dp = DisintegrationProcess(grid, hh, ss, kk, ll, choose_strategy,
-                                   logger)
-        co = CycleObserver(grid, hh, ss, kk, ll, choose_strategy, logger)
+                                   logger, index, v, tracer)
+        co = CycleObserver(grid, hh, ss, kk, ll, choose_strategy, logger, index, v, tracer)
         return hp, lp, kp, pp, dp, co
 
 
@@ -919,8 +1665,10 @@ class WorldContext(object):
     def __init__(self, max_iter: int, grid: Dict[Point, T], hole_process: HoleProcess, link_process: LinkProcess,
                  catalyst_process:
                  CatalystProcess, production_process: ProductionProcess, disintegration_process: DisintegrationProcess,
-                 cycle_observer: CycleObserver):
+                 cycle_observer: CycleObserver, validation: Optional[Validation] = None):
         self.grid = grid
+        self.validation = validation if validation is not None else Validation()
+        self.tracer: trace.EventTracer = cycle_observer.tracer
         self.cycle_observer = cycle_observer
         self.disintegration_process = disintegration_process
         self.production_process = production_process
@@ -928,12 +1676,20 @@ class WorldContext(object):
         self.link_process = link_process
         self.hole_process = hole_process
         self.max_iter = max_iter
+        # iterations simulated so far
+        self.iteration: int = 0
+
+    def getProcesses(self) -> [Process]:
+        return [self.hole_process, self.link_process, self.catalyst_process, self.production_process,
+                self.disintegration_process, self.cycle_observer]
 
 
 class Experiment(object):
 
     def __init__(self):
         self._time = 0
+        # why the simulation ended, one of the STOP_* values, None while running
+        self.stop_reason: Optional[str] = None
 
     def incTime(self):
         self._time = self._time + 1
@@ -944,6 +1700,13 @@ class Experiment(object):
     def addRecord(self, born: int, dead: int, length: int):
         pass
 
+    def getState(self) -> dict:
+        return {'time': self._time, 'stop_reason': self.stop_reason}
+
+    def setState(self, state: dict):
+        self._time = state['time']
+        self.stop_reason = state['stop_reason']
+
     def process(self):
         pass
 
@@ -957,5 +1720,92 @@ class AliveDurationExperiment(Experiment):
     def addRecord(self, born: int, dead: int, length: int):
         self.alive_durations.append(Life(born, dead, length))
 
+    def getState(self) -> dict:
+        state = super().getState()
+        state['alive_durations'] = [list(d) for d in self.alive_durations]
+        return state
+
+    def setState(self, state: dict):
+        super().setState(state)
+        self.alive_durations = [Life(*d) for d in state['alive_durations']]
+
     def process(self):
         return [(d.dead - d.born, d.length) for d in self.alive_durations]
+
+
+STOP_MAX_ITER = 'max_iter'
+STOP_ABSORBING = 'absorbing'
+STOP_NO_CYCLE = 'no_cycle'
+STOP_STEP_BUDGET = 'step_budget'
+STOP_TIME_BUDGET = 'time_budget'
+
+
+class StopCondition(object):
+    """Ends a simulation before max_iter once going on cannot change the experiment.
+
+    `check` runs after every iteration, a condition holding state is only
+    used for one world.
+    """
+
+    def start(self, ctx: WorldContext, exp: Experiment):
+        pass
+
+    def check(self, ctx: WorldContext, exp: Experiment) -> Optional[str]:
+        """Returns the reason to stop, None to go on."""
+        return None
+
+
+class AbsorbingStateStop(StopCondition):
+    """Stops once no link exists and none can be produced again.
+
+    Links only come from a catalyst next to a substrate and substrate only
+    comes from disintegrating links, so without links and without either
+    catalysts or substrate the world can never hold a cycle again.
+    """
+
+    def check(self, ctx: WorldContext, exp: Experiment) -> Optional[str]:
+        p = ctx.production_process
+        if not p.l_list and (not p.k_list or not len(p.s_list)):
+            return STOP_ABSORBING
+        return None
+
+
+class NoCycleStop(StopCondition):
+    """Stops when no cycle has been alive for the last `iterations` iterations."""
+
+    def __init__(self, iterations: int):
+        assert iterations > 0
+        self.iterations = iterations
+        self._last_cycle: int = 0
+
+    def start(self, ctx: WorldContext, exp: Experiment):
+        self._last_cycle = ctx.iteration
+
+    def check(self, ctx: WorldContext, exp: Experiment) -> Optional[str]:
+        if ctx.cycle_observer.cycles:
+            self._last_cycle = ctx.iteration
+        elif ctx.iteration - self._last_cycle >= self.iterations:
+            return STOP_NO_CYCLE
+        return None
+
+
+class BudgetStop(StopCondition):
+    """Stops after a number of iterations or seconds of wall-clock time, counted from start."""
+
+    def __init__(self, iterations: Optional[int] = None, seconds: Optional[float] = None):
+        self.iterations = iterations
+        self.seconds = seconds
+        self._first: int = 0
+        self._deadline: float = 0.0
+
+    def start(self, ctx: WorldContext, exp: Experiment):
+        self._first = ctx.iteration
+        if self.seconds is not None:
+            self._deadline = time.perf_counter() + self.seconds
+
+    def check(self, ctx: WorldContext, exp: Experiment) -> Optional[str]:
+        if self.iterations is not None and ctx.iteration - self._first >= self.iterations:
+            return STOP_STEP_BUDGET
+        if self.seconds is not None and time.perf_counter() >= self._deadline:
+            return STOP_TIME_BUDGET
+        return None
@@ -18,28 +18,37 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """Presentation logic + experiment execution logic.
 
 """
+import argparse
+import collections
+import copy
+import functools
 import itertools
 import logging
 import multiprocessing
 import os
 import pickle
 import statistics
-from typing import Dict
+import sys
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import helper
+import result_store
+import world_metrics
 import world_model as world
 import world_viewer as viewer
 
-NUM_ITERATIONS = 1000
-
-GRID_SIZE = 10
-
-NUM_PROCESS = 20
+SWEEP_PATH = 'sweep.json'
 
 
 class WorldPresenter(object):
 
-    def __init__(self, viewer: viewer.WorldViewer, context: world.WorldContext):
+    def __init__(self, viewer: viewer.WorldViewer, context: world.WorldContext,
+                 instrumentation: Optional[world_metrics.Instrumentation] = None):
+        """
+        :param instrumentation: if given, times every phase and counts the
+        events of each iteration
+        """
         self._ctx = context
         self._viewer = viewer
         self._iter = 0
@@ -51,104 +60,230 @@ class WorldPresenter(object):
         self._cycle_observer: world.CycleObserver = self._ctx.cycle_observer
         self._grid: Dict[world.Point: world.T] = self._ctx.grid
         self._iter: int = self._ctx.max_iter
+        self._instrumentation = instrumentation
+        self._phase_times: Dict[str, float] = {}
+        if instrumentation is not None:
+            instrumentation.attach(context)
 
     def _doSingleStep(self):
+        if self._instrumentation is not None:
+            self._doTimedStep()
+            return
         self._hole_process.doStep()
         self._link_process.doStep()
         self._catalyst_process.doStep()
         self._prod_process.doStep()
         self._disintegrate_process.doStep()
 
+    def _doTimedStep(self):
+        times = self._phase_times
+        for process in (self._hole_process, self._link_process, self._catalyst_process, self._prod_process,
+                        self._disintegrate_process):
+            start = time.perf_counter()
+            process.doStep()
+            times[type(process).__name__] = time.perf_counter() - start
+
     def postProcess(self):
         pass
 
-    def doSimulate(self):
-        for i in range(self._iter):
-            self._viewer.updateView(self._grid, i)
-            self._doSingleStep()
+    def checkStop(self) -> Optional[str]:
+        """Returns why the simulation should end before max_iter, None to go on."""
+        return None
+
+    def doIteration(self) -> bool:
+        """Runs the next iteration, returns False once the simulation is over.
+
+        Lets an event loop drive the simulation one iteration at a time, call
+        finishSimulation after the last one.
+        """
+        i = self._ctx.iteration
+        if i >= self._iter:
+            return False
+        tracer = self._ctx.tracer
+        if tracer.enabled:
+            tracer.emit(world.trace.IterationEvent(i))
+        self._viewer.updateView(self._grid, i)
+        self._doSingleStep()
+        if self._instrumentation is None:
             self.postProcess()
-        self._viewer.updateView(self._grid, i + 1)
+        else:
+            start = time.perf_counter()
+            self.postProcess()
+            self._phase_times['postProcess'] = time.perf_counter() - start
+            self._instrumentation.record(i, self._phase_times)
+            self._phase_times = {}
+        if self._ctx.validation.full:
+            world.checkWorld(self._ctx)
+        self._ctx.iteration = i + 1
+        return self.checkStop() is None and self._ctx.iteration < self._iter
+
+    def finishSimulation(self):
+        self._viewer.updateView(self._grid, self._ctx.iteration)
+        self._viewer.close()
+        # the sink may be shared with other worlds, so it is not closed here
+        self._ctx.tracer.flush()
+
+    def doSimulate(self):
+        # a restored world continues where it was saved
+        while self.doIteration():
+            pass
+        self.finishSimulation()
 
 
 class ConsolePresenter(WorldPresenter):
 
     def __init__(self, viewer: viewer.ConsoleViewer, config: helper.Config,
-                 exp: world.Experiment
+                 exp: world.Experiment, stop_conditions: Iterable[world.StopCondition] = (),
+                 instrumentation: Optional[world_metrics.Instrumentation] = None
                  ) -> None:
-        super().__init__(viewer, config)
+        super().__init__(viewer, config, instrumentation)
         self._experiment = exp
+        self._stop_conditions: List[world.StopCondition] = list(stop_conditions)
 
     def postProcess(self):
         self._cycle_observer.doStep(self._experiment)
         self._experiment.incTime()
 
+    def checkStop(self) -> Optional[str]:
+        for condition in self._stop_conditions:
+            reason = condition.check(self._ctx, self._experiment)
+            if reason is not None:
+                self._experiment.stop_reason = reason
+                return reason
+        return None
 
-def batch_run():
+    def doSimulate(self):
+        for condition in self._stop_conditions:
+            condition.start(self._ctx, self._experiment)
+        super().doSimulate()
+        if self._experiment.stop_reason is None and self._ctx.iteration >= self._iter:
+            self._experiment.stop_reason = world.STOP_MAX_ITER
+
+
+def batch_run(spec: helper.SweepSpec, dry_run: bool = False, metrics_dir: Optional[str] = None,
+              metrics_format: str = 'jsonl'):
+    """Runs the sweep, saving every finished job to the result store of spec.
+
+    Jobs already in the store are not run again, so an interrupted sweep
+    continues where it stopped. A store written by a sweep with other
+    settings, see SweepSpec.getResultSpec, raises SweepMismatchError.
+    With metrics_dir, every job run writes its per iteration metrics to a
+    file of its own in that directory, see metricsPath.
+    """
     logging.basicConfig(level=os.environ.get("LOGLEVEL", "WARNING"))
-    jobs = []
-    grid_seeds = range(0, 5)
-    proc_seeds = range(100, 105)
-    disint_prbs = [x / 100 for x in range(2, 12, 2)]
-    # H S K
-    weights_list = [[9 + int(i / 2), 90 - i, 1 + int(i / 2)] for i in range(0, 45, 5)]
-    result = multiprocessing.Manager().dict()
-    params_iter = [i for i in itertools.product(grid_seeds, proc_seeds, disint_prbs, weights_list)]
-    jobs_per_proc = int(len(params_iter) / NUM_PROCESS)
-
-    params_split_iter = grouper(params_iter, jobs_per_proc)
-
-    for i, params in enumerate(params_split_iter):
-        p = multiprocessing.Process(target=runSimulOnProcessor, args=(params, result, i))
-        jobs.append(p)
-
-    for job in jobs:
-        job.start()
-    for job in jobs:
-        job.join()
+    params_iter = spec.getJobs()
+    processes = spec.processes or availableCores()
+
+    with result_store.ResultStore(spec.results, spec.getResultSpec()) as result:
+        pending = [params for params in params_iter if params not in result]
+        print('{0} jobs, {1} already done, {2} to run on {3} workers'.format(
+            len(params_iter), len(params_iter) - len(pending), len(pending), processes))
+        print('estimated cost: {0:.3g} cell updates, {1:.3g} per worker'.format(
+            estimatedCellUpdates(spec, len(pending)), estimatedCellUpdates(spec, len(pending)) / processes))
+        if dry_run:
+            return
+        if metrics_dir:
+            os.makedirs(metrics_dir, exist_ok=True)
+        for params, alive, stop_reason in scheduleJobs(pending, spec.grid_size, spec.iter, processes,
+                                                       spec.createStopConditions(), metrics_dir, metrics_format):
+            result.add(params, alive, stop_reason)
+        print('stop reasons:', dict(collections.Counter(result.getStopReason(params) for params in params_iter)))
 
     result_dict = {}
     display_dict = {}
-    for prob, weights in itertools.product(disint_prbs, weights_list):
+    for prob, weights in itertools.product(spec.disint_probs, spec.weights_list):
         alive_stats = []
         size_stats = []
-        for grid_seed, proc_seed in itertools.product(grid_seeds, proc_seeds):
-            alive_stats.extend([i[0] for i in result[grid_seed, proc_seed, prob, tuple(weights)]])
-            size_stats.extend([i[1] for i in result[grid_seed, proc_seed, prob, tuple(weights)]])
-        result_dict[prob, tuple(weights)] = (alive_stats, size_stats)
-        display_dict[prob, tuple(weights)] = ((alive_stats), statistics.mean(size_stats))
+        for grid_seed, proc_seed in itertools.product(spec.grid_seeds, spec.proc_seeds):
+            alive_stats.extend([i[0] for i in result[grid_seed, proc_seed, prob, weights]])
+            size_stats.extend([i[1] for i in result[grid_seed, proc_seed, prob, weights]])
+        result_dict[prob, weights] = (alive_stats, size_stats)
+        display_dict[prob, weights] = ((alive_stats), statistics.mean(size_stats))
     print(display_dict)
-    with open('outputfile', 'wb') as fout:
+    with open(spec.summary, 'wb') as fout:
         pickle.dump(result_dict, fout)
 
 
-def grouper(iterable, n, fillvalue=None):
-    "Collect data into fixed-length chunks or blocks"
-    # grouper('ABCDEFG', 3, 'x') --> ABC DEF Gxx"
-    args = [iter(iterable)] * n
-    return itertools.zip_longest(*args, fillvalue=fillvalue)
-
-
-def runSimulOnProcessor(params, result, i):
-    factory = world.WorldFactory()
-    grid_size = GRID_SIZE
-    iter = NUM_ITERATIONS
-    view = viewer.NullViewer()
-    print('Starting job:', i)
-    # the iterator may iterate over None values so remove those
-    params = [param for param in params if param is not None]
-    for grid_seed, proc_seed, disint_prb, weights in params:
-        exp = runSimulForParam(disint_prb, factory, grid_seed, grid_size, iter, proc_seed, view, weights)
-        result[(grid_seed, proc_seed, disint_prb, tuple(weights))] = exp.process() if exp.process() else [[0, 0]]
-    print('Stopping job:', i)
-
-
-def runSimulForParam(disint_prb, factory, grid_seed, grid_size, iter, proc_seed, view, weights):
+def estimatedCellUpdates(spec: helper.SweepSpec, jobs: int) -> int:
+    """Returns an upper bound of the cells updated by running jobs jobs of spec.
+
+    Every job is counted with all spec.iter iterations, the stop conditions
+    of spec are ignored although they may end a job much earlier.
+    """
+    return jobs * spec.grid_size * spec.grid_size * spec.iter
+
+
+def availableCores() -> int:
+    """Returns the number of cores this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def expectedCost(params) -> float:
+    """Returns a relative estimate of the run time of a job.
+
+    More catalysts produce more links, and links live longer when
+    disintegration is rare, so both make a run slower.
+    """
+    grid_seed, proc_seed, disint_prb, weights = params
+    return (1 + weights[2]) / max(disint_prb, 1e-3)
+
+
+def metricsPath(metrics_dir: str, params, metrics_format: str = 'jsonl') -> str:
+    """Returns the metrics file of the job params, e.g. g0_p1_d0.02_w9-90-1.jsonl."""
+    grid_seed, proc_seed, disint_prb, weights = params
+    name = 'g{0}_p{1}_d{2}_w{3}.{4}'.format(grid_seed, proc_seed, disint_prb, '-'.join(map(str, weights)),
+                                             metrics_format)
+    return os.path.join(metrics_dir, name)
+
+
+def scheduleJobs(params_list, grid_size: int, iter: int, processes: Optional[int] = None,
+                 stop_conditions: Iterable[world.StopCondition] = (), metrics_dir: Optional[str] = None,
+                 metrics_format: str = 'jsonl', job: Optional[Callable] = None) -> Iterator[Tuple[tuple, list, str]]:
+    """Runs one simulation per (grid_seed, proc_seed, disint_prb, weights) tuple on a pool of workers.
+
+    Workers take the next task as soon as they are done, starting with the
+    longest expected ones, and results are yielded as (params, alive,
+    stop_reason) in order of completion. Every job gets its own copy of
+    stop_conditions, and with metrics_dir its own metrics file. job replaces
+    runJob and must take the same arguments.
+    """
+    jobs = sorted(params_list, key=expectedCost, reverse=True)
+    stop_conditions = list(stop_conditions)
+    with multiprocessing.Pool(processes or availableCores()) as pool:
+        yield from pool.imap_unordered(
+            functools.partial(job or runJob, grid_size=grid_size, iter=iter, stop_conditions=stop_conditions,
+                              metrics_dir=metrics_dir, metrics_format=metrics_format), jobs,
+            chunksize=1)
+
+
+def runJob(params, grid_size: int, iter: int, stop_conditions: Iterable[world.StopCondition] = (),
+           metrics_dir: Optional[str] = None, metrics_format: str = 'jsonl') -> Tuple[tuple, list, str]:
+    grid_seed, proc_seed, disint_prb, weights = params
+    instrumentation = None
+    if metrics_dir:
+        instrumentation = world_metrics.Instrumentation(
+            world_metrics.createWriter(metricsPath(metrics_dir, params, metrics_format)))
+    try:
+        exp = runSimulForParam(disint_prb, world.WorldFactory(), grid_seed, grid_size, iter, proc_seed,
+                               viewer.NullViewer(), weights, [copy.copy(c) for c in stop_conditions],
+                               instrumentation)
+    finally:
+        if instrumentation is not None:
+            instrumentation.close()
+    return params, exp.process() if exp.process() else [[0, 0]], exp.stop_reason
+
+
+def runSimulForParam(disint_prb, factory, grid_seed, grid_size, iter, proc_seed, view, weights,
+                     stop_conditions: Iterable[world.StopCondition] = (),
+                     instrumentation: Optional[world_metrics.Instrumentation] = None):
     exp = world.AliveDurationExperiment()
     ctx: world.WorldContext = factory.createRandomWorld(grid_size, weights, grid_random_seed=grid_seed,
                                                         max_iter=iter,
                                                         proc_random_seed=proc_seed,
                                                         disintegrate_prob=disint_prb)
-    wp = ConsolePresenter(view, ctx, exp)
+    wp = ConsolePresenter(view, ctx, exp, stop_conditions, instrumentation)
     wp.doSimulate()
     return exp
 
@@ -165,5 +300,27 @@ def main():
     print(exp.process())
 
 
+def parseArgs(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Run a parameter sweep of the autopoiesis world.')
+    parser.add_argument('sweep', nargs='?', default=SWEEP_PATH, help='sweep specification (default: %(default)s)')
+    parser.add_argument('-j', '--processes', type=int, help='number of workers (default: from the sweep, or all cores)')
+    parser.add_argument('-o', '--results', help='result store to write and resume from (default: from the sweep)')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='only print the number of jobs and their cost')
+    parser.add_argument('--metrics', metavar='DIR',
+                        help='write the phase timings and event counts of every iteration of each job to DIR')
+    parser.add_argument('--metrics-format', choices=['jsonl', 'csv'], default='jsonl',
+                        help='format of the metrics files (default: %(default)s)')
+    return parser.parse_args(argv)
+
+
 if __name__ == '__main__':
-    batch_run()
+    args = parseArgs()
+    sweep = helper.SweepSpec.loadSweepFromFile(args.sweep)
+    if args.processes:
+        sweep.processes = args.processes
+    if args.results:
+        sweep.results = args.results
+    try:
+        batch_run(sweep, args.dry_run, args.metrics, args.metrics_format)
+    except result_store.SweepMismatchError as e:
+        sys.exit(str(e))
@@ -0,0 +1,164 @@
+"""
+Copyright 2020 Siddharth Priya
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""Save, restore and fork running worlds.
+
+A snapshot holds everything needed to continue a world exactly as it would
+have run: the cell types, the bonds of every link, the order of the element
+lists, the random generator, the iteration counter and the state of the
+processes, the cycle observer and the experiment. Elements are stored by
+flat cell index (y * grid_size + x), the arrays, including the random
+numbers drawn but not used yet, in a compressed .npz file.
+"""
+import json
+from typing import IO, Dict, Optional, Tuple, Union
+
+import numpy
+
+import world_model as world
+
+SNAPSHOT_VERSION = 2
+
+EXPERIMENTS = {c.__name__: c for c in (world.Experiment, world.AliveDurationExperiment)}
+
+
+class WorldSnapshot(object):
+
+    def __init__(self, arrays: Dict[str, numpy.ndarray], meta: dict):
+        # types, bond0, bond1, the cells of the element lists and the random block
+        self.arrays: Dict[str, numpy.ndarray] = arrays
+        # everything else, JSON compatible
+        self.meta: dict = meta
+
+    def save(self, out: Union[str, IO[bytes]]):
+        header = numpy.frombuffer(json.dumps(self.meta).encode(), dtype=numpy.uint8)
+        numpy.savez_compressed(out, meta=header, **self.arrays)
+
+    @staticmethod
+    def load(source: Union[str, IO[bytes]]) -> 'WorldSnapshot':
+        with numpy.load(source, allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files if name != 'meta'}
+            meta = json.loads(data['meta'].tobytes().decode())
+        if meta['version'] != SNAPSHOT_VERSION:
+            raise ValueError('unsupported snapshot version {0}'.format(meta['version']))
+        return WorldSnapshot(arrays, meta)
+
+
+def _cells(elements, n: int) -> numpy.ndarray:
+    return numpy.array([e.point.y * n + e.point.x for e in elements], dtype=numpy.int32)
+
+
+def takeSnapshot(ctx: world.WorldContext, exp: world.Experiment) -> WorldSnapshot:
+    chooser = ctx.hole_process.chooser
+    if not isinstance(chooser, world.ChooseRandomStrategy):
+        raise TypeError('worlds using {0} cannot be saved'.format(type(chooser).__name__))
+    grid = ctx.grid
+    n = world.getGridSize(grid)
+    p = ctx.hole_process
+    bond0 = numpy.full(n * n, world.NO_BOND, dtype=numpy.int32)
+    bond1 = numpy.full(n * n, world.NO_BOND, dtype=numpy.int32)
+    for l in p.l_list:
+        i = l.point.y * n + l.point.x
+        bonded = l.getAllBondedLinks()
+        if len(bonded) > 0:
+            bond0[i] = bonded[0].point.y * n + bonded[0].point.x
+        if len(bonded) > 1:
+            bond1[i] = bonded[1].point.y * n + bonded[1].point.x
+    arrays = {'types': numpy.array(world.getTypeCodes(grid), dtype=numpy.int8), 'bond0': bond0, 'bond1': bond1,
+              'holes': _cells(p.h_list, n), 'catalysts': _cells(p.k_list, n), 'links': _cells(p.l_list, n)}
+    array_grid = isinstance(grid, world.ArrayGrid)
+    if not array_grid:
+        arrays['substrates'] = _cells(p.s_list, n)
+    chooser_state = chooser.getState()
+    arrays['random_block'] = numpy.array(chooser_state.pop('block'), dtype=numpy.float64)
+    meta = {'version': SNAPSHOT_VERSION, 'grid_size': n, 'array_grid': array_grid, 'max_iter': ctx.max_iter,
+            'iteration': ctx.iteration, 'chooser': chooser_state, 'index': p.index.getState(),
+            'processes': [process.getState() for process in ctx.getProcesses()],
+            'experiment': type(exp).__name__, 'experiment_state': exp.getState()}
+    return WorldSnapshot(arrays, meta)
+
+
+def restoreSnapshot(snapshot: WorldSnapshot, factory: Optional[world.WorldFactory] = None,
+                    proc_random_seed: Optional[int] = None) -> Tuple[world.WorldContext, world.Experiment]:
+    """Returns a new world and experiment in the state of snapshot.
+
+    :param factory: sets validation, logging and tracing of the new world,
+    whether it uses an ArrayGrid comes from the snapshot
+    :param proc_random_seed: if given the new world draws from a generator
+    seeded with it instead of continuing the saved one
+    """
+    factory = factory if factory is not None else world.WorldFactory()
+    meta = snapshot.meta
+    arrays = snapshot.arrays
+    n = meta['grid_size']
+    types = arrays['types'].tolist()
+    elements: Dict[int, world.Element] = {}
+    if meta['array_grid']:
+        grid = world.ArrayGrid(n)
+    else:
+        grid = {}
+    for i, code in enumerate(types):
+        if code == world.SUBSTRATE and meta['array_grid']:
+            continue
+        e = world.CODE_TYPES[code](world.Point(i % n, i // n), n)
+        grid[e.point] = e
+        elements[i] = e
+    for i in arrays['links'].tolist():
+        bonded = [b for b in (int(arrays['bond0'][i]), int(arrays['bond1'][i])) if b != world.NO_BOND]
+        elements[i].setBonds([elements[b] for b in bonded])
+
+    hh = [elements[i] for i in arrays['holes'].tolist()]
+    kk = [elements[i] for i in arrays['catalysts'].tolist()]
+    ll = [elements[i] for i in arrays['links'].tolist()]
+    ss = grid.substrates() if meta['array_grid'] else [elements[i] for i in arrays['substrates'].tolist()]
+    chooser_state = meta['chooser']
+    chooser = world.ChooseRandomStrategy(seed=proc_random_seed, disintegration_prob=chooser_state['disintegration_prob'],
+                                         block_size=chooser_state['block_size'])
+    if proc_random_seed is None:
+        chooser.setState(dict(chooser_state, block=arrays['random_block'].tolist()))
+    processes = factory.createProcesses(grid, hh, ss, kk, ll, chooser)
+    for process, state in zip(processes, meta['processes']):
+        process.setState(state)
+    processes[0].index.setState(meta['index'])
+    hole_process, link_process, catalyst_process, prod_process, disintegrate_process, cycle_observer = processes
+    ctx = world.WorldContext(max_iter=meta['max_iter'], grid=grid, hole_process=hole_process,
+                             link_process=link_process, catalyst_process=catalyst_process,
+                             production_process=prod_process, disintegration_process=disintegrate_process,
+                             cycle_observer=cycle_observer, validation=factory.validation)
+    ctx.iteration = meta['iteration']
+    exp = EXPERIMENTS[meta['experiment']]()
+    exp.setState(meta['experiment_state'])
+    return ctx, exp
+
+
+def saveWorld(ctx: world.WorldContext, exp: world.Experiment, out: Union[str, IO[bytes]]):
+    takeSnapshot(ctx, exp).save(out)
+
+
+def loadWorld(source: Union[str, IO[bytes]], factory: Optional[world.WorldFactory] = None) -> Tuple[
+        world.WorldContext, world.Experiment]:
+    return restoreSnapshot(WorldSnapshot.load(source), factory)
+
+
+def forkWorld(ctx: world.WorldContext, exp: world.Experiment, factory: Optional[world.WorldFactory] = None,
+              proc_random_seed: Optional[int] = None) -> Tuple[world.WorldContext, world.Experiment]:
+    """Returns an independent copy of a world and its experiment, without going through a file.
+
+    Without proc_random_seed the copy makes the same random draws as the
+    original, with it the copy starts a new continuation.
+    """
+    return restoreSnapshot(takeSnapshot(ctx, exp), factory, proc_random_seed)
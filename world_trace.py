@@ -0,0 +1,183 @@
+"""
+Copyright 2020 Siddharth Priya
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""
+Structured event tracing for the world model.
+
+Processes describe what they do with small typed events instead of log
+messages. An event is only built when the tracer of the world has a sink,
+so a world without sinks pays for a single attribute check per event.
+"""
+import collections
+import json
+import logging
+from typing import IO, Dict, Iterable, Optional, Union
+
+# Points are (x, y) cell coordinates, element kinds are class names
+IterationEvent = collections.namedtuple('IterationEvent', ['iteration'])
+SwapEvent = collections.namedtuple('SwapEvent', ['this', 'this_point', 'other', 'other_point'])
+BondEvent = collections.namedtuple('BondEvent', ['first', 'second'])
+UnbondEvent = collections.namedtuple('UnbondEvent', ['first', 'second'])
+ProduceEvent = collections.namedtuple('ProduceEvent', ['catalyst', 'point'])
+DisintegrateEvent = collections.namedtuple('DisintegrateEvent', ['point'])
+RebondEvent = collections.namedtuple('RebondEvent', ['point', 'bonds'])
+# kind is one of the CYCLE_* values below
+CycleEvent = collections.namedtuple('CycleEvent', ['kind', 'key', 'length', 'time'])
+
+CYCLE_FOUND = 'found'
+CYCLE_MAINTAINED = 'maintained'
+CYCLE_REPAIRED = 'repaired'
+CYCLE_DISCARDED = 'discarded'
+CYCLE_BROKEN = 'broken'
+
+
+class TraceSink(object):
+
+    def write(self, event: tuple):
+        pass
+
+    def flush(self):
+        """Pushes buffered events out, the sink stays open."""
+        pass
+
+    def close(self):
+        pass
+
+
+class EventTracer(object):
+    """Hands events to its sinks.
+
+    Callers check `enabled` before building an event, e.g.
+    `if tracer.enabled: tracer.emit(SwapEvent(...))`.
+    """
+
+    def __init__(self, sinks: Iterable[TraceSink] = ()):
+        self._sinks = list(sinks)
+        self.enabled: bool = bool(self._sinks)
+
+    @staticmethod
+    def forLogger(logger: logging.Logger, sink: Optional[TraceSink] = None) -> 'EventTracer':
+        """Returns a tracer that logs events if logger shows INFO and writes them to sink."""
+        sinks = [LoggingTraceSink(logger)] if logger.isEnabledFor(logging.INFO) else []
+        if sink is not None:
+            sinks.append(sink)
+        return EventTracer(sinks)
+
+    def addSink(self, sink: TraceSink):
+        self._sinks.append(sink)
+        self.enabled = True
+
+    def emit(self, event: tuple):
+        for sink in self._sinks:
+            sink.write(event)
+
+    def flush(self):
+        for sink in self._sinks:
+            sink.flush()
+
+    def close(self):
+        """Closes every sink, including ones other tracers share."""
+        for sink in self._sinks:
+            sink.close()
+
+
+def _cell(kind: str, p) -> str:
+    return '{0}:({1},{2})'.format(kind, p[0], p[1])
+
+
+_CYCLE_MESSAGES = {CYCLE_FOUND: 'Found cycle', CYCLE_MAINTAINED: 'Maintained cycle',
+                   CYCLE_REPAIRED: 'Repaired cycle', CYCLE_DISCARDED: 'cycle discarded',
+                   CYCLE_BROKEN: 'cycle broken'}
+
+# level and message of every event type
+_LOG_FORMATS = {
+    IterationEvent: (logging.DEBUG, lambda e: 'iter:{0}'.format(e.iteration)),
+    SwapEvent: (logging.DEBUG, lambda e: 'Swapping {0} and {1}'.format(_cell(e.this, e.this_point),
+                                                                      _cell(e.other, e.other_point))),
+    BondEvent: (logging.DEBUG, lambda e: 'Bonding {0} and {1}'.format(_cell('Link', e.first),
+                                                                     _cell('Link', e.second))),
+    UnbondEvent: (logging.DEBUG, lambda e: 'Unbonding {0} and {1}'.format(_cell('Link', e.first),
+                                                                         _cell('Link', e.second))),
+    ProduceEvent: (logging.DEBUG, lambda e: '{0} becomes {1}'.format(_cell('Substrate', e.point),
+                                                                    _cell('Link', e.point))),
+    DisintegrateEvent: (logging.DEBUG, lambda e: '{0} is disintegrating'.format(_cell('Link', e.point))),
+    RebondEvent: (logging.DEBUG, lambda e: 'Rebonded {0} bonds around ({1},{2})'.format(e.bonds, *e.point)),
+    CycleEvent: (logging.INFO, lambda e: '{0}:{1} len:{2} iter:{3}'.format(_CYCLE_MESSAGES[e.kind], e.key,
+                                                                          e.length, e.time)),
+}
+
+
+class LoggingTraceSink(TraceSink):
+    """Logs events with the messages the processes used to log."""
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+
+    def write(self, event: tuple):
+        level, message = _LOG_FORMATS[type(event)]
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, message(event))
+
+
+# counter of every event type, cycle events are counted per kind
+COUNTER_NAMES = {IterationEvent: 'iterations', SwapEvent: 'swaps', BondEvent: 'bonds', UnbondEvent: 'unbonds',
+                 ProduceEvent: 'productions', DisintegrateEvent: 'disintegrations', RebondEvent: 'rebonds'}
+CYCLE_COUNTER_NAMES = {kind: 'cycles_' + kind for kind in _CYCLE_MESSAGES}
+COUNTERS = [name for name in COUNTER_NAMES.values() if name != 'iterations'] + list(CYCLE_COUNTER_NAMES.values())
+
+
+class CountingTraceSink(TraceSink):
+    """Counts events, see COUNTERS."""
+
+    def __init__(self):
+        self.counts: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+
+    def write(self, event: tuple):
+        if type(event) is CycleEvent:
+            name = CYCLE_COUNTER_NAMES[event.kind]
+        else:
+            name = COUNTER_NAMES[type(event)]
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def popCounts(self) -> Dict[str, int]:
+        """Returns the counts since the last call and starts again from zero."""
+        counts = self.counts
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        return counts
+
+
+class JsonLinesTraceSink(TraceSink):
+    """Writes one JSON object per event, e.g. {"event": "BondEvent", "first": [1, 2], "second": [2, 2]}."""
+
+    def __init__(self, out: Union[str, IO[str]]):
+        self._owned = isinstance(out, str)
+        self._out: IO[str] = open(out, 'w') if self._owned else out
+
+    def write(self, event: tuple):
+        record = {'event': type(event).__name__}
+        record.update(event._asdict())
+        self._out.write(json.dumps(record, separators=(',', ':')))
+        self._out.write('\n')
+
+    def flush(self):
+        self._out.flush()
+
+    def close(self):
+        if self._owned:
+            self._out.close()
+        else:
+            self._out.flush()
@@ -26,6 +26,10 @@ class WorldViewer(object):
     def updateView(self, grid: [world.Point, world.T], iteration: int):
         pass
 
+    def close(self):
+        """Called once the simulation is over, e.g. to finish writing files."""
+        pass
+
 
 class ConsoleViewer(WorldViewer):
 